@@ -0,0 +1,359 @@
+"""
+A reproducible benchmark of index loading and query answering.
+
+A corpus is either made up (documents whose lemmas follow a Zipf
+distribution, from a fixed random seed) or the real one in 'tagged/'. Its
+index is saved in every format asked for; for each format the benchmark
+measures the file size, the time it takes to load the index, how much the
+process grows while loading it and answering queries, and the latency of
+every query of a query log (also made up with Zipf-distributed lemmas, or
+read from a file with one query per line). The same queries are also
+answered in batches with simple_query_many(). If NumPy is installed, the
+NumPy scoring backend is measured too.
+
+The results are written as JSON with sorted keys, so the results of two
+versions of the code can be compared with diff.
+"""
+
+import os
+import sys
+import gc
+import json
+import random
+import bisect
+import getopt
+import shutil
+import platform
+import tempfile
+from timeit import default_timer
+# modules I've written:
+import indexer
+import search_engine
+import save_and_load
+import spimi
+import numpy_scoring
+import url_table
+
+# 'numpy' is the in-memory index scored with the NumPy backend
+FORMATS = ('memory', 'xml', 'binary', 'numpy')
+
+
+def current_rss():
+    """
+    current_rss(): Return the resident set size of this process in bytes
+    (the peak one where the current one can't be read).
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return spimi.peak_rss()
+
+def percentile(sorted_values, fraction):
+    """
+    percentile(sorted_values, fraction): Return the value 'fraction' (0.0 -
+    1.0) of the way into the sorted list 'sorted_values' (nearest rank).
+    """
+    if not sorted_values:
+        return 0.0
+    rank = int(round(fraction * len(sorted_values) + 0.5)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+class ZipfSampler:
+    """Draws ranks 0 .. n-1 with probability proportional to 1/(rank+1)^s."""
+
+    def __init__(self, n, s=1.1, rng=None):
+        self._rng = rng or random.Random(0)
+        self._cumulative = []
+        total = 0.0
+        for rank in xrange(n):
+            total += 1.0 / (rank + 1) ** s
+            self._cumulative.append(total)
+        self._total = total
+
+    def sample(self):
+        """sample(self): Return a random rank."""
+        return bisect.bisect_left(self._cumulative,
+                                  self._rng.random() * self._total)
+
+
+def _lemma(rank):
+    return 'w' + str(rank)
+
+def synthetic_corpus(num_docs, vocabulary=20000, doc_length=300, s=1.1,
+                     seed=0):
+    """
+    synthetic_corpus(num_docs, vocabulary=20000, doc_length=300, s=1.1,
+    seed=0): Yield (id, {lemma: tf}, length) for 'num_docs' made-up 
+    documents of about 'doc_length' words drawn from 'vocabulary' lemmas 
+    with a Zipf distribution of exponent 's'. The same arguments give the 
+    same corpus.
+    """
+    rng = random.Random(seed)
+    sampler = ZipfSampler(vocabulary, s, rng)
+    for id in xrange(num_docs):
+        length = max(1, int(rng.gauss(doc_length, doc_length / 4.0)))
+        counts = {}
+        for i in xrange(length):
+            lemma = _lemma(sampler.sample())
+            counts[lemma] = counts.get(lemma, 0) + 1
+        yield id, dict([(lemma, count / float(length))
+                        for lemma, count in counts.iteritems()]), length
+
+def real_corpus(num_docs=None):
+    """
+    real_corpus(num_docs=None): Yield (id, {lemma: tf}, length) for the 
+    documents in 'tagged/' (the first 'num_docs' of them, if given).
+    """
+    for i, doc in enumerate(indexer.iter_term_freqs(True)):
+        if num_docs is not None and i >= num_docs:
+            break
+        yield doc
+
+def zipf_query_log(num_queries, vocabulary=20000, s=1.1, max_terms=3,
+                   seed=1):
+    """
+    zipf_query_log(num_queries, vocabulary=20000, s=1.1, max_terms=3,
+    seed=1): Return 'num_queries' made-up queries (lists of 1 to
+    'max_terms' lemmas drawn with a Zipf distribution).
+    """
+    rng = random.Random(seed)
+    sampler = ZipfSampler(vocabulary, s, rng)
+    return [[_lemma(sampler.sample())
+             for i in xrange(rng.randint(1, max_terms))]
+            for q in xrange(num_queries)]
+
+def read_query_log(filename):
+    """
+    read_query_log(filename): Return the queries in 'filename', one query
+    (lemmas separated by white space) per line.
+    """
+    with open(filename, 'r') as f:
+        return [line.split() for line in f if line.strip()]
+
+def time_queries(searcher, queries, repeat=1, top_k=None):
+    """
+    time_queries(searcher, queries, repeat=1, top_k=None): Answer every
+    query in 'queries' (lists of lemmas) 'repeat' times with 'searcher'
+    (bypassing its result cache) and return a dict with the number of
+    queries, the total time, the queries per second and the mean, p50, p95
+    and p99 latency (in seconds).
+    """
+    latencies = []
+    for i in xrange(repeat):
+        for query in queries:
+            start = default_timer()
+            searcher.simple_query(query, top_k, use_cache=False)
+            latencies.append(default_timer() - start)
+    total = sum(latencies)
+    latencies.sort()
+    count = len(latencies)
+    return {'queries': count, 'seconds': total,
+            'qps': count / total if total else 0.0,
+            'mean': total / count if count else 0.0,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99)}
+
+def time_query_batches(searcher, queries, repeat=1, top_k=None,
+                       batch_size=64):
+    """
+    time_query_batches(searcher, queries, repeat=1, top_k=None,
+    batch_size=64): Answer 'queries' 'repeat' times with
+    searcher.simple_query_many(), 'batch_size' queries at a time, and return
+    the queries per second.
+    """
+    start = default_timer()
+    for i in xrange(repeat):
+        for j in xrange(0, len(queries), batch_size):
+            searcher.simple_query_many(queries[j:j + batch_size], top_k)
+    seconds = default_timer() - start
+    return repeat * len(queries) / seconds if seconds else 0.0
+
+def default_formats():
+    """default_formats(): FORMATS, without 'numpy' if it's not installed."""
+    if numpy_scoring.numpy_available():
+        return FORMATS
+    return tuple([fmt for fmt in FORMATS if fmt != 'numpy'])
+
+def _save(index, fmt, directory):
+    """Save 'index' in format 'fmt' in 'directory'; return the filename."""
+    if fmt == 'xml':
+        filename = os.path.join(directory, 'index.xml')
+        with open(filename, 'w') as f:
+            save_and_load.save_index(index, f)
+    else:
+        filename = os.path.join(directory, 'index.bin')
+        with open(filename, 'wb') as f:
+            save_and_load.save_index_binary(index, f)
+    return filename
+
+def run(corpus, queries, formats=None, top_k=10, repeat=1):
+    """
+    run(corpus, queries, formats=None, top_k=10, repeat=1): Index 'corpus'
+    ((id, {lemma: tf}, length) tuples), then for every format in 'formats'
+    (default: default_formats(); 'memory' is the index the indexer made, 
+    no file, and 'numpy' the same scored with NumPy) save and load the 
+    index and replay 'queries'. Return the results as a dict.
+    """
+    if formats is None:
+        formats = default_formats()
+    start = default_timer()
+    builder = indexer.IndexBuilder()
+    max_id = -1
+    for id, term_freqs, length in corpus:
+        builder.add_document(id, term_freqs, length)
+        max_id = max(max_id, id)
+    num_docs = builder.get_num_docs()
+    index = builder.finish()
+    results = {'docs': num_docs, 'lemmas': len(index),
+               'postings': sum([len(p) for p in index.itervalues()]),
+               'build_seconds': default_timer() - start,
+               'queries': len(queries), 'repeat': repeat, 'top_k': top_k,
+               'formats': {}}
+    urls = ['doc' + str(id) for id in xrange(max_id + 1)]
+    directory = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        urls_file = os.path.join(directory, url_table.URLS_FILE)
+        url_table.save_url_table(urls, urls_file)
+        for fmt in formats:
+            searcher = search_engine.SimpleSearchEngine()
+            gc.collect()
+            rss_before = current_rss()
+            if fmt in ('memory', 'numpy'):
+                size = None
+                start = default_timer()
+                searcher.set_index_and_urls(index, urls)
+                if fmt == 'numpy':
+                    searcher.use_numpy()
+                    # copies the index into NumPy arrays
+                    searcher.simple_query_many([])
+            else:
+                filename = _save(index, fmt, directory)
+                size = os.path.getsize(filename)
+                start = default_timer()
+                searcher.load_index_and_urls(filename, urls_file, fmt)
+            load_seconds = default_timer() - start
+            stats = time_queries(searcher, queries, repeat, top_k)
+            stats['batch_qps'] = time_query_batches(searcher, queries, repeat,
+                                                    top_k)
+            stats['index_bytes'] = size
+            stats['load_seconds'] = load_seconds
+            stats['rss_growth'] = current_rss() - rss_before
+            results['formats'][fmt] = stats
+            del searcher
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def _print_results(results):
+    print '%d documents, %d lemmas, %d postings, indexed in %.2f s' % \
+          (results['docs'], results['lemmas'], results['postings'],
+           results['build_seconds'])
+    print '%-8s %12s %10s %10s %9s %9s %9s %9s %10s' % \
+          ('format', 'size (KB)', 'load (ms)', 'RSS (KB)', 'QPS',
+           'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'batch QPS')
+    for fmt in sorted(results['formats']):
+        stats = results['formats'][fmt]
+        size = '-'
+        if stats['index_bytes'] is not None:
+            size = '%.1f' % (stats['index_bytes'] / 1024.0)
+        print '%-8s %12s %10.2f %10d %9.1f %9.3f %9.3f %9.3f %10.1f' % \
+              (fmt, size, 1000 * stats['load_seconds'],
+               stats['rss_growth'] // 1024, stats['qps'],
+               1000 * stats['p50'], 1000 * stats['p95'], 1000 * stats['p99'],
+               stats['batch_qps'])
+
+def _print_help():
+    print 'Query benchmark. (benchmark.py)\n'
+    print 'usage: benchmark.py [arguments]\n'
+    print 'Arguments: '
+    print '   -h or --help                display this help message'
+    print '   -n <n> or --docs=<n>        made-up documents (default 2000)'
+    print '   -r or --real                use the documents in \'tagged/\' '
+    print '                               (the first <n>, if -n was given)'
+    print '   -q <n> or --queries=<n>     made-up queries (default 1000)'
+    print '   -l <file> or --log=<file>   replay the queries in <file> '
+    print '                               (one per line) instead'
+    print '   -v <n> or --vocabulary=<n>  lemmas of the made-up corpus and '
+    print '                               queries (default 20000)'
+    print '   -s <s> or --zipf=<s>        Zipf exponent (default 1.1)'
+    print '   -k <n> or --top-k=<n>       results per query; 0 for all '
+    print '                               (default 10)'
+    print '   -f <list> or --formats=<list>  comma separated formats '
+    print '                               (default memory,xml,binary and '
+    print '                               numpy if NumPy is installed)'
+    print '   -o <file> or --output=<file>   write the results as JSON'
+    print '   --seed=<n>                  random seed (default 0)'
+
+def main(argv):
+    """Run the benchmark (see _print_help() for the arguments)."""
+    try:
+        opts, args = getopt.getopt(argv, 'hn:rq:l:v:s:k:f:o:',
+                                   ['help', 'docs=', 'real', 'queries=',
+                                    'log=', 'vocabulary=', 'zipf=', 'top-k=',
+                                    'formats=', 'output=', 'seed='])
+    except getopt.GetoptError:
+        _print_help()
+        return 2
+    num_docs, real, num_queries, log = None, False, 1000, None
+    vocabulary, s, top_k, formats = 20000, 1.1, 10, default_formats()
+    output, seed = None, 0
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            _print_help()
+            return 0
+        elif opt in ('-n', '--docs'):
+            num_docs = int(arg)
+        elif opt in ('-r', '--real'):
+            real = True
+        elif opt in ('-q', '--queries'):
+            num_queries = int(arg)
+        elif opt in ('-l', '--log'):
+            log = arg
+        elif opt in ('-v', '--vocabulary'):
+            vocabulary = int(arg)
+        elif opt in ('-s', '--zipf'):
+            s = float(arg)
+        elif opt in ('-k', '--top-k'):
+            top_k = int(arg) or None
+        elif opt in ('-f', '--formats'):
+            formats = arg.split(',')
+            for fmt in formats:
+                if fmt not in FORMATS:
+                    _print_help()
+                    return 2
+                if fmt == 'numpy' and \
+                   not numpy_scoring.numpy_available():
+                    sys.stderr.write('NumPy is not installed\n')
+                    return 2
+        elif opt in ('-o', '--output'):
+            output = arg
+        elif opt == '--seed':
+            seed = int(arg)
+    if real:
+        corpus = real_corpus(num_docs)
+    else:
+        corpus = synthetic_corpus(num_docs or 2000, vocabulary, s=s,
+                                  seed=seed)
+    if log is not None:
+        queries = read_query_log(log)
+    else:
+        queries = zipf_query_log(num_queries, vocabulary, s, seed=seed + 1)
+    results = run(corpus, queries, formats, top_k)
+    results['config'] = {'real': real, 'docs': num_docs, 'log': log,
+                         'vocabulary': vocabulary, 'zipf': s, 'seed': seed,
+                         'python': platform.python_version(),
+                         'platform': platform.platform()}
+    _print_results(results)
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 0
+
+if __name__ == '__main__':
+    status = main(sys.argv[1:])
+    sys.exit(status)
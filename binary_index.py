@@ -0,0 +1,258 @@
+"""
+A compact binary format for the inverted index, read through mmap.
+
+Layout of an index file (all numbers little-endian):
+
+    header        magic, version, number of lemmas, offsets of the lemma
+                  table and of the lemma strings
+    postings      for every lemma, its doc ids (int32) followed by its
+                  weights (float32), both sorted by doc id
+    lemma table   one fixed size entry per lemma, sorted by lemma:
+                  (string offset, string length, postings offset,
+                  number of postings, largest weight)
+    strings       the lemmas, utf-8 encoded, one after the other
+
+Opening an index only maps the file in memory and reads the header;
+lemmas are found with a binary search on the lemma table and their
+postings are read the first time they are asked for.
+"""
+
+import sys
+import mmap
+import array
+import struct
+# modules I've written:
+from postings import Postings, as_postings
+
+MAGIC = 'SWSEIDX\x00'
+VERSION = 2
+
+_HEADER = struct.Struct('<8sIIQQ')
+_ENTRY = struct.Struct('<IIQIf')
+
+
+class BadIndexFileError(Exception):
+    """Exception raised when a file is not a binary index we can read."""
+
+    def __init__(self, filename, reason):
+        self.filename = filename
+        self.reason = reason
+
+    def __str__(self):
+        return 'File \'' + str(self.filename) + '\' is not a binary index: ' + \
+               self.reason
+
+
+def _to_bytes(lemma):
+    """Return 'lemma' as a utf-8 encoded str."""
+    if isinstance(lemma, unicode):
+        return lemma.encode('utf-8')
+    return lemma
+
+def _write_array(file, typecode, values):
+    """Write 'values' to 'file' as a little-endian array of 'typecode'."""
+    a = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    a.tofile(file)
+
+def _read_array(buf, typecode, offset, count):
+    """Read a little-endian array of 'count' 'typecode' items from 'buf'."""
+    a = array.array(typecode)
+    a.fromstring(buf[offset:offset + count * a.itemsize])
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+class BinaryIndexWriter:
+    """
+    Write a binary index one lemma at a time.
+
+    Lemmas must be added in sorted (utf-8 byte) order, so the postings of
+    the whole index never have to be in memory at the same time.
+    """
+
+    def __init__(self, file):
+        """
+        __init__(self, file): 'file' is a file object opened for writing
+        in binary mode.
+        """
+        self._file = file
+        self._entries = []
+        self._strings = []
+        self._strings_size = 0
+        self._last_lemma = None
+        # leave room for the header, we'll write it when we're done
+        self._file.write('\x00' * _HEADER.size)
+        self._offset = _HEADER.size
+
+    def add(self, lemma, ids, weights, max_weight=None):
+        """
+        add(self, lemma, ids, weights, max_weight=None): Add the postings of
+        'lemma'. 'ids' is a sorted sequence of doc ids and 'weights' the 
+        matching weights. 'max_weight' (the largest weight) will be computed
+        if it isn't given.
+        """
+        lemma = _to_bytes(lemma)
+        if self._last_lemma is not None and lemma <= self._last_lemma:
+            raise ValueError('lemmas must be added in sorted order')
+        self._last_lemma = lemma
+        count = len(ids)
+        if max_weight is None:
+            max_weight = max(weights) if count else 0.0
+        self._entries.append((self._strings_size, len(lemma), self._offset,
+                              count, max_weight))
+        self._strings.append(lemma)
+        self._strings_size += len(lemma)
+        _write_array(self._file, 'i', ids)
+        _write_array(self._file, 'f', weights)
+        self._offset += 8 * count
+
+    def close(self):
+        """close(self): Write the lemma table, strings and header."""
+        table_offset = self._offset
+        for entry in self._entries:
+            self._file.write(_ENTRY.pack(*entry))
+        strings_offset = table_offset + _ENTRY.size * len(self._entries)
+        for lemma in self._strings:
+            self._file.write(lemma)
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(MAGIC, VERSION, len(self._entries),
+                                      table_offset, strings_offset))
+        self._file.flush()
+
+
+def write_index(index, file):
+    """
+    write_index(index, file): Save the in-memory 'index' (a dict mapping
+    lemmas to postings or {doc_id: weight} dicts) in the binary format.
+
+    'file' is a file object opened for writing in binary mode.
+    """
+    writer = BinaryIndexWriter(file)
+    for lemma in sorted(index.iterkeys(), key=_to_bytes):
+        postings = as_postings(index[lemma])
+        writer.add(lemma, postings.ids, postings.weights, 
+                   postings.max_weight)
+    writer.close()
+
+def is_binary_index(filename):
+    """is_binary_index(filename): True if 'filename' starts with MAGIC."""
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class BinaryIndex:
+    """
+    A read-only inverted index backed by a memory-mapped binary index file.
+
+    Behaves like the dict the indexer makes: index[lemma] returns the
+    lemma's Postings, read straight from the mapped file, and raises 
+    KeyError if the lemma is not in the index.
+    """
+
+    def __init__(self, filename):
+        """__init__(self, filename): Map the index file 'filename'."""
+        self._filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # empty file
+            self._file.close()
+            raise BadIndexFileError(filename, 'file is empty')
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise BadIndexFileError(filename, 'file is too short')
+        magic, version, self._num_lemmas, self._table_offset, \
+            self._strings_offset = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise BadIndexFileError(filename, 'bad magic number')
+        if version != VERSION:
+            self.close()
+            raise BadIndexFileError(filename, 'unsupported version ' +
+                                    str(version))
+
+    def close(self):
+        """close(self): Unmap and close the index file."""
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._num_lemmas
+
+    def _entry(self, i):
+        """Return the i-th entry of the lemma table."""
+        return _ENTRY.unpack_from(self._map,
+                                  self._table_offset + i * _ENTRY.size)
+
+    def _lemma(self, entry):
+        """Return the lemma (a str) an entry of the lemma table points to."""
+        start = self._strings_offset + entry[0]
+        return self._map[start:start + entry[1]]
+
+    def _find(self, lemma):
+        """Return the lemma table entry for 'lemma' or None."""
+        lemma = _to_bytes(lemma)
+        low, high = 0, self._num_lemmas
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            found = self._lemma(entry)
+            if found < lemma:
+                low = middle + 1
+            elif found > lemma:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def _postings(self, entry):
+        """Read the postings an entry of the lemma table points to."""
+        offset, count = entry[2], entry[3]
+        ids = _read_array(self._map, 'i', offset, count)
+        weights = _read_array(self._map, 'f', offset + 4 * count, count)
+        return Postings(ids, weights, entry[4])
+
+    def __getitem__(self, lemma):
+        entry = self._find(lemma)
+        if entry is None:
+            raise KeyError(lemma)
+        return self._postings(entry)
+
+    def get(self, lemma, default=None):
+        try:
+            return self[lemma]
+        except KeyError:
+            return default
+
+    def __contains__(self, lemma):
+        return self._find(lemma) is not None
+
+    def lemma(self, i):
+        """lemma(self, i): Return the i-th lemma in sorted order."""
+        if not 0 <= i < self._num_lemmas:
+            raise IndexError('lemma table index out of range')
+        return self._lemma(self._entry(i))
+
+    def iterkeys(self):
+        """iterkeys(self): Iterate over the lemmas in sorted order."""
+        for i in xrange(self._num_lemmas):
+            yield self._lemma(self._entry(i))
+
+    __iter__ = iterkeys
+
+    def iteritems(self):
+        """iteritems(self): Iterate over (lemma, postings) in sorted order."""
+        for i in xrange(self._num_lemmas):
+            entry = self._entry(i)
+            yield self._lemma(entry), self._postings(entry)
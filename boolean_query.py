@@ -0,0 +1,337 @@
+"""
+Boolean queries: AND, OR, NOT and parentheses.
+
+    whale AND (sea OR ocean) NOT fish
+
+Words next to each other without an operator are OR'ed, like in a plain
+query, and NOT binds to the word (or group) right after it; 'a NOT b' is
+'a AND NOT b'. Operators must be in capitals ('and', 'or' and 'not' are
+words). A NOT has to be AND'ed with something to exclude pages from, so
+'NOT fish' and 'whale OR NOT fish' are rejected. A query is only taken for
+a boolean one if it has an operator or its parentheses are balanced, so
+'smile :)' is a plain query.
+
+parse() turns a query into a tree of tuples:
+
+    ('word', text)                  before lemmatize()
+    ('term', lemma)                 after lemmatize()
+    ('and', (child, child, ...))
+    ('or', (child, child, ...))       ('or', ()) matches no page
+    ('not', child)
+
+match() evaluates a tree over the sorted doc ids of the postings lists: an
+AND walks its shortest list and gallops through the others (see
+positional_index._gallop()), so it costs about the length of the shortest
+list times the log of the others, and never builds a dict of the longer
+ones. score() ranks the matching pages by the sum of the weights of the
+lemmas they were not excluded for, like a plain query.
+"""
+
+import re
+# modules I've written:
+from positional_index import _gallop
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+_TOKEN_RE = re.compile(r'\(|\)|[^\s()]+')
+
+
+class BooleanQueryError(Exception):
+    """Exception raised when a boolean query can't be parsed or evaluated."""
+
+    def __init__(self, reason):
+        self.reason = reason
+
+    def __str__(self):
+        return 'Bad boolean query: ' + self.reason
+
+
+def tokenize(input):
+    """
+    tokenize(input): Split the query string 'input' into words, operators
+    and parentheses.
+    """
+    return _TOKEN_RE.findall(input)
+
+def is_boolean(input):
+    """
+    is_boolean(input): True if the query string 'input' has an operator in 
+    it, or parentheses that are all balanced.
+    """
+    depth = 0
+    balanced = True
+    has_parentheses = False
+    for token in tokenize(input):
+        if token in OPERATORS:
+            return True
+        if token == '(':
+            depth += 1
+            has_parentheses = True
+        elif token == ')':
+            depth -= 1
+            if depth < 0:
+                balanced = False
+    return has_parentheses and balanced and depth == 0
+
+
+class _Parser:
+    """
+    A recursive descent parser for:
+
+        or_expr  := and_expr ('OR'? and_expr)*
+        and_expr := unary (('AND' unary) | (&'NOT' unary))*
+        unary    := 'NOT' unary | '(' or_expr ')' | word
+    """
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._i = 0
+
+    def _peek(self):
+        if self._i < len(self._tokens):
+            return self._tokens[self._i]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        self._i += 1
+        return token
+
+    def parse(self):
+        if not self._tokens:
+            raise BooleanQueryError('empty query')
+        tree = self._or_expr()
+        if self._peek() is not None:
+            raise BooleanQueryError('unexpected \'' + self._peek() + '\'')
+        return tree
+
+    def _or_expr(self):
+        children = [self._and_expr()]
+        while self._peek() not in (None, ')'):
+            if self._peek() == 'OR':
+                self._next()
+            children.append(self._and_expr())
+        if len(children) == 1:
+            return children[0]
+        return ('or', tuple(children))
+
+    def _and_expr(self):
+        children = [self._unary()]
+        while self._peek() in ('AND', 'NOT'):
+            if self._peek() == 'AND':
+                self._next()
+            children.append(self._unary())
+        if len(children) == 1:
+            return children[0]
+        return ('and', tuple(children))
+
+    def _unary(self):
+        token = self._next()
+        if token is None:
+            raise BooleanQueryError('the query ends too soon')
+        if token == 'NOT':
+            return ('not', self._unary())
+        if token == '(':
+            tree = self._or_expr()
+            if self._next() != ')':
+                raise BooleanQueryError('missing \')\'')
+            return tree
+        if token in ('AND', 'OR', ')'):
+            raise BooleanQueryError('unexpected \'' + token + '\'')
+        return ('word', token)
+
+
+def parse(input):
+    """
+    parse(input): Parse the query string 'input' and return its tree (with
+    ('word', text) leaves). Raises BooleanQueryError if it's malformed.
+    """
+    return _Parser(tokenize(input)).parse()
+
+def lemmatize(tree, lemmatize_word, expand_word=None):
+    """
+    lemmatize(tree, lemmatize_word, expand_word=None): Return 'tree' with 
+    every ('word', text) leaf replaced by the ('term', lemma) leaves of the
+    lemmas 'lemmatize_word(text)' returns (AND'ed if there's more than 
+    one). Words it returns no lemmas for (e.g. the stop words it leaves 
+    out) are dropped; return None if nothing's left.
+
+    If 'expand_word' is given and 'expand_word(text)' isn't None, it's the
+    list of lemmas a pattern (see term_dictionary.py) matches, and they are
+    OR'ed instead; a pattern that matches no lemma becomes ('or', ()), so
+    it matches no page instead of being dropped.
+    """
+    kind = tree[0]
+    if kind == 'word':
+        expanded = None
+        if expand_word is not None:
+            expanded = expand_word(tree[1])
+        if expanded is not None:
+            lemmas, kind = expanded, 'or'
+        else:
+            lemmas, kind = lemmatize_word(tree[1]), 'and'
+        terms = [('term', lemma) for lemma in lemmas]
+        if not terms:
+            if kind == 'or':
+                # a pattern without matches
+                return ('or', ())
+            return None
+        if len(terms) == 1:
+            return terms[0]
+        return (kind, tuple(terms))
+    if kind == 'not':
+        child = lemmatize(tree[1], lemmatize_word, expand_word)
+        if child is None:
+            return None
+        return ('not', child)
+    if kind in ('and', 'or'):
+        children = [child for child in
+                    [lemmatize(child, lemmatize_word, expand_word)
+                     for child in tree[1]]
+                    if child is not None]
+        if not children:
+            return None
+        if len(children) == 1:
+            return children[0]
+        return (kind, tuple(children))
+    # already lemmatized
+    return tree
+
+def positive_lemmas(tree):
+    """
+    positive_lemmas(tree): Return the lemmas of the ('term', lemma) leaves
+    of 'tree' that aren't under a NOT, in order (a lemma given twice is
+    there twice).
+    """
+    if tree is None or tree[0] == 'not':
+        return []
+    if tree[0] == 'term':
+        return [tree[1]]
+    lemmas = []
+    for child in tree[1]:
+        lemmas.extend(positive_lemmas(child))
+    return lemmas
+
+
+def intersect(lists):
+    """
+    intersect(lists): Return the doc ids in all of the sorted sequences
+    'lists', sorted. The shortest is walked and the others galloped
+    through.
+    """
+    if not lists:
+        return []
+    lists = sorted(lists, key=len)
+    shortest, others = lists[0], lists[1:]
+    if not others:
+        return list(shortest)
+    cursors = [0] * len(others)
+    result = []
+    for id in shortest:
+        found = True
+        for j, ids in enumerate(others):
+            p = _gallop(ids, id, cursors[j])
+            cursors[j] = p
+            if p == len(ids):
+                # no more ids in one of the lists
+                return result
+            if ids[p] != id:
+                found = False
+                break
+        if found:
+            result.append(id)
+    return result
+
+def union(lists):
+    """union(lists): Return the doc ids in any of the sorted 'lists', sorted."""
+    if len(lists) == 1:
+        return lists[0]
+    ids = set()
+    for l in lists:
+        ids.update(l)
+    return sorted(ids)
+
+def difference(ids, excluded):
+    """
+    difference(ids, excluded): Return the doc ids of the sorted sequence
+    'ids' that aren't in the sorted sequence 'excluded', sorted.
+    """
+    if not len(excluded):
+        return ids
+    result = []
+    cursor = 0
+    for i, id in enumerate(ids):
+        cursor = _gallop(excluded, id, cursor)
+        if cursor == len(excluded):
+            # nothing left to exclude
+            result.extend(ids[i:])
+            break
+        if excluded[cursor] != id:
+            result.append(id)
+    return result
+
+def match(index, tree):
+    """
+    match(index, tree): Return the sorted doc ids of the pages matching the
+    lemmatized query 'tree' in 'index' (anything with get(lemma) returning
+    postings, or None). Raises BooleanQueryError for a NOT with nothing to
+    exclude pages from.
+    """
+    if tree is None:
+        return []
+    kind = tree[0]
+    if kind == 'term':
+        lemma_postings = index.get(tree[1])
+        if lemma_postings is None:
+            # 'lemma' was not in the index
+            return []
+        return lemma_postings.ids
+    if kind == 'not':
+        raise BooleanQueryError('NOT needs a word to exclude pages from '
+                                '(e.g. \'whale NOT fish\')')
+    if kind == 'or':
+        return union([match(index, child) for child in tree[1]])
+    if kind == 'and':
+        positive = [child for child in tree[1] if child[0] != 'not']
+        negative = [child[1] for child in tree[1] if child[0] == 'not']
+        if not positive:
+            raise BooleanQueryError('NOT needs a word to exclude pages from '
+                                    '(e.g. \'whale NOT fish\')')
+        ids = intersect([match(index, child) for child in positive])
+        for child in negative:
+            if not len(ids):
+                break
+            ids = difference(ids, match(index, child))
+        return ids
+    raise BooleanQueryError('the query has not been lemmatized')
+
+def score(index, tree, top_k=None):
+    """
+    score(index, tree, top_k=None): Return (doc id, weight) tuples for the
+    pages matching the lemmatized query 'tree' in 'index', sorted by weight
+    (the sum of the weights of positive_lemmas(tree)) in descending order,
+    ties going to the smaller doc id; only the 'top_k' best if 'top_k' is
+    given.
+    """
+    ids = match(index, tree)
+    if not len(ids):
+        return []
+    weights = [0.0] * len(ids)
+    for lemma in positive_lemmas(tree):
+        lemma_postings = index.get(lemma)
+        if lemma_postings is None:
+            continue
+        lemma_ids = lemma_postings.ids
+        lemma_weights = lemma_postings.weights
+        cursor = 0
+        for i, id in enumerate(ids):
+            cursor = _gallop(lemma_ids, id, cursor)
+            if cursor == len(lemma_ids):
+                break
+            if lemma_ids[cursor] == id:
+                weights[i] += lemma_weights[cursor]
+    results = sorted(zip(ids, weights), key=lambda (id, weight):
+                     (-weight, id))
+    if top_k is not None:
+        return results[:top_k]
+    return results
@@ -0,0 +1,139 @@
+"""
+Crawl a local stand-in web server and report how many pages/second the
+crawler fetches.
+
+The server makes up its pages: every page is big enough to pass the
+crawler's checks and links to a few other pages, spread over the hosts
+127.0.0.1 - 127.0.0.<hosts> (all of them are the same local server).
+Each response is delayed by '--latency' seconds to play the part of a
+slow remote server.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import getopt
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+# modules I've written:
+import crawler
+
+
+class _PageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve made-up html pages over keep-alive connections."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        rng = random.Random(self.path)
+        links = ''.join(['<a href="http://127.0.0.%d:%d/page/%d.html">link</a>'
+                         % (rng.randint(1, self.server.hosts),
+                            self.server.server_address[1],
+                            rng.randint(0, self.server.pages))
+                         for i in xrange(5)])
+        body = '<html><head><title>' + self.path + '</title></head><body>' + \
+               links + '<p>' + 'lorem ipsum dolor sit amet ' * 1600 + \
+               '</p></body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_server(hosts=4, pages=100000, latency=0.05):
+    """
+    start_server(hosts=4, pages=100000, latency=0.05): Start the stand-in
+    server on a free port in a background thread and return it.
+    """
+    server = _Server(('0.0.0.0', 0), _PageHandler)
+    server.hosts = hosts
+    server.pages = pages
+    server.latency = latency
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def is_no_go_local_link(linkurl):
+    """Like crawler.is_no_go_link, but only allow the stand-in server."""
+    if linkurl[0] and linkurl[0] != 'http':
+        return True
+    if linkurl[1] and not linkurl[1].startswith('127.0.0.'):
+        return True
+    if not linkurl[2].endswith('.html') and not linkurl[2].endswith('/'):
+        return True
+    return False
+
+def run(server, num_pages=200, threads=8, per_host=2, host_delay=0.0):
+    """
+    run(server, num_pages=200, threads=8, per_host=2, host_delay=0.0): Crawl
+    'num_pages' pages off 'server' (inside a temporary directory) and return
+    the crawler's stats.
+    """
+    seeds = ['http://127.0.0.%d:%d/' % (host, server.server_address[1])
+             for host in xrange(1, server.hosts + 1)]
+    c = crawler.Crawler(num_pages=num_pages, seeds=seeds, threads=threads,
+                        per_host=per_host, host_delay=host_delay,
+                        is_no_go=is_no_go_local_link)
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+    try:
+        c.crawl()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir)
+    return c.get_crawl_stats()
+
+def main(argv):
+    """
+    Crawl the stand-in server with 1, 2, 4, ... up to '--threads' threads
+    and print the pages/second for each.
+    """
+    try:
+        opts, args = getopt.getopt(argv, 'n:t:p:d:l:', ['pages=', 'threads=',
+                                                        'per-host=', 'delay=',
+                                                        'latency='])
+    except getopt.GetoptError:
+        sys.stderr.write('usage: crawl_benchmark.py [-n pages] [-t threads] '
+                         '[-p per_host] [-d host_delay] [-l latency]\n')
+        return 2
+    num_pages, max_threads, per_host, delay, latency = 200, 16, 2, 0.0, 0.05
+    for opt, arg in opts:
+        if opt in ('-n', '--pages'):
+            num_pages = int(arg)
+        elif opt in ('-t', '--threads'):
+            max_threads = int(arg)
+        elif opt in ('-p', '--per-host'):
+            per_host = int(arg)
+        elif opt in ('-d', '--delay'):
+            delay = float(arg)
+        elif opt in ('-l', '--latency'):
+            latency = float(arg)
+    server = start_server(hosts=8, latency=latency)
+    threads = 1
+    while threads <= max_threads:
+        stats = run(server, num_pages, threads, per_host, delay)
+        print '%3d threads: %5d pages in %6.2f s   %8.2f pages/second' % \
+              (threads, stats['fetched'], stats['seconds'],
+               stats['pages_per_second'])
+        threads *= 2
+    server.shutdown()
+    return 0
+
+if __name__ == '__main__':
+    status = main(sys.argv[1:])
+    sys.exit(status)
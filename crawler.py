@@ -1,16 +1,34 @@
-"""A simple crawler."""
+"""
+A simple crawler.
+
+Pages are downloaded by a pool of threads (see fetcher.py), a few hosts 
+at a time, while parsing, checking and saving them happens in the
+crawler's own thread. Urls wait their turn in a disk-backed priority 
+frontier (see frontier.py).
+
+Every few pages the crawler saves a checkpoint, so an interrupted crawl
+can be resumed (python crawler.py --resume).
+"""
 
 import os
 import sys
-import urllib2
+import time
 import urlparse
-import socket      # to catch any socket.timeout exceptions read() might throw
 import sys         # to get the sys.stdout handle
 import pickle
+import getopt
+import Queue
 # modules I've written:
 from html_parser import SimpleHTMLParser
+import fetcher
+import frontier
+import manifest
+import metrics
+import url_table
 
 PAGE_SIZE = 40000
+# histogram buckets for page sizes (bytes)
+_SIZE_BUCKETS = (1000, 4000, 16000, 40000, 100000, 250000, 1000000)
 
 
 class OutOfUrlsError(Exception):
@@ -23,11 +41,55 @@ class OutOfUrlsError(Exception):
 class Crawler:
     """A simple crawler."""
     
-    def __init__(self, num_pages=None, min_page_size=None, seeds=None):
-        """Initialize an object."""
-        self._to_crawl = set([])        # urls to crawl
-        self._crawled = set([])         # urls of crawled pages
+    def __init__(self, num_pages=None, min_page_size=None, seeds=None,
+                 threads=8, per_host=1, host_delay=1.0, rate=None, 
+                 timeout=2, is_no_go=None, frontier_dir=None, bloom=False,
+                 checkpoint_every=50, save_pages=True):
+        """
+        Initialize an object.
+        
+        threads      (int) : number of pages to download at the same time
+        per_host     (int) : at most that many of them from the same host
+        host_delay (float) : seconds between two requests to the same host
+        rate       (float) : maximum number of requests per second (None for
+                             no limit)
+        timeout    (float) : socket timeout in seconds
+        is_no_go    (func) : the link filter (default is_no_go_link)
+        frontier_dir (str) : where the frontier keeps its segment files
+                             and checkpoints are saved (default './frontier')
+        bloom       (bool) : remember seen urls in a Bloom filter instead of
+                             a set of url fingerprints (smaller, but a few
+                             urls will wrongly look seen)
+        checkpoint_every (int) : save a checkpoint every that many pages
+        save_pages  (bool) : save the pages in './html/'
+        """
+        self._to_crawl = None           # urls to crawl (made by crawl())
+        # urls ever added to the frontier:
+        if bloom:
+            self._crawled = frontier.BloomFilter()
+        else:
+            self._crawled = frontier.FingerprintSet()
         self._url = []                  # urls of saved pages
+        self._checkpointed_urls = 0     # urls saved in the last checkpoint
+        self._checkpoint_every = checkpoint_every
+        self._save_pages = save_pages
+        self._on_page = None
+        self._depth = {}                # depth of urls being fetched
+        self._host_count = {}           # links queued per host
+        if frontier_dir is not None:
+            self._frontier_dir = frontier_dir
+        else:
+            self._frontier_dir = './frontier'
+        self._threads = threads
+        self._per_host = per_host
+        self._host_delay = host_delay
+        self._rate = rate
+        self._timeout = timeout
+        if is_no_go is not None:
+            self._is_no_go = is_no_go
+        else:
+            self._is_no_go = is_no_go_link
+        self._stats = {}
         # number of pages to download:
         if num_pages is not None:
             self._num_pages = num_pages
@@ -52,114 +114,311 @@ class Crawler:
     def reset(self):
         self.__init__()
     
-    def crawl(self):
+    def crawl(self, resume=False, on_page=None):
         """
         Find and save 'self._num_pages' html pages, each at least 
         'self._min_page_size' characters long.
         
         seeds (list): start crawling from these urls
+        resume (bool): continue from the last checkpoint, if there is one
+        on_page (func): called as on_page(id, url, html) for every page kept
         """
+        resumed = resume and self._resume()
+        if not resumed:
+            # set the crawler's seeds
+            self._start_afresh()
         # open './log.txt'
         try:
-            log = open('./log.txt', 'w')
+            if resumed:
+                log = open('./log.txt', 'a')
+            else:
+                log = open('./log.txt', 'w')
         except Exception:
             print "Couldn't open log.txt. All output will go to the screen."
             log = sys.stdout
-        # set the crawler's seeds
-        self._to_crawl = set(self._seeds)
+        self._on_page = on_page
         # make a directory to save the pages in
-        os.mkdir('./html')
+        if self._save_pages and not os.path.isdir('./html'):
+            os.mkdir('./html')
         # create a parser (to get each page's links)
         parser = SimpleHTMLParser()
+        # urls waiting for their host's turn, and the threads fetching them
+        queues = fetcher.HostQueues(self._per_host, self._host_delay)
+        fetch = fetcher.Fetcher(self._threads, self._timeout, self._rate)
+        in_flight = 0
+        fetched = 0
+        start = time.time()
         
         # start gathering pages
         try:
-            while len(self._url) < self._num_pages:
-                try:
-                    crawling = self._to_crawl.pop()
-                    print >>log, crawling
-                except KeyError as e:
-                    # out of urls
-                    raise OutOfUrlsError
-                
-                url = urlparse.urlsplit(crawling)
-                try:
-                    page_handle = urllib2.urlopen(crawling, timeout=2)
-                except:
-                    print >>log, '    exception while opening!'
-                    continue
-                if page_handle.getcode() > 399:
-                    # got an HTTP error code, continue to the next link
-                    print >>log, '    got HTTP error code!'
-                    continue
-                
-                # check url in case there was a redirection and we ended up on
-                # a forbidden page
-                if is_no_go_link(urlparse.urlsplit(page_handle.geturl())):
-                    print >>log, '    redirected to forbidden page!'
-                    continue
-                
-                # add 'crawling' to the set of all crawled urls
-                self._crawled.add(crawling)
-                # add page_handle.geturl() too in case we were redirected
-                self._crawled.add(page_handle.geturl())
-                
-                # read page text
-                try:
-                    page_html = page_handle.read()
-                except socket.timeout:
-                    print >>log, '    socket timeout!'
-                    continue
-                except Exception:
-                    print >>log, '    problem during page_handle.read()!'
-                    continue
-                # parse the page
-                parser.reset()
-                try:
-                    parser.parse(page_html)
-                except Exception as e:
-                    print >>log, '    parser exception!   ---   ' + str(e)
-                    continue
-                
-                # extract hyperlinks
-                extract_new_links(url, parser.get_hyperlinks(), self._to_crawl,
-                                  self._crawled)
-                
-                # do the checks (at least 'self._min_page_size' chars, english, etc.)
-                ok = self._check_page(page_handle, len(page_html))
-                if ok:
-                    # give the page an id and save it
-                    # the page's position in the _url list will be it's id
-                    self._url.append(crawling)
-                    save_page(page_html, len(self._url) - 1)
-                    # print the number of pages gathered so far
-                    print str(len(self._url)) + ' pages'
-                else:
-                    print >>log, '    page not ok!'
-                page_handle.close()
+            try:
+                while len(self._url) < self._num_pages:
+                    self._fill_host_queues(queues)
+                    # keep every thread busy
+                    while in_flight < self._threads:
+                        next = queues.pop()
+                        if next is None:
+                            break
+                        fetch.submit(*next)
+                        in_flight += 1
+                    if in_flight == 0:
+                        if not len(queues) and not self._to_crawl:
+                            # out of urls
+                            raise OutOfUrlsError
+                        # every queued host must wait a bit
+                        time.sleep(queues.wait_time())
+                        continue
+                    try:
+                        result = fetch.get(max(queues.wait_time(), 0.01))
+                    except Queue.Empty:
+                        continue
+                    in_flight -= 1
+                    fetched += 1
+                    queues.release(result.host)
+                    if result.redirect is not None:
+                        self._redirect(result, queues, log)
+                        continue
+                    self._process(result, parser, log)
+                    if len(self._url) - self._checkpointed_urls >= \
+                       self._checkpoint_every:
+                        self._checkpoint()
+            finally:
+                fetch.stop()
+                self._update_stats(fetched, time.time() - start)
+                # urls still being fetched are in self._depth, so they'll 
+                # be crawled again after a resume
+                self._checkpoint()
         except KeyboardInterrupt:
             # remember that the while loop was in this try-except block
             # did this to close the log file if an ctrl-c was pressed
             if log is not sys.stdout:
                 log.close()
             return False
+        print >>log, 'fetched ' + str(fetched) + ' pages in ' + \
+                     '%.1f seconds (%.2f pages/second)' % \
+                     (self._stats['seconds'], self._stats['pages_per_second'])
         # if everything went well close the log file and exit True
         if log is not sys.stdout:
             log.close()
         return True
     
+    def _state_file(self, name):
+        """Return the path of the checkpoint file 'name'."""
+        return os.path.join(self._frontier_dir, name)
+    
+    def _start_afresh(self):
+        """Empty the frontier, forget old checkpoints and add the seeds."""
+        self._to_crawl = frontier.Frontier(self._frontier_dir)
+        for name in ('checkpoint.pickle', 'seen.bin', 'urls.txt'):
+            if os.path.exists(self._state_file(name)):
+                os.remove(self._state_file(name))
+        for seed in self._seeds:
+            self._add_link(seed, 0)
+    
+    def _checkpoint(self):
+        """
+        Save what it takes to resume the crawl. Only what changed since the
+        last checkpoint is written out: the urls of newly saved pages and 
+        the newly seen urls' fingerprints are appended to their files, and
+        the frontier only saves the entries it keeps in memory.
+        """
+        with open(self._state_file('urls.txt'), 'a') as f:
+            for url in self._url[self._checkpointed_urls:]:
+                f.write(url + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            urls_size = f.tell()
+        seen_size = self._crawled.save(self._state_file('seen.bin'))
+        state = {'frontier': self._to_crawl.state(),
+                 'in_flight': self._depth.items(),
+                 'host_count': self._host_count,
+                 'num_urls': len(self._url), 'urls_size': urls_size,
+                 'seen_size': seen_size,
+                 'bloom': isinstance(self._crawled, frontier.BloomFilter)}
+        # write the new checkpoint next to the old one and swap them, so
+        # there always is a complete checkpoint on disk
+        filename = self._state_file('checkpoint.pickle')
+        with open(filename + '.tmp', 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(filename + '.tmp', filename)
+        self._checkpointed_urls = len(self._url)
+        # segment files read back before this checkpoint aren't needed now
+        self._to_crawl.sweep()
+    
+    def _resume(self):
+        """
+        Load the last checkpoint. Return False if there isn't one.
+        """
+        filename = self._state_file('checkpoint.pickle')
+        if not os.path.exists(filename):
+            return False
+        with open(filename, 'rb') as f:
+            state = pickle.load(f)
+        self._to_crawl = frontier.Frontier(self._frontier_dir,
+                                           state=state['frontier'])
+        if state['bloom']:
+            self._crawled = frontier.BloomFilter()
+        else:
+            self._crawled = frontier.FingerprintSet()
+        self._crawled.load(self._state_file('seen.bin'), state['seen_size'])
+        # pages saved after the checkpoint will be fetched (and saved with
+        # the same ids) again
+        with open(self._state_file('urls.txt'), 'r+') as f:
+            self._url = f.read(state['urls_size']).splitlines()
+            f.truncate(state['urls_size'])
+        self._checkpointed_urls = len(self._url)
+        self._host_count = state['host_count']
+        self._depth = {}
+        for url, depth in state['in_flight']:
+            self._to_crawl.add(url, depth, 0)
+        return True
+    
+    def _fill_host_queues(self, queues):
+        """
+        Move urls from the crawl frontier to the per-host queues, but only a 
+        few more than the fetcher threads can take.
+        """
+        while len(queues) < 4 * self._threads and self._to_crawl:
+            url, depth = self._to_crawl.pop()
+            self._depth[url] = depth
+            queues.add(url, urlparse.urlsplit(url)[1])
+    
+    def _add_link(self, link, depth):
+        """
+        Add 'link', found 'depth' links away from a seed, to the frontier
+        (unless it has been seen before).
+        """
+        if link in self._crawled:
+            return False
+        self._crawled.add(link)
+        host = urlparse.urlsplit(link)[1]
+        count = self._host_count.get(host, 0)
+        self._host_count[host] = count + 1
+        self._to_crawl.add(link, depth, 
+                           frontier.link_priority(depth, count, 
+                                                  link_score(link)))
+        return True
+    
+    def _redirect(self, result, queues, log):
+        """
+        Queue the url on another host the fetcher was redirected to, in
+        place of the url it was asked for (unless it's been seen before).
+        """
+        depth = self._depth.pop(result.url, 0)
+        target = result.redirect
+        print >>log, result.url
+        print >>log, '    redirected to ' + target
+        if self._is_no_go(urlparse.urlsplit(target)):
+            print >>log, '    redirected to forbidden page!'
+            return False
+        if target in self._crawled:
+            return False
+        self._crawled.add(target)
+        self._depth[target] = depth
+        queues.add(target, urlparse.urlsplit(target)[1])
+        return True
+    
+    def _process(self, result, parser, log):
+        """
+        Check, parse and (if it's ok) save a page the fetcher downloaded.
+        
+        result (fetcher.FetchResult) : the url and page (or error)
+        parser     (SimpleHTMLParser) : the parser to get the page's links
+        log                    (file) : the log file
+        """
+        crawling = result.url
+        depth = self._depth.pop(crawling, 0)
+        print >>log, crawling
+        if result.page is None:
+            print >>log, '    exception while opening!   ---   ' + \
+                         str(result.error)
+            return False
+        page_handle = result.page
+        url = urlparse.urlsplit(crawling)
+        if page_handle.getcode() > 399:
+            # got an HTTP error code, continue to the next link
+            print >>log, '    got HTTP error code!'
+            return False
+        
+        # check url in case there was a redirection and we ended up on
+        # a forbidden page
+        if self._is_no_go(urlparse.urlsplit(page_handle.geturl())):
+            print >>log, '    redirected to forbidden page!'
+            return False
+        
+        # add page_handle.geturl() to the seen urls in case we were
+        # redirected ('crawling' was added when it was queued)
+        self._crawled.add(page_handle.geturl())
+        
+        # read page text
+        page_html = page_handle.read()
+        metrics.observe('crawl.page_bytes', len(page_html), _SIZE_BUCKETS)
+        # parse the page
+        with metrics.timer('crawl.parse'):
+            parser.reset()
+            try:
+                parser.parse(page_html)
+            except Exception as e:
+                print >>log, '    parser exception!   ---   ' + str(e)
+                metrics.count('crawl.parse_errors')
+                return False
+            
+            # extract hyperlinks
+            for link in parser.get_hyperlinks():
+                link = normalize_link(url, link, self._is_no_go)
+                if link is not None:
+                    self._add_link(link, depth + 1)
+        
+        # do the checks (at least 'self._min_page_size' chars, english, etc.)
+        ok = self._check_page(page_handle, len(page_html))
+        if ok:
+            # give the page an id and save it
+            # the page's position in the _url list will be it's id
+            self._url.append(crawling)
+            if self._save_pages:
+                with metrics.timer('crawl.save'):
+                    save_page(page_html, len(self._url) - 1)
+            metrics.count('crawl.pages_saved')
+            if self._on_page is not None:
+                self._on_page(len(self._url) - 1, crawling, page_html)
+            # print the number of pages gathered so far
+            print str(len(self._url)) + ' pages'
+        else:
+            print >>log, '    page not ok!'
+            metrics.count('crawl.pages_rejected')
+        page_handle.close()
+        return ok
+    
+    def _update_stats(self, fetched, seconds):
+        """Remember how many pages we fetched and saved, and how fast."""
+        self._stats = {'fetched': fetched, 'saved': len(self._url),
+                       'seconds': seconds,
+                       'pages_per_second': fetched / max(seconds, 1e-6)}
+    
     def get_crawl_frontier(self):
         """Get the crawl frontier - links about to be crawled."""
         return self._to_crawl
     
     def get_crawled_links(self):
-        """Get all the crawled links."""
+        """
+        Get the set of seen links (links ever added to the frontier). It can
+        only answer 'link in crawled_links', it doesn't keep the links.
+        """
         return self._crawled
     
     def get_page_urls(self):
         """Get the list mapping ids to page urls."""
         return self._url
     
+    def get_crawl_stats(self):
+        """
+        Get a dict with the number of pages fetched and saved by the last 
+        crawl, how many seconds it took and how many pages/second it fetched.
+        """
+        return self._stats
+    
     def get_seeds(self):
         """Get the seeds - the links to start crawling from."""
         return self._seeds
@@ -171,11 +430,11 @@ class Crawler:
 
     def dump_ids_and_urls(self):
         """
-        Export self._url as 'urls.pickle' using pickle. Also create a text 
-        file, 'ids_and_urls.txt', mapping page ids to urls.
+        Export self._url as the url table 'urls.bin' (see url_table.py). 
+        Also create a text file, 'ids_and_urls.txt', mapping page ids to 
+        urls.
         """
-        with open('urls.pickle', 'w') as f:
-            pickle.dump(self._url, f)
+        url_table.save_url_table(self._url)
         with open('ids_and_urls.txt', 'w') as f:
             for id, url in enumerate(self._url):
                 f.write('%-5s %s\n' % (id, url))
@@ -220,7 +479,7 @@ def save_page(page_html, page_id):
         f.write(page_html)
     return True
 
-def extract_new_links(url, links, to_crawl, crawled):
+def extract_new_links(url, links, to_crawl, crawled, is_no_go=None):
     """
     Add all links in 'links' (except those in 'crawled') into 'to_crawl'.
     Before adding a link check if it's acceptable.
@@ -229,26 +488,50 @@ def extract_new_links(url, links, to_crawl, crawled):
     links      (list) : a list of the extracted links
     to_crawl    (set) : links not yet crawled
     crawled     (set) : links already crawled
+    is_no_go   (func) : the link filter (default is_no_go_link)
     """
     for link in links:
-        # print >>log, 'found link: ' + link
-        try:
-            linkurl = urlparse.urlsplit(link.lower())
-        except Exception:
-            continue
-        if is_no_go_link(linkurl):
-            continue
-        elif not linkurl[1]:
-            if link.startswith('/'):
-                link = 'http://' + url[1] + link
-            else:
-                link = 'http://' + url[1] + '/' + link
-        elif not linkurl[0]:
-            link = 'http://' + link
-        if link not in crawled:
+        link = normalize_link(url, link, is_no_go)
+        if link is not None and link not in crawled:
             to_crawl.add(link)
     return True
 
+def normalize_link(url, link, is_no_go=None):
+    """
+    Return 'link' as an absolute url, or None if it's not acceptable.
+    
+    url (like a list) : the split url of the page 'link' was found on
+    link     (string) : the link
+    is_no_go   (func) : the link filter (default is_no_go_link)
+    """
+    if is_no_go is None:
+        is_no_go = is_no_go_link
+    # print >>log, 'found link: ' + link
+    try:
+        linkurl = urlparse.urlsplit(link.lower())
+    except Exception:
+        return None
+    if is_no_go(linkurl):
+        return None
+    elif not linkurl[1]:
+        if link.startswith('/'):
+            link = 'http://' + url[1] + link
+        else:
+            link = 'http://' + url[1] + '/' + link
+    elif not linkurl[0]:
+        link = 'http://' + link
+    return link
+
+def link_score(link):
+    """
+    Return how promising 'link' looks: links to '.html' or '.htm' pages 
+    (more likely articles long enough to keep) score 1, others 0.
+    """
+    path = urlparse.urlsplit(link)[2]
+    if path.endswith('.html') or path.endswith('.htm'):
+        return 1
+    return 0
+
 def is_no_go_link(linkurl):
     """
     Return True if the link must be avoided (e.g. a 'mailto:' or '.gov' link).
@@ -256,7 +539,7 @@ def is_no_go_link(linkurl):
     linkurl (like list) : the split link
     """
     # block links starting with 'ftp://', 'mailto:' etc.
-    if linkurl[0] and not linkurl[0] == 'http':
+    if linkurl[0] and linkurl[0] not in ('http', 'https'):
         return True
     # block anchor urls
     if not linkurl[1] and not linkurl[2]:
@@ -284,11 +567,51 @@ def is_no_go_link(linkurl):
     return False
 
 def main():
-    """Download 1000 html pages into './html/'."""
-    c = Crawler()
-    status = c.crawl()
-    c.dump_ids_and_urls()
-    return status
+    """
+    Download 1000 html pages into './html/'.
+    
+    If --resume or -r was given continue the last (interrupted) crawl.
+    If --metrics was given print fetch, parse and save timings, page sizes
+    and error counts at the end. If --profile=file was given run under
+    cProfile and save the profile to 'file'.
+    """
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'r', ['resume', 'metrics',
+                                                       'profile='])
+    except getopt.GetoptError:
+        sys.stderr.write('usage: crawler.py [-r | --resume] [--metrics] '
+                         '[--profile=file]\n')
+        return 2
+    resume = False
+    collect_metrics = False
+    profile_file = None
+    for opt, arg in opts:
+        if opt in ('-r', '--resume'):
+            resume = True
+        elif opt == '--metrics':
+            collect_metrics = True
+        elif opt == '--profile':
+            profile_file = arg
+    if collect_metrics:
+        metrics.enable()
+    if profile_file is not None:
+        metrics.start_profile()
+    try:
+        c = Crawler()
+        status = c.crawl(resume)
+        c.dump_ids_and_urls()
+        manifest.make_manifest(urls=c.get_page_urls())
+        stats = c.get_crawl_stats()
+        if stats:
+            print 'Fetched %d pages in %.1f seconds (%.2f pages/second)' % \
+                  (stats['fetched'], stats['seconds'],
+                   stats['pages_per_second'])
+        return status
+    finally:
+        if profile_file is not None:
+            metrics.stop_profile(profile_file)
+        if collect_metrics:
+            metrics.dump()
 
 if __name__ == '__main__':
     status = main()
@@ -0,0 +1,150 @@
+"""
+Per-document statistics saved alongside the index: every document's vector
+norm (the length of its tf-idf vector) and length (number of lemmas).
+
+With them a query can be scored by cosine similarity or BM25 (see
+search_engine.py) without going over the index to work them out.
+
+Layout of a docinfo file (all numbers little-endian):
+
+    header        magic, version, number of doc ids (largest id + 1),
+                  number of documents indexed
+    norms         float32 per doc id (0.0 for ids without a document)
+    lengths       int32 per doc id (0 for ids without a document)
+
+The number of documents is the N the indexer's idfs were computed with
+(every document added, even those without a lemma), so a query's idfs
+match the index's. A document's length is its number of lemmas, as counted
+by vector_space.count_lemmas().
+"""
+
+import os
+import array
+import struct
+from math import sqrt
+# modules I've written:
+from binary_index import _write_array, _read_array
+
+MAGIC = 'SWSEDOC\x00'
+VERSION = 1
+DOCINFO_FILE = 'docinfo.bin'
+
+_HEADER = struct.Struct('<8sIII')
+
+
+class BadDocInfoError(Exception):
+    """Exception raised when a file is not a docinfo file we can read."""
+
+    def __init__(self, filename, reason):
+        self.filename = filename
+        self.reason = reason
+
+    def __str__(self):
+        return 'File \'' + str(self.filename) + '\' is not a docinfo file: ' + \
+               self.reason
+
+
+class DocInfo:
+    """The norms and lengths of the documents, indexed by doc id."""
+
+    def __init__(self, norms, lengths, num_docs=None):
+        """
+        __init__(self, norms, lengths, num_docs=None): 'norms' is an 
+        array('f') and 'lengths' an array('i'), both indexed by doc id. 
+        'num_docs' is the number of documents indexed (default: those with
+        a length).
+        """
+        self.norms = norms
+        self.lengths = lengths
+        if num_docs is None:
+            num_docs = sum([1 for length in lengths if length])
+        self.num_docs = num_docs
+        if self.num_docs:
+            self.average_length = sum(lengths) / float(self.num_docs)
+        else:
+            self.average_length = 0.0
+
+    def __len__(self):
+        return len(self.norms)
+
+
+class DocInfoBuilder:
+    """Collects the norms and lengths of the documents while indexing."""
+
+    def __init__(self):
+        self._squares = {}
+        self._lengths = {}
+
+    def add_document(self, id, length):
+        """
+        add_document(self, id, length): Note the length 'length' (number of
+        lemmas) of document 'id'.
+        """
+        self._lengths[id] = length
+
+    def add_weights(self, ids, weights):
+        """
+        add_weights(self, ids, weights): Add a lemma's weights 'weights' in
+        the documents 'ids' to their norms.
+        """
+        squares = self._squares
+        for id, weight in zip(ids, weights):
+            squares[id] = squares.get(id, 0.0) + weight * weight
+
+    def finish(self):
+        """finish(self): Return the DocInfo."""
+        size = 0
+        if self._lengths:
+            size = max(self._lengths) + 1
+        norms = array.array('f', [0.0]) * size
+        lengths = array.array('i', [0]) * size
+        for id, length in self._lengths.iteritems():
+            lengths[id] = length
+        for id, square in self._squares.iteritems():
+            norms[id] = sqrt(square)
+        return DocInfo(norms, lengths, len(self._lengths))
+
+
+def write_docinfo(info, file):
+    """
+    write_docinfo(info, file): Write the DocInfo 'info' to 'file', opened
+    for writing in binary mode.
+    """
+    file.write(_HEADER.pack(MAGIC, VERSION, len(info.norms), info.num_docs))
+    _write_array(file, 'f', info.norms)
+    _write_array(file, 'i', info.lengths)
+    file.flush()
+
+def save_docinfo(info, filename=DOCINFO_FILE):
+    """
+    save_docinfo(info, filename=DOCINFO_FILE): Save the DocInfo 'info' as
+    'filename' (written to a temporary file first, then renamed).
+    """
+    with open(filename + '.tmp', 'wb') as f:
+        write_docinfo(info, f)
+    os.rename(filename + '.tmp', filename)
+
+def load_docinfo(filename=DOCINFO_FILE):
+    """load_docinfo(filename=DOCINFO_FILE): Read a DocInfo from 'filename'."""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise BadDocInfoError(filename, 'file is too short')
+    magic, version = struct.unpack_from('<8sI', data, 0)
+    if magic != MAGIC:
+        raise BadDocInfoError(filename, 'bad magic number')
+    if version != VERSION:
+        raise BadDocInfoError(filename, 'unsupported version ' + str(version))
+    magic, version, count, num_docs = _HEADER.unpack_from(data, 0)
+    if len(data) != _HEADER.size + 8 * count:
+        raise BadDocInfoError(filename, 'wrong size')
+    norms = _read_array(data, 'f', _HEADER.size, count)
+    lengths = _read_array(data, 'i', _HEADER.size + 4 * count, count)
+    return DocInfo(norms, lengths, num_docs)
+
+def docinfo_file(index_file):
+    """
+    docinfo_file(index_file): Return the name of the docinfo file that goes
+    with the index file 'index_file' (DOCINFO_FILE in the same directory).
+    """
+    return os.path.join(os.path.dirname(index_file), DOCINFO_FILE)
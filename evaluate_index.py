@@ -5,13 +5,27 @@ import sys
 import getopt
 # modules I've written:
 import search_engine
+import morphosyntactic
+import sharded
+import metrics
+import boolean_query
+import query_executor
+
+# default: ten 1-word, four 2-word and one 3-word queries
+DEFAULT_QUERIES = [['whitney'], ['something'], ['cpu'], ['mobile'], ['web'],
+                   ['algorithm'], ['not-a-word'], ['job'], ['record'],
+                   ['linux'], ['whale', 'sea'], ['whatever', 'happen'],
+                   ['mobile', 'job'], ['coffee', 'sleep'],
+                   ['economy', 'market', 'capital']]
 
 def loop(searcher):
     """
     loop(searcher): Display a prompt through which a user can make a query.
     
+    Queries can use AND, OR, NOT and parentheses (see boolean_query.py).
     Loop until the user presses Ctrl-D.
-    'searcher' is a SimpleSearchEngine instance.
+    'searcher' is a SimpleSearchEngine (or sharded.ShardedSearchEngine) 
+    instance.
     """
     # loop until Ctrl-D is pressed
     while True:
@@ -22,14 +36,23 @@ def loop(searcher):
             print
             break
         # check if we're running on linux or windows
-        if os.name != 'nt':
-            # we're on linux (or mac)
-            # clean input, make query and print results
-            results = searcher.query(input)
-        else:
-            # we're on windows (cannot clean input -> need TreeTagger)
-            # just do a simple query (split the input into words first)
-            results = searcher.simple_query(input.split())
+        try:
+            if os.name != 'nt':
+                # we're on linux (or mac)
+                # clean input, make query and print results
+                results = searcher.query(input)
+            elif boolean_query.is_boolean(input):
+                # we're on windows (cannot lemmatize -> use the words as 
+                # they are)
+                results = searcher.query(input, lemmatize=str.split)
+            else:
+                # we're on windows (cannot clean input -> need TreeTagger)
+                # just do a simple query (split the input into words first)
+                results = searcher.simple_query(input.split())
+        except boolean_query.BooleanQueryError as e:
+            print str(e)
+            print
+            continue
         # print results:
         if len(results):
             print 'Results:'
@@ -39,25 +62,73 @@ def loop(searcher):
             print 'Sorry, no files match the query.. Please try again'
         print 
 
-def evaluate(searcher, queries=None, repeat=100):
+def evaluate(searcher, queries=None, repeat=100, top_k=None, 
+             concurrency=None):
     """
-    evaluate(searcher, queries=None, repeat): Run a series of queries 
-    on the index 'repeat' times and return the average query time.
+    evaluate(searcher, queries=None, repeat, top_k=None, concurrency=None):
+    Run a series of queries on the index 'repeat' times and return the 
+    average query time.
 
-    'searcher' is a SimpleSearchEngine instance (contains the index)
+    'searcher' is a SimpleSearchEngine or sharded.ShardedSearchEngine 
+               instance (contains the index)
     'queries' is a list of lists containing strings (the queries)
     'repeat' is an integer (number of times to run the queries)
+    'top_k' is an integer (only ask for the 'top_k' best results) or None
+    'concurrency' is an integer (answer the queries with that many 
+               processes at the same time, see query_executor.py; the 
+               result is then the elapsed time divided by the number of
+               queries, i.e. 1 / aggregate throughput) or None
     """
     if queries == None:
-        # default: ten 1-word, four 2-word and one 3-word queries
-        queries = [['whitney'], ['something'], ['cpu'], ['mobile'], ['web'],
-                   ['algorithm'], ['not-a-word'], ['job'], ['record'],
-                   ['linux'], ['whale', 'sea'], ['whatever', 'happen'],
-                   ['mobile', 'job'], ['coffee', 'sleep'],
-                   ['economy', 'market', 'capital']]
-    avg_time = searcher.evaluate(queries, repeat)
+        queries = DEFAULT_QUERIES
+    if concurrency is not None:
+        with query_executor.QueryExecutor(searcher, concurrency) as executor:
+            result = executor.evaluate(queries, repeat, top_k)
+        return result['seconds'] / max(1, result['queries'])
+    avg_time = searcher.evaluate(queries, repeat, top_k)
     return avg_time
 
+def evaluate_concurrency(searcher, concurrencies, queries=None, repeat=100,
+                         top_k=10):
+    """
+    evaluate_concurrency(searcher, concurrencies, queries=None, repeat=100,
+    top_k=10): Answer the queries with every number of processes in 
+    'concurrencies' (see evaluate()) and return a list of (processes, 
+    queries per second) tuples.
+    """
+    results = []
+    for concurrency in concurrencies:
+        avg_time = evaluate(searcher, queries, repeat, top_k, concurrency)
+        results.append((concurrency, 1.0 / max(avg_time, 1e-9)))
+    return results
+
+def evaluate_shards(shard_counts, index_file='index.bin', 
+                    urls_file=None, queries=None, repeat=100, 
+                    top_k=10):
+    """
+    evaluate_shards(shard_counts, index_file='index.bin', 
+    urls_file=None, queries=None, repeat=100, top_k=10): Serve the
+    binary index 'index_file' with every number of shards in 'shard_counts'
+    (see sharded.py) and return a list of (shards, queries per second) 
+    tuples.
+    """
+    results = []
+    for num_shards in shard_counts:
+        with sharded.ShardedSearchEngine(index_file, urls_file, 
+                                         num_shards) as searcher:
+            avg_time = evaluate(searcher, queries, repeat, top_k)
+        results.append((num_shards, 1.0 / max(avg_time, 1e-9)))
+    return results
+
+def _doubling(n):
+    """Return [1, 2, 4, ...], up to 'n'."""
+    counts = []
+    count = 1
+    while count <= n:
+        counts.append(count)
+        count *= 2
+    return counts
+
 def _print_help():
     """
     Show the command line user info about expected command line arguments etc.
@@ -68,8 +139,39 @@ def _print_help():
     print '   -h or --help                      display this help message'
     print '   -i <file> or --index=<file>       load index from file <file>'
     print '   -u <file> or --urls=<file>        load url-map from file <file>'
+    print '   -f <fmt> or --format=<fmt>        index file format, \'xml\' or '
+    print '                                     \'binary\' (default: guess from '
+    print '                                     the file, \'index.xml\' if no '
+    print '                                     index file was given)'
+    print '   -l <name> or --lemmatizer=<name>  lemmatize queries with \'gposttl\''
+    print '                                     or the \'python\' fallback '
+    print '                                     (default: gposttl if installed)'
+    print '   -P <file> or --positions=<file>   load the positional index <file>'
+    print '                                     for "phrase queries" and '
+    print '                                     proximity scoring'
+    print '   --numpy                           score queries with NumPy'
+    print '   --scoring=<mode>                  rank pages by \'tfidf\' '
+    print '                                     (default), \'cosine\' or '
+    print '                                     \'bm25\' (needs docinfo.bin)'
+    print '   -n <n> or --shards=<n>            answer queries with <n> worker'
+    print '                                     processes, each owning a shard'
+    print '                                     of a binary index'
+    print '   --qps=<n>                         print the queries per second '
+    print '                                     with 1, 2, 4, ... <n> shards '
+    print '                                     and exit'
+    print '   -c <n> or --concurrency=<n>       print the queries per second '
+    print '                                     answering queries with 1, 2, '
+    print '                                     4, ... <n> processes at once '
+    print '                                     and exit'
     print '   -m or --makeindex                 make index file from scratch '
     print '                                     (overrides -i and -u)'
+    print '   -s or --streaming                 with -m, index pages as they '
+    print '                                     are crawled, without saving '
+    print '                                     intermediate files'
+    print '   --metrics                         print per-stage timings and '
+    print '                                     counters at exit'
+    print '   --profile=<file>                  run under cProfile and save '
+    print '                                     the profile to <file>'
 
 def main(argv):
     """
@@ -81,23 +183,60 @@ def main(argv):
     from file 'filename'.
     If --urls=filename or -u filename was specified load the url-map
     from file 'filename'.
+    If --format=fmt or -f fmt was specified load the index as an 'xml' or 
+    a 'binary' index file (default index file 'index.bin' for 'binary').
+    If --lemmatizer=name or -l name was specified lemmatize queries with 
+    'gposttl' or with the pure-Python fallback ('python').
+    If --positions=file or -P file was specified load the positional index
+    'file' (see positional_index.py): queries in double quotes are phrase 
+    queries and pages with the query's lemmas close together rank higher.
+    If --numpy was specified score queries with NumPy (numpy_scoring.py).
+    If --scoring=mode was specified rank pages by 'tfidf', 'cosine' or 
+    'bm25' (the last two need the documents' norms and lengths, see 
+    docinfo.py).
+    If --shards=n or -n n was specified answer queries with n processes, 
+    each owning a shard of the binary index (see sharded.py).
+    If --qps=n was specified print the queries per second with 1, 2, 4, ... 
+    n shards and exit.
+    If --concurrency=n or -c n was specified print the aggregate queries 
+    per second answering queries with 1, 2, 4, ... n processes sharing the
+    index (see query_executor.py) and exit.
+    If --metrics was specified print the time spent in every stage 
+    (cleaning, lemmatizing, scoring, ...) and other counters at exit.
+    If --profile=file was specified run everything under cProfile, save 
+    the profile to 'file' and print the most expensive functions at exit.
     If --makeindex or -m  was specified create the index and url-map 
-    from scratch. 
+    from scratch. With --streaming or -s, index the pages as they are
+    crawled.
     If no argument was given for the index or url-map they will be loaded 
-    from 'index.xml' and 'urls.pickle' respectively.
+    from 'index.xml' and 'urls.bin' (or 'urls.pickle') respectively.
     """
     # parse command line arguments:
     try:
-        opts, args = getopt.getopt(argv, 'hi:u:m', ['help', 'index=', 
-                                                    'urls=', 'makeindex'])
+        opts, args = getopt.getopt(argv, 'hi:u:f:l:msn:P:c:',
+                                   ['help', 'index=', 'urls=', 'format=',
+                                    'lemmatizer=', 'positions=',
+                                    'makeindex', 'streaming', 'shards=',
+                                    'qps=', 'numpy', 'metrics', 'profile=',
+                                    'scoring=', 'concurrency='])
     except getopt.GetoptError:
         # print help
         _print_help()
         return 2
     # initialize variables:
-    index_file = 'index.xml'
-    urls_file = 'urls.pickle'
+    index_file = None
+    urls_file = None
+    index_format = None
     make_index = False
+    streaming = False
+    num_shards = None
+    max_shards = None
+    max_concurrency = None
+    positions_file = None
+    use_numpy = False
+    scoring = None
+    collect_metrics = False
+    profile_file = None
     # check command line arguments:
     for opt, arg in opts:
         if opt in ('-h', '--help'):
@@ -109,19 +248,88 @@ def main(argv):
         elif opt in ('-u', '--urls'):
             urls_file = arg
             continue
+        elif opt in ('-f', '--format'):
+            if arg not in ('xml', 'binary'):
+                _print_help()
+                return 2
+            index_format = arg
+            continue
+        elif opt in ('-l', '--lemmatizer'):
+            if arg not in ('gposttl', 'python'):
+                _print_help()
+                return 2
+            morphosyntactic.set_query_lemmatizer(arg)
+            continue
         elif opt in ('-m', '--makeindex'):
             make_index = True
+        elif opt in ('-s', '--streaming'):
+            streaming = True
+        elif opt in ('-P', '--positions'):
+            positions_file = arg
+        elif opt in ('-n', '--shards'):
+            num_shards = int(arg)
+        elif opt == '--qps':
+            max_shards = int(arg)
+        elif opt in ('-c', '--concurrency'):
+            max_concurrency = int(arg)
+        elif opt == '--numpy':
+            use_numpy = True
+        elif opt == '--scoring':
+            if arg not in search_engine.SCORING_MODES:
+                _print_help()
+                return 2
+            scoring = arg
+        elif opt == '--metrics':
+            collect_metrics = True
+        elif opt == '--profile':
+            profile_file = arg
     # main:
-    searcher = search_engine.SimpleSearchEngine()
-    if make_index:
-        print 'An index will be created from scratch. (CTRL-C to exit)' 
-        print 'Please be patient, this will take a while..'
-        searcher.make_index_and_urls()
-    else:
-        print 'Loading index and url-map..'
-        searcher.load_index_and_urls(index_file, urls_file)
-    loop(searcher)
-    return 0
+    if collect_metrics:
+        metrics.enable()
+    if profile_file is not None:
+        metrics.start_profile()
+    try:
+        if (max_shards is not None or num_shards is not None) and \
+           index_file is None:
+            # shards are made of the binary index
+            index_file = 'index.bin'
+        if max_shards is not None:
+            for n, qps in evaluate_shards(_doubling(max_shards), index_file,
+                                          urls_file):
+                print '%3d shards: %10.1f queries/second' % (n, qps)
+            return 0
+        if num_shards is not None:
+            print 'Starting ' + str(num_shards) + ' shard workers..'
+            with sharded.ShardedSearchEngine(index_file, urls_file, 
+                                             num_shards) as searcher:
+                loop(searcher)
+            return 0
+        searcher = search_engine.SimpleSearchEngine()
+        if make_index:
+            print 'An index will be created from scratch. (CTRL-C to exit)' 
+            print 'Please be patient, this will take a while..'
+            searcher.make_index_and_urls(streaming)
+        else:
+            print 'Loading index and url-map..'
+            searcher.load_index_and_urls(index_file, urls_file, index_format)
+        if positions_file is not None:
+            searcher.load_positional_index(positions_file)
+        if use_numpy:
+            searcher.use_numpy()
+        if scoring is not None:
+            searcher.set_scoring(scoring)
+        if max_concurrency is not None:
+            for n, qps in evaluate_concurrency(searcher, 
+                                               _doubling(max_concurrency)):
+                print '%3d processes: %10.1f queries/second' % (n, qps)
+            return 0
+        loop(searcher)
+        return 0
+    finally:
+        if profile_file is not None:
+            metrics.stop_profile(profile_file)
+        if collect_metrics:
+            metrics.dump()
 
 if __name__ == '__main__':
     status = main(sys.argv[1:])
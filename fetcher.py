@@ -0,0 +1,300 @@
+"""
+Concurrent page fetching for the crawler.
+
+A Fetcher runs a pool of threads that download pages over keep-alive HTTP
+or HTTPS connections (one per thread, scheme and host), optionally under a
+global rate limit. HostQueues decides which url may be fetched next, so
+that no host gets more than a few requests at a time and consecutive
+requests to the same host are spaced out.
+
+Redirects on the same host are followed at once. A redirect to another
+host isn't: the fetcher hands the new url back (FetchResult.redirect), to
+be queued for that host like any other url.
+"""
+
+import time
+import socket
+import httplib
+import urlparse
+import threading
+import Queue
+from collections import deque
+# modules I've written:
+import metrics
+
+USER_AGENT = 'simple-web-search-engine'
+MAX_REDIRECTS = 5
+
+
+class FetchError(Exception):
+    """Exception raised when a page couldn't be downloaded."""
+
+    def __init__(self, url, reason):
+        self.url = url
+        self.reason = reason
+
+    def __str__(self):
+        return 'Could not fetch \'' + self.url + '\': ' + str(self.reason)
+
+
+class FetchedPage:
+    """
+    A downloaded page. Looks like the handle urllib2.urlopen() returns, as
+    far as the crawler is concerned (getcode, geturl, info, headers, read).
+    """
+
+    def __init__(self, url, code, headers, body):
+        self._url = url
+        self._code = code
+        self.headers = headers
+        self._body = body
+
+    def getcode(self):
+        return self._code
+
+    def geturl(self):
+        return self._url
+
+    def info(self):
+        return self.headers
+
+    def read(self):
+        return self._body
+
+    def close(self):
+        pass
+
+
+class FetchResult:
+    """
+    What a fetcher thread hands back: a page, the reason it failed or the
+    url on another host it was redirected to.
+    """
+
+    def __init__(self, url, host, page=None, error=None, redirect=None):
+        self.url = url
+        self.host = host
+        self.page = page
+        self.error = error
+        self.redirect = redirect
+
+
+class RateLimiter:
+    """A token bucket allowing 'rate' requests per second (thread-safe)."""
+
+    def __init__(self, rate, burst=1):
+        self._rate = float(rate)
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """wait(self): Block until a request may be made."""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self._burst, self._tokens +
+                                   (now - self._last) * self._rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                delay = (1.0 - self._tokens) / self._rate
+            time.sleep(delay)
+
+
+class HostQueues:
+    """
+    One queue of urls per host. pop() only returns urls of hosts that have
+    fewer than 'max_per_host' requests in flight and whose last request
+    finished at least 'delay' seconds ago.
+    """
+
+    def __init__(self, max_per_host=1, delay=0.0):
+        self._max_per_host = max_per_host
+        self._delay = delay
+        self._queues = {}           # host -> deque of urls
+        self._active = {}           # host -> requests in flight
+        self._next_time = {}        # host -> earliest time of next request
+        self._ready = deque()       # hosts that may have urls to hand out
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, url, host):
+        """add(self, url, host): Queue 'url', a page on 'host'."""
+        if host not in self._queues:
+            self._queues[host] = deque()
+            self._ready.append(host)
+        self._queues[host].append(url)
+        self._size += 1
+
+    def pop(self):
+        """
+        pop(self): Return a (url, host) tuple that may be fetched now, or
+        None. Hosts take turns.
+        """
+        now = time.time()
+        for i in xrange(len(self._ready)):
+            host = self._ready[0]
+            self._ready.rotate(-1)
+            if self._active.get(host, 0) >= self._max_per_host or \
+               self._next_time.get(host, 0.0) > now:
+                continue
+            url = self._queues[host].popleft()
+            self._size -= 1
+            if not self._queues[host]:
+                del self._queues[host]
+                self._ready.remove(host)
+            self._active[host] = self._active.get(host, 0) + 1
+            return url, host
+        return None
+
+    def release(self, host):
+        """release(self, host): A request to 'host' finished."""
+        self._active[host] -= 1
+        if not self._active[host]:
+            del self._active[host]
+        if self._delay:
+            self._next_time[host] = time.time() + self._delay
+
+    def wait_time(self):
+        """
+        wait_time(self): Seconds until some queued url may be fetched.
+        """
+        now = time.time()
+        times = [self._next_time.get(host, now) - now for host in self._ready]
+        if not times:
+            return 0.0
+        return max(0.0, min(times))
+
+
+class Fetcher:
+    """A pool of threads downloading pages."""
+
+    def __init__(self, threads=8, timeout=2, rate=None):
+        """
+        __init__(self, threads=8, timeout=2, rate=None): Fetch with 'threads'
+        threads. 'timeout' is the socket timeout in seconds and 'rate' (if
+        given) the maximum number of requests per second over all threads.
+        """
+        self._timeout = timeout
+        self._limiter = None
+        if rate:
+            self._limiter = RateLimiter(rate)
+        self._todo = Queue.Queue()
+        self._done = Queue.Queue()
+        self._threads = []
+        for i in xrange(threads):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, url, host):
+        """submit(self, url, host): Fetch 'url' (a page on 'host')."""
+        self._todo.put((url, host))
+
+    def get(self, timeout=None):
+        """
+        get(self, timeout=None): Return the next FetchResult. Raise
+        Queue.Empty if none is ready within 'timeout' seconds.
+        """
+        return self._done.get(True, timeout)
+
+    def stop(self):
+        """
+        stop(self): Tell the threads to exit once they're done and wait for
+        them (a thread can't take much longer than a socket timeout for every
+        url it was given).
+        """
+        for thread in self._threads:
+            self._todo.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        connections = {}
+        while True:
+            item = self._todo.get()
+            if item is None:
+                break
+            url, host = item
+            try:
+                with metrics.timer('crawl.fetch'):
+                    self._done.put(self._fetch(url, host, connections))
+            except FetchError as e:
+                metrics.count('crawl.fetch_errors')
+                self._done.put(FetchResult(url, host, error=e))
+            except Exception as e:
+                metrics.count('crawl.fetch_errors')
+                self._done.put(FetchResult(url, host, error=FetchError(url,
+                                                                       e)))
+        for connection in connections.itervalues():
+            connection.close()
+
+    def _request(self, scheme, netloc, path, connections):
+        """
+        Make a GET request, reusing a connection to 'netloc' over 'scheme'
+        ('http' or 'https') if we can.
+        """
+        key = (scheme, netloc)
+        for attempt in (0, 1):
+            reused = key in connections
+            if not reused:
+                if scheme == 'https':
+                    connections[key] = httplib.HTTPSConnection(
+                        netloc, timeout=self._timeout)
+                else:
+                    connections[key] = httplib.HTTPConnection(
+                        netloc, timeout=self._timeout)
+            connection = connections[key]
+            try:
+                connection.request('GET', path, headers={
+                    'User-Agent': USER_AGENT, 'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                del connections[key]
+                if reused and attempt == 0:
+                    # the server closed the idle connection, try a new one
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+                del connections[key]
+            return response, body
+
+    def _fetch(self, url, host, connections):
+        """
+        Download 'url', a page on 'host', following redirects on the same
+        host. Return a FetchResult.
+        """
+        requested = url
+        for hop in xrange(MAX_REDIRECTS + 1):
+            parts = urlparse.urlsplit(url)
+            if parts[0] not in ('http', 'https'):
+                raise FetchError(url, 'not an http or https url')
+            if parts[1] != host:
+                # the other host's turn will come (see HostQueues)
+                return FetchResult(requested, host, redirect=url)
+            path = parts[2] or '/'
+            if parts[3]:
+                path += '?' + parts[3]
+            if self._limiter is not None:
+                self._limiter.wait()
+            try:
+                response, body = self._request(parts[0], parts[1], path,
+                                               connections)
+            except (httplib.HTTPException, socket.error) as e:
+                raise FetchError(url, e)
+            location = response.getheader('location')
+            if response.status in (301, 302, 303, 307) and location:
+                url = urlparse.urljoin(url, location)
+                continue
+            return FetchResult(requested, host, page=FetchedPage(
+                url, response.status, response.msg, body))
+        raise FetchError(url, 'too many redirects')
@@ -0,0 +1,315 @@
+"""
+The crawl frontier: the urls waiting to be crawled, and the urls seen.
+
+Frontier is a priority queue kept mostly on disk. There is one FIFO queue
+per priority level; each queue holds only its head and tail in memory,
+everything in between lives in append-only segment files. Lower priority
+numbers are crawled first.
+
+The seen-url sets remember every url ever added to the frontier without
+storing the urls themselves: FingerprintSet keeps a 64-bit hash of each
+url, BloomFilter a few bits.
+
+Both can be checkpointed cheaply (see Crawler._checkpoint()): the
+frontier's state is its in-memory heads and tails plus the names of its
+segment files, which never change once written, and a FingerprintSet
+only appends the fingerprints added since the last checkpoint to its
+file.
+"""
+
+import os
+import math
+import glob
+import struct
+import hashlib
+from collections import deque
+
+
+def fingerprint(url):
+    """fingerprint(url): Return a 64-bit hash (an int) of 'url'."""
+    return int(hashlib.md5(url).hexdigest()[:16], 16)
+
+
+class FingerprintSet:
+    """A set of urls that only keeps a 64-bit fingerprint of each url."""
+
+    def __init__(self):
+        self._fingerprints = set()
+        self._unsaved = []              # added since the last save()
+
+    def add(self, url):
+        fp = fingerprint(url)
+        if fp not in self._fingerprints:
+            self._fingerprints.add(fp)
+            self._unsaved.append(fp)
+
+    def __contains__(self, url):
+        return fingerprint(url) in self._fingerprints
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    def save(self, filename):
+        """
+        save(self, filename): Append the fingerprints added since the last
+        save() to 'filename' and return the file's new size.
+        """
+        with open(filename, 'ab') as f:
+            f.write(struct.pack('<%dQ' % len(self._unsaved), *self._unsaved))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        self._unsaved = []
+        return size
+
+    def load(self, filename, size):
+        """
+        load(self, filename, size): Load the fingerprints in the first 
+        'size' bytes of 'filename' (what save() returned) and cut off the
+        rest of the file.
+        """
+        with open(filename, 'r+b') as f:
+            data = f.read(size)
+            f.truncate(size)
+        self._fingerprints = set(struct.unpack('<%dQ' % (len(data) // 8),
+                                               data))
+        self._unsaved = []
+
+
+class BloomFilter:
+    """
+    A Bloom filter of urls: tiny, but might claim to contain a url it was
+    never given (with probability about 'error_rate' once it holds
+    'capacity' urls). Such a url would never be crawled.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        # the usual optimal number of bits and of hash functions
+        bits = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self._num_bits = max(8, bits)
+        self._num_hashes = max(1, int(round(math.log(2) * self._num_bits /
+                                            capacity)))
+        self._bits = bytearray((self._num_bits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, url):
+        # double hashing: the i-th bit is h1 + i * h2
+        digest = hashlib.md5(url).hexdigest()
+        h1, h2 = int(digest[:16], 16), int(digest[16:], 16) | 1
+        return [(h1 + i * h2) % self._num_bits
+                for i in xrange(self._num_hashes)]
+
+    def add(self, url):
+        for bit in self._positions(url):
+            self._bits[bit >> 3] |= 1 << (bit & 7)
+        self._count += 1
+
+    def __contains__(self, url):
+        for bit in self._positions(url):
+            if not self._bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self._count
+
+    def save(self, filename):
+        """
+        save(self, filename): Write the filter to 'filename'. (the whole 
+        filter - it's small) Return the number of bytes written.
+        """
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(struct.pack('<Q', self._count))
+            f.write(self._bits)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(filename + '.tmp', filename)
+        return 8 + len(self._bits)
+
+    def load(self, filename, size):
+        """load(self, filename, size): Load what save() wrote."""
+        with open(filename, 'rb') as f:
+            data = f.read(size)
+        self._count = struct.unpack('<Q', data[:8])[0]
+        self._bits = bytearray(data[8:])
+
+
+class _SegmentQueue:
+    """
+    A FIFO queue of (url, depth) entries. New entries collect in memory and
+    are written to an append-only segment file every 'segment_size'
+    entries; old ones are read back a segment at a time.
+
+    A segment file that has been read back is only deleted by sweep(), so
+    the last checkpoint can still find it.
+    """
+
+    def __init__(self, prefix, segment_size, state=None):
+        self._prefix = prefix
+        self._segment_size = segment_size
+        self._head = deque()            # entries read back from disk
+        self._tail = []                 # entries not yet written to disk
+        self._segments = deque()        # segment numbers, oldest first
+        self._consumed = []             # segments read back, not deleted
+        self._next_segment = 0
+        self._size = 0
+        if state is not None:
+            self._head = deque(state['head'])
+            self._tail = list(state['tail'])
+            self._segments = deque(state['segments'])
+            self._next_segment = state['next_segment']
+            self._size = state['size']
+
+    def state(self):
+        """Return what it takes to rebuild the queue (see __init__)."""
+        return {'head': list(self._head), 'tail': list(self._tail),
+                'segments': list(self._segments),
+                'next_segment': self._next_segment, 'size': self._size}
+
+    def segment_files(self):
+        """Return the names of the segment files the queue still needs."""
+        return [self._filename(segment) for segment in self._segments]
+
+    def sweep(self):
+        """Delete the segment files that have been read back."""
+        for segment in self._consumed:
+            filename = self._filename(segment)
+            if os.path.exists(filename):
+                os.remove(filename)
+        self._consumed = []
+
+    def __len__(self):
+        return self._size
+
+    def _filename(self, segment):
+        return self._prefix + '%08d.seg' % segment
+
+    def append(self, url, depth):
+        self._tail.append((url, depth))
+        self._size += 1
+        if len(self._tail) >= self._segment_size:
+            self._spill()
+
+    def _spill(self):
+        """Write the in-memory tail to a new segment file."""
+        segment = self._next_segment
+        self._next_segment += 1
+        with open(self._filename(segment), 'w') as f:
+            for url, depth in self._tail:
+                f.write(str(depth) + '\t' + url + '\n')
+        self._segments.append(segment)
+        self._tail = []
+
+    def popleft(self):
+        if not self._head:
+            if self._segments:
+                # read the oldest segment back
+                segment = self._segments.popleft()
+                with open(self._filename(segment), 'r') as f:
+                    for line in f:
+                        depth, url = line.rstrip('\n').split('\t', 1)
+                        self._head.append((url, int(depth)))
+                self._consumed.append(segment)
+            else:
+                self._head.extend(self._tail)
+                self._tail = []
+        self._size -= 1
+        return self._head.popleft()
+
+    def remove_files(self):
+        self._consumed.extend(self._segments)
+        self._segments.clear()
+        self.sweep()
+
+
+class Frontier:
+    """
+    A disk-backed priority queue of urls to crawl. pop() returns the oldest
+    entry with the smallest priority number.
+    """
+
+    def __init__(self, directory='./frontier', levels=8, segment_size=1000,
+                 state=None):
+        """
+        __init__(self, directory='./frontier', levels=8, segment_size=1000,
+        state=None): Keep segment files in 'directory' (made if it doesn't
+        exist). Priorities are clamped to 0 .. 'levels' - 1.
+
+        If 'state' (what state() returned) is given, continue from there; 
+        otherwise start empty. Segment files in 'directory' the frontier
+        doesn't need are deleted.
+        """
+        self._directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if state is not None:
+            levels = len(state['queues'])
+            queue_states = state['queues']
+        else:
+            queue_states = [None] * levels
+        self._queues = [_SegmentQueue(os.path.join(directory,
+                                                   'level%d-' % level),
+                                      segment_size, queue_states[level])
+                        for level in xrange(levels)]
+        self._size = sum([len(queue) for queue in self._queues])
+        needed = set()
+        for queue in self._queues:
+            needed.update(queue.segment_files())
+        for filename in glob.glob(os.path.join(directory, '*.seg')):
+            if filename not in needed:
+                os.remove(filename)
+
+    def state(self):
+        """
+        state(self): Return the frontier's state (a dict that can be 
+        pickled). Together with the segment files it names, it's enough to
+        rebuild the frontier.
+        """
+        return {'queues': [queue.state() for queue in self._queues]}
+
+    def sweep(self):
+        """
+        sweep(self): Delete segment files that have been read back. Call it
+        after saving a checkpoint.
+        """
+        for queue in self._queues:
+            queue.sweep()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, url, depth=0, priority=0):
+        """
+        add(self, url, depth=0, priority=0): Queue 'url', found 'depth' links
+        away from a seed, with priority 'priority'.
+        """
+        level = min(max(int(priority), 0), len(self._queues) - 1)
+        self._queues[level].append(url, depth)
+        self._size += 1
+
+    def pop(self):
+        """pop(self): Return the next (url, depth) to crawl, or None."""
+        for queue in self._queues:
+            if len(queue):
+                self._size -= 1
+                return queue.popleft()
+        return None
+
+    def close(self):
+        """close(self): Delete the frontier's segment files."""
+        for queue in self._queues:
+            queue.remove_files()
+
+
+def link_priority(depth, host_count, score=0, host_quota=50):
+    """
+    link_priority(depth, host_count, score=0, host_quota=50): Return the
+    priority of a link (smaller is crawled sooner).
+
+    depth      (int) : links away from a seed
+    host_count (int) : links of the same host already queued, so one host
+                       can't take over the frontier: every 'host_quota'
+                       links add one to the priority
+    score      (int) : how promising the link looks (larger is better)
+    """
+    return depth + host_count // host_quota - score
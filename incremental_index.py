@@ -0,0 +1,381 @@
+"""
+An inverted index that can take new, changed and deleted documents
+without being rebuilt.
+
+The index keeps every document's raw term frequencies and every term's
+document frequency, and only multiplies by the idf when a term's postings
+are asked for, so adding a document doesn't change what's stored for any
+other document.
+
+New documents collect in a small in-memory buffer. Once it holds
+'max_buffered_docs' documents it is turned into an immutable segment.
+Deleting a document only records a tombstone in its segment; the document
+is really dropped when its segment is merged with others. Segments are
+merged (in a background thread by default) whenever 'merge_factor' of
+them are about the same size, so there are never many of them.
+
+An IncrementalIndex looks like the dicts of postings lists indexer.py
+makes (index[lemma], get, in, len, iterkeys), so SimpleSearchEngine can
+query it while documents are being added.
+"""
+
+import threading
+from math import log10
+from itertools import izip
+# modules I've written:
+import postings
+
+
+class Segment:
+    """
+    An immutable batch of documents: the raw tf postings of every term in
+    them, and the tombstones of the ones deleted since.
+    """
+
+    def __init__(self, term_postings, doc_ids):
+        """
+        __init__(self, term_postings, doc_ids): 'term_postings' maps terms
+        to postings.Postings of raw tfs and 'doc_ids' are the documents in
+        the segment.
+        """
+        self.postings = term_postings
+        self.doc_ids = frozenset(doc_ids)
+        self.deleted = set()
+
+    @classmethod
+    def from_buffer(cls, buffer, doc_ids):
+        """
+        from_buffer(cls, buffer, doc_ids): Make a segment of 'buffer', a
+        {term: {doc_id: tf}} dict, holding the documents 'doc_ids'.
+        """
+        return cls(dict([(term, postings.Postings.from_dict(tfs))
+                         for term, tfs in buffer.iteritems()]), doc_ids)
+
+    def num_live_docs(self):
+        """num_live_docs(self): Documents in the segment not deleted."""
+        return len(self.doc_ids) - len(self.deleted)
+
+
+def merge_segments(segments, deleted=None):
+    """
+    merge_segments(segments, deleted=None): Return a new Segment with the
+    documents of 'segments' that aren't deleted. 'deleted' is a list with
+    the tombstones to use for every segment (default: their own).
+    """
+    if deleted is None:
+        deleted = [segment.deleted for segment in segments]
+    pairs = {}
+    doc_ids = set()
+    for segment, dead in izip(segments, deleted):
+        doc_ids.update(segment.doc_ids - dead)
+        for term, term_postings in segment.postings.iteritems():
+            for id, tf in izip(term_postings.ids, term_postings.weights):
+                if id not in dead:
+                    pairs.setdefault(term, []).append((id, tf))
+    return Segment(dict([(term, postings.Postings.from_pairs(term_pairs))
+                         for term, term_pairs in pairs.iteritems()]),
+                   doc_ids)
+
+
+class IncrementalIndex:
+    """
+    An index documents can be added to and deleted from at any time, by
+    any thread, while it's being queried.
+    """
+
+    def __init__(self, max_buffered_docs=100, merge_factor=8,
+                 background_merges=True):
+        """
+        __init__(self, max_buffered_docs=100, merge_factor=8,
+        background_merges=True): Turn the in-memory buffer into a segment
+        every 'max_buffered_docs' documents and merge 'merge_factor'
+        segments of about the same size into one. Merges run in a
+        background thread unless 'background_merges' == False.
+        """
+        self._max_buffered_docs = max_buffered_docs
+        self._merge_factor = max(2, merge_factor)
+        self._background_merges = background_merges
+        self._lock = threading.RLock()
+        self._merge_done = threading.Condition(self._lock)
+        self._buffer = {}           # term -> {doc_id: tf}, not yet a segment
+        self._buffered_docs = set()
+        self._segments = []
+        self._location = {}         # live doc_id -> its Segment (or None)
+        self._doc_terms = {}        # live doc_id -> tuple of its terms
+        self._df = {}               # term -> live documents containing it
+        self._cache = {}            # term -> Postings with the idf applied
+        self._merging = False
+        self._closed = False
+        self._merge_thread = None
+        self._merge_wanted = threading.Event()
+
+    # -- updates --
+
+    def add_document(self, id, term_freqs):
+        """
+        add_document(self, id, term_freqs): Add document 'id' with the term
+        frequencies 'term_freqs' ({lemma: tf}). If there already is a
+        document 'id' it's replaced.
+        """
+        with self._lock:
+            if id in self._location:
+                self._delete(id)
+            terms = []
+            for term, tf in term_freqs.iteritems():
+                # gposttl's <unknown> lemma isn't indexed (see indexer.py)
+                if term == '<unknown>':
+                    continue
+                self._buffer.setdefault(term, {})[id] = tf
+                self._df[term] = self._df.get(term, 0) + 1
+                terms.append(term)
+            self._doc_terms[id] = tuple(terms)
+            self._location[id] = None
+            self._buffered_docs.add(id)
+            self._cache.clear()
+            if len(self._buffered_docs) >= self._max_buffered_docs:
+                self.flush()
+
+    def delete_document(self, id):
+        """
+        delete_document(self, id): Delete document 'id'. Return False if
+        there was no such document.
+        """
+        with self._lock:
+            if id not in self._location:
+                return False
+            self._delete(id)
+            self._cache.clear()
+            return True
+
+    def _delete(self, id):
+        """Forget live document 'id' (the lock must be held)."""
+        segment = self._location.pop(id)
+        for term in self._doc_terms.pop(id):
+            self._df[term] -= 1
+            if not self._df[term]:
+                del self._df[term]
+            if segment is None:
+                del self._buffer[term][id]
+                if not self._buffer[term]:
+                    del self._buffer[term]
+        if segment is None:
+            self._buffered_docs.discard(id)
+        else:
+            segment.deleted.add(id)
+
+    def flush(self):
+        """
+        flush(self): Turn the documents in the in-memory buffer into a new
+        segment (and start a merge if one is due).
+        """
+        with self._lock:
+            if not self._buffered_docs:
+                return
+            segment = Segment.from_buffer(self._buffer, self._buffered_docs)
+            for id in self._buffered_docs:
+                self._location[id] = segment
+            self._segments.append(segment)
+            self._buffer = {}
+            self._buffered_docs = set()
+        self._maybe_merge()
+
+    # -- merging --
+
+    def _level(self, segment):
+        """
+        Return the size class of 'segment': 0 up to 'max_buffered_docs' *
+        'merge_factor' documents, 1 up to 'merge_factor' times that, etc.
+        """
+        level = 0
+        size = self._max_buffered_docs * self._merge_factor
+        while segment.num_live_docs() >= size:
+            level += 1
+            size *= self._merge_factor
+        return level
+
+    def _pick_merge(self):
+        """
+        Return the segments to merge next, or None (the lock must be held):
+        'merge_factor' segments of the smallest level that has that many.
+        """
+        levels = {}
+        for segment in self._segments:
+            levels.setdefault(self._level(segment), []).append(segment)
+        for level in sorted(levels):
+            if len(levels[level]) >= self._merge_factor:
+                return levels[level][:self._merge_factor]
+        return None
+
+    def _maybe_merge(self):
+        if self._background_merges:
+            with self._lock:
+                if self._merge_thread is None and not self._closed:
+                    self._merge_thread = threading.Thread(
+                        target=self._merge_loop)
+                    self._merge_thread.daemon = True
+                    self._merge_thread.start()
+            self._merge_wanted.set()
+        else:
+            while self._merge_once():
+                pass
+
+    def _merge_loop(self):
+        while True:
+            self._merge_wanted.wait()
+            self._merge_wanted.clear()
+            if self._closed:
+                return
+            while self._merge_once():
+                pass
+
+    def _merge_once(self, segments=None):
+        """
+        Merge 'segments' (default: what _pick_merge() picks) into one. The
+        segments are read without holding the lock, so queries and updates
+        go on meanwhile. Return False if there was nothing to merge.
+        """
+        with self._lock:
+            if self._merging:
+                return False
+            if segments is None:
+                segments = self._pick_merge()
+            elif [segment for segment in segments
+                  if segment not in self._segments]:
+                # merged away meanwhile
+                return False
+            if not segments:
+                return False
+            self._merging = True
+            deleted = [set(segment.deleted) for segment in segments]
+        try:
+            merged = merge_segments(segments, deleted)
+        except:
+            with self._lock:
+                self._merging = False
+                self._merge_done.notify_all()
+            raise
+        with self._lock:
+            # documents deleted while merging
+            for segment, dead in izip(segments, deleted):
+                merged.deleted.update(segment.deleted - dead)
+            for id in merged.doc_ids:
+                if self._location.get(id) in segments:
+                    self._location[id] = merged
+            position = self._segments.index(segments[0])
+            self._segments = [segment for segment in self._segments
+                              if segment not in segments]
+            self._segments.insert(position, merged)
+            self._merging = False
+            self._merge_done.notify_all()
+        return True
+
+    def wait_for_merges(self):
+        """wait_for_merges(self): Wait for a running merge to finish."""
+        with self._lock:
+            while self._merging:
+                self._merge_done.wait()
+
+    def optimize(self):
+        """
+        optimize(self): Flush the buffer and merge all segments into one,
+        dropping every deleted document. (in this thread)
+        """
+        self.flush()
+        while True:
+            self.wait_for_merges()
+            with self._lock:
+                segments = list(self._segments)
+            if len(segments) <= 1 and not (segments and segments[0].deleted):
+                return
+            if self._merge_once(segments):
+                return
+
+    def close(self):
+        """close(self): Stop the background merge thread."""
+        with self._lock:
+            self._closed = True
+            thread = self._merge_thread
+        self._merge_wanted.set()
+        if thread is not None:
+            thread.join()
+
+    # -- queries --
+
+    def num_docs(self):
+        """num_docs(self): Return the number of live documents."""
+        return len(self._location)
+
+    def __getitem__(self, term):
+        """
+        Return the postings.Postings of 'term': tf * idf for every live
+        document containing it, idf being log10(num_docs / df(term)).
+        """
+        with self._lock:
+            result = self._cache.get(term)
+            if result is not None:
+                return result
+            df = self._df.get(term)
+            if not df:
+                raise KeyError(term)
+            idf = log10(float(len(self._location)) / df)
+            pairs = []
+            for segment in self._segments:
+                term_postings = segment.postings.get(term)
+                if term_postings is None:
+                    continue
+                dead = segment.deleted
+                for id, tf in izip(term_postings.ids, term_postings.weights):
+                    if id not in dead:
+                        pairs.append((id, tf * idf))
+            for id, tf in self._buffer.get(term, {}).iteritems():
+                pairs.append((id, tf * idf))
+            result = postings.Postings.from_pairs(pairs)
+            self._cache[term] = result
+            return result
+
+    def get(self, term, default=None):
+        try:
+            return self[term]
+        except KeyError:
+            return default
+
+    def __contains__(self, term):
+        return term in self._df
+
+    def __len__(self):
+        return len(self._df)
+
+    def iterkeys(self):
+        with self._lock:
+            return iter(self._df.keys())
+
+    __iter__ = iterkeys
+
+    def iteritems(self):
+        for term in self.iterkeys():
+            value = self.get(term)
+            if value is not None:
+                yield term, value
+
+    def snapshot(self, compress=False):
+        """
+        snapshot(self, compress=False): Return a plain index (a dict of
+        postings lists, like indexer.make_index() returns) of the live
+        documents, e.g. to save it.
+        """
+        with self._lock:
+            return postings.freeze_index(dict(self.iteritems()), compress)
+
+    def stats(self):
+        """
+        stats(self): Return a dict with the number of live, buffered and
+        deleted (not yet merged away) documents and the segments' sizes.
+        """
+        with self._lock:
+            return {'docs': len(self._location),
+                    'buffered': len(self._buffered_docs),
+                    'deleted': sum([len(segment.deleted)
+                                    for segment in self._segments]),
+                    'segments': [len(segment.doc_ids)
+                                 for segment in self._segments],
+                    'merging': self._merging}
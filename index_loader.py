@@ -4,6 +4,8 @@ and loads the index on memory.
 """
 
 from xml.sax.handler import ContentHandler
+# modules I've written:
+from postings import Postings
 
 class IndexLoader(ContentHandler):
     """
@@ -13,15 +15,22 @@ class IndexLoader(ContentHandler):
     
     def __init__(self):
         self._in_lemma = None
+        self._pairs = []
         self.index = {}
     
     def startElement(self, elem, attrs):
         if elem == 'lemma':
             self._in_lemma = attrs.get('name')
-            self.index[self._in_lemma] = {}
+            self._pairs = []
         elif elem == 'document':
             id, weight = int(attrs.get('id')), float(attrs.get('weight'))
-            self.index[self._in_lemma][id] = weight
+            self._pairs.append((id, weight))
+    
+    def endElement(self, elem):
+        if elem == 'lemma':
+            # the lemma's postings are complete - pack them into arrays
+            self.index[self._in_lemma] = Postings.from_pairs(self._pairs)
+            self._pairs = []
     
     def get_index(self):
         return self.index
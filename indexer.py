@@ -3,62 +3,191 @@
 import sys
 import time
 import pickle
+import getopt
 from math import log10
 # modules I've written:
 import morphosyntactic
 import vector_space
 import save_and_load
+import postings
+import manifest
+import spimi
+import metrics
+import docinfo
 
-def make_index(tagged=True, time_it=False):
+
+class IndexBuilder:
     """
-    make_index(tagged=True, time_it=False): Make and return the inverted index.
-    (using the vector_space and, if tagged=False, the morphosyntactic module)
+    Build the inverted index one document at a time.
 
-    If 'time_it' == True, time the whole thing and return a tuple 
-    (index, time_passed).
+    add_document() takes a document's {lemma: tf} dict and length (what 
+    vector_space.count_lemmas() returns); finish() multiplies by 
+    the idfs and returns the index. snapshot() returns an index of the 
+    documents added so far without stopping the builder. After finish(),
+    get_doc_info() returns the documents' norms and lengths.
     """
-    if time_it:
-        time_start = time.time()
-    # Call vector_space's functions on each of the files 'tagged/0.txt' - 
-    # 'tagged/999.txt'.
-    index = {}
-    for id in xrange(1000):
+
+    def __init__(self):
+        # index[term] is a {doc_id: tf} dictionary until finish()
+        self._index = {}
+        self._num_docs = 0
+        self._docinfo = docinfo.DocInfoBuilder()
+        self._doc_info = None
+
+    def add_document(self, id, term_freqs, length):
+        """
+        add_document(self, id, term_freqs, length): Add document 'id' with
+        the term frequencies 'term_freqs' ({lemma: tf}) and 'length' lemmas.
+        """
+        for term, tf in term_freqs.iteritems():
+            self._index.setdefault(term, {})
+            self._index[term][id] = tf
+            # we'll multiply by "term's" idf later
+        self._docinfo.add_document(id, length)
+        self._num_docs += 1
+
+    def get_num_docs(self):
+        """get_num_docs(self): Return the number of documents added."""
+        return self._num_docs
+
+    def get_doc_info(self):
+        """
+        get_doc_info(self): Return the docinfo.DocInfo (norms and lengths)
+        of the documents, or None before finish().
+        """
+        return self._doc_info
+
+    def _weighted(self, index, compress):
+        """Multiply the tfs in 'index' by the idfs and freeze it."""
+        # if gposttl couldn't tag and lemmatize some word it would output 
+        # <unknown> so delete key <unknown> from the dictionary
+        try:
+            del(index['<unknown>'])
+        except KeyError:
+            pass
+        # so far we've only calculated each term's tf for every document
+        # multiply by each term's idf to get the real weight
+        num_docs = float(self._num_docs)
+        for term, weight in index.iteritems():
+            idf = log10(num_docs / len(weight))
+            for id in weight.iterkeys():
+                # multiply by idf(term) = log10(num_docs / len(weight))
+                weight[id] *= idf
+        # pack every term's {id: weight} dict into a compact postings list
+        return postings.freeze_index(index, compress)
+
+    def snapshot(self, compress=False):
+        """
+        snapshot(self, compress=False): Return an index of the documents 
+        added so far. The builder can go on adding documents.
+        """
+        return self._weighted(dict([(term, dict(weights)) for term, weights
+                                    in self._index.iteritems()]), compress)
+
+    def finish(self, compress=False):
+        """
+        finish(self, compress=False): Return the index. The builder can't
+        be used after that.
+        """
+        with metrics.timer('index.weight'):
+            index = self._weighted(self._index, compress)
+            for lemma_postings in index.itervalues():
+                self._docinfo.add_weights(lemma_postings.ids,
+                                          lemma_postings.weights)
+            self._doc_info = self._docinfo.finish()
+        self._index = None
+        return index
+
+
+def iter_term_freqs(tagged=True):
+    """
+    iter_term_freqs(tagged=True): Yield (id, {lemma: tf}, length) for every 
+    document in the corpus manifest. (using the vector_space and, if tagged=False, 
+    the morphosyntactic module)
+    """
+    # Call vector_space's functions on each of the files 'tagged/<id>.txt'
+    # of the documents in the corpus manifest.
+    if tagged:
+        ids = manifest.iter_doc_ids('tagged', '.txt')
+    else:
+        ids = manifest.iter_doc_ids('tokenized', '.txt')
+    for id in ids:
         # Check if the files need to be tagged:
         if tagged:
             # The files have already been tagged. (called from main())
             print 'Processing document ' + str(id) + ' ... ',
             # 'id' is of course the current document's id
             filename = 'tagged/' + str(id) + '.txt'
-            text = vector_space.remove_stopwords_from_file(filename)
+            with metrics.timer('index.filter_and_count'):
+                d, length = vector_space.count_lemmas_in_file(filename, True)
         else:
             # The files in 'tokenized/' need to be tagged. 
-            # (called from search_engine.py)
-            print 'Tagging tokenized/' + str(id) + '.txt ... ',
-            text = morphosyntactic.tag_file('tokenized/' + str(id) + '.txt')
-            print '   done!'
-            print 'Processing ... ',
-            text = vector_space.remove_stopwords(text)
-        d = vector_space.make_dict_of_lemmas(text)
-        # 'd' contains the tf(term, id) for every term 'term' in 'id'
-        for term, tf in d.iteritems():
-            # index[term] is now a dictionary
-            index.setdefault(term, {})
-            index[term][id] = tf
-            # we'll multiply by "term's" idf later
+            # (called from search_engine.py) gposttl's output is counted 
+            # as it comes.
+            print 'Tagging and processing tokenized/' + str(id) + '.txt ... ',
+            with metrics.timer('index.tag_filter_and_count'):
+                d, length = vector_space.count_lemmas(
+                    morphosyntactic.iter_tagged_lines(
+                        'tokenized/' + str(id) + '.txt'), True)
+        metrics.count('index.documents')
         print '   done!'
+        yield id, d, length
+
+def make_index_file(filename='index.bin', tagged=True, 
+                    memory_limit=64 * 1024 * 1024, run_dir=None,
+                    docinfo_file=None):
+    """
+    make_index_file(filename='index.bin', tagged=True, 
+    memory_limit=64 * 1024 * 1024, run_dir=None, docinfo_file=None): Make 
+    the inverted index and save it in the binary format as 'filename', 
+    without ever holding more than about 'memory_limit' bytes of postings 
+    in memory (see spimi.py). The documents' norms and lengths are saved as
+    'docinfo_file' (default: docinfo.DOCINFO_FILE next to 'filename'). 
+    Return a dict with the number of documents, runs and postings, and the
+    peak RSS in bytes.
+    """
+    builder = spimi.BlockIndexBuilder(memory_limit, run_dir)
+    for id, d, length in iter_term_freqs(tagged):
+        builder.add_document(id, d, length)
+    print 'Merging runs into \'' + filename + '\' ... ',
+    with open(filename, 'wb') as f:
+        stats = builder.finish(f)
+    if docinfo_file is None:
+        docinfo_file = docinfo.docinfo_file(filename)
+    docinfo.save_docinfo(builder.doc_info, docinfo_file)
+    print '   done!'
+    stats = dict(stats)
+    stats['docs'] = builder.get_num_docs()
+    return stats
+
+def make_index(tagged=True, time_it=False, compress=False, 
+               docinfo_file=None):
+    """
+    make_index(tagged=True, time_it=False, compress=False, 
+    docinfo_file=None): Make and return the inverted index. (using the 
+    vector_space and, if tagged=False, the morphosyntactic module)
+
+    If 'docinfo_file' is given the documents' norms and lengths are saved 
+    in it (see docinfo.py).
+
+    The index maps every lemma to a postings.Postings list, or to a 
+    postings.CompressedPostings list if 'compress' == True.
+
+    If 'time_it' == True, time the whole thing and return a tuple 
+    (index, time_passed).
+    """
+    if time_it:
+        time_start = time.time()
+    builder = IndexBuilder()
+    for id, d, length in iter_term_freqs(tagged):
+        # 'd' contains the tf(term, id) for every term 'term' in 'id'
+        builder.add_document(id, d, length)
     print 'Postprocessing index ... ',
-    # if gposttl couldn't tag and lemmatize some word it would output <unknown>
-    # so delete key <unknown> from the dictionary
-    try:
-        del(index['<unknown>'])
-    except KeyError:
-        pass
-    # so far we've only calculated each term's tf for every document
-    # multiply by each term's idf to get the real weight
-    for term, weight in index.iteritems():
-        for id in weight.iterkeys():
-            # multiply by idf(term) --- idf(term) = log10(1000.0 / len(weight))
-            weight[id] *= log10(1000.0 / len(weight))
+    # multiply by the idfs (idf(term) = log10(N / df(term)), N being the 
+    # number of documents added) and pack into postings lists
+    index = builder.finish(compress)
+    if docinfo_file is not None:
+        docinfo.save_docinfo(builder.get_doc_info(), docinfo_file)
     print '   done!'
     # stop timing (if time_it == True):
     if time_it:
@@ -69,16 +198,66 @@ def make_index(tagged=True, time_it=False):
 
 def main():
     """
-    Tag files tokenized/0.txt - tokenized/999.txt, use them to make the 
-    inverted index and save it on disk. (using save_and_load.py)
+    Tag files tokenized/0.txt, tokenized/1.txt, ..., use them to make the 
+    inverted index and save it on disk, both as 'index.xml' and in the 
+    binary format as 'index.bin'. (using save_and_load.py) The documents'
+    norms and lengths are saved as 'docinfo.bin' (see docinfo.py).
+
+    If -m or --memory-limit MB was given, only make 'index.bin', holding at
+    most about MB megabytes of postings in memory.
+    If --metrics was given, print the time spent tagging, counting and
+    weighting at the end. If --profile=file was given, run under cProfile
+    and save the profile to 'file'.
 
     preprocessor.py must have already been called
     """
-    d = make_index(tagged=False)
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'm:', ['memory-limit=',
+                                                        'metrics', 'profile='])
+    except getopt.GetoptError:
+        sys.stderr.write('usage: indexer.py [-m | --memory-limit MB] '
+                         '[--metrics] [--profile=file]\n')
+        return 2
+    memory_limit = None
+    collect_metrics = False
+    profile_file = None
+    for opt, arg in opts:
+        if opt in ('-m', '--memory-limit'):
+            memory_limit = int(float(arg) * 1024 * 1024)
+        elif opt == '--metrics':
+            collect_metrics = True
+        elif opt == '--profile':
+            profile_file = arg
+    if collect_metrics:
+        metrics.enable()
+    if profile_file is not None:
+        metrics.start_profile()
+    try:
+        return _make_index_files(memory_limit)
+    finally:
+        if profile_file is not None:
+            metrics.stop_profile(profile_file)
+        if collect_metrics:
+            metrics.dump()
+
+def _make_index_files(memory_limit):
+    """Make 'index.bin' (and 'index.xml' without a memory limit)."""
+    if memory_limit is not None:
+        stats = make_index_file('index.bin', tagged=False, 
+                                memory_limit=memory_limit)
+        print 'Indexed %d documents (%d postings, %d runs), peak RSS %.1f MB' \
+              % (stats['docs'], stats['postings'], stats['runs'],
+                 stats['peak_rss'] / 1048576.0)
+        return 0
+    d = make_index(tagged=False, docinfo_file=docinfo.DOCINFO_FILE)
     print 'Saving index file as \'index.xml\' ... ',
     with open('index.xml', 'w') as f:
         save_and_load.save_index(d, f)
     print '   done!'
+    print 'Saving index file as \'index.bin\' ... ',
+    with open('index.bin', 'wb') as f:
+        save_and_load.save_index_binary(d, f)
+    print '   done!'
     return 0
 
 if __name__ == '__main__':
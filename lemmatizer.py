@@ -0,0 +1,312 @@
+"""
+Query lemmatizers that don't start a new process for every query.
+
+GposttlPool keeps a few gposttl processes running and streams queries to
+them through their stdin/stdout pipes. Every query is followed by a marker
+token, so we know where gposttl's answer to it ends.
+
+PythonLemmatizer is a pure-Python fallback for machines without gposttl.
+It only knows a handful of English suffix rules, so its lemmas won't
+always match the ones gposttl put in the index.
+"""
+
+import os
+import select
+import subprocess
+import threading
+import Queue
+from distutils.spawn import find_executable
+
+GPOSTTL = 'gposttl'
+# the lemma of a word gposttl doesn't know
+UNKNOWN = '<unknown>'
+# how long to wait for gposttl to answer a query (seconds)
+TIMEOUT = 5.0
+
+
+class LemmatizerError(Exception):
+    """Exception raised when a gposttl process stops answering."""
+
+    def __init__(self, reason):
+        self.reason = reason
+
+    def __str__(self):
+        return 'gposttl worker failed: ' + self.reason
+
+
+def gposttl_available():
+    """gposttl_available(): True if gposttl is on the PATH."""
+    return find_executable(GPOSTTL) is not None
+
+def lemmas_from_tagged(lines):
+    """
+    lemmas_from_tagged(lines): Return the lemmas in 'lines', gposttl output
+    lines of the form 'word tag lemma'. Unknown words come back as UNKNOWN,
+    so a phrase keeps their place (see known_lemmas()).
+    """
+    lemmas = []
+    for line in lines:
+        if UNKNOWN in line:
+            lemmas.append(UNKNOWN)
+            continue
+        try:
+            (word, tag, lemma) = line.split()
+        except ValueError:
+            continue
+        lemmas.append(lemma)
+    return lemmas
+
+def known_lemmas(lemmas):
+    """
+    known_lemmas(lemmas): Return the lemmas of 'lemmas' that aren't 
+    UNKNOWN, as a tuple.
+    """
+    return tuple([lemma for lemma in lemmas if lemma != UNKNOWN])
+
+def lemmatize_once(query):
+    """
+    lemmatize_once(query): Lemmatize 'query' with a new gposttl process and
+    return a list of lemmas. (slow, used when a worker breaks down)
+    """
+    p = subprocess.Popen([GPOSTTL, '--silent'], shell=False,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output = p.communicate('\n'.join(query.split()) + '\n')[0]
+    return lemmas_from_tagged(output.splitlines())
+
+
+class GposttlWorker:
+    """A gposttl process that lemmatizes one query at a time."""
+
+    def __init__(self, timeout=None):
+        """
+        __init__(self, timeout=None): Start gposttl. Give up on a query if
+        gposttl hasn't answered within 'timeout' seconds.
+        """
+        if timeout is None:
+            timeout = TIMEOUT
+        self._timeout = timeout
+        self._serial = 0
+        self._pending = ''
+        command = [GPOSTTL, '--silent']
+        # ask for line-buffered output, or gposttl would keep its answers
+        # in a pipe buffer until it fills up
+        stdbuf = find_executable('stdbuf')
+        if stdbuf is not None:
+            command = [stdbuf, '-oL'] + command
+        self._devnull = open(os.devnull, 'w')
+        self._process = subprocess.Popen(command, shell=False,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=self._devnull)
+
+    def _readline(self):
+        """Return the next line gposttl writes (without the newline)."""
+        fd = self._process.stdout.fileno()
+        while '\n' not in self._pending:
+            ready = select.select([fd], [], [], self._timeout)[0]
+            if not ready:
+                raise LemmatizerError('timed out')
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                raise LemmatizerError('gposttl exited')
+            self._pending += chunk
+        line, self._pending = self._pending.split('\n', 1)
+        return line
+
+    def lemmatize(self, query):
+        """
+        lemmatize(self, query): Return the list of lemmas in 'query', a
+        string.
+        """
+        return self.lemmatize_many([query])[0]
+
+    def lemmatize_many(self, queries):
+        """
+        lemmatize_many(self, queries): Return a list with the list of lemmas
+        of every query in 'queries'. All the queries are written to gposttl
+        at once, each followed by its own marker.
+        """
+        markers = []
+        frames = []
+        for query in queries:
+            self._serial += 1
+            marker = 'swseendofquery' + str(self._serial)
+            markers.append(marker)
+            frames.append(''.join([word + '\n' for word in query.split()]) +
+                          marker + '\n')
+        try:
+            self._process.stdin.write(''.join(frames))
+            self._process.stdin.flush()
+        except (IOError, OSError) as e:
+            raise LemmatizerError(str(e))
+        results = []
+        for marker in markers:
+            lines = []
+            while True:
+                line = self._readline()
+                fields = line.split()
+                if fields and fields[0] == marker:
+                    break
+                lines.append(line)
+            results.append(lemmas_from_tagged(lines))
+        return results
+
+    def close(self):
+        """close(self): Stop the gposttl process."""
+        try:
+            self._process.stdin.close()
+            self._process.kill()
+            self._process.wait()
+        except (IOError, OSError):
+            pass
+        self._devnull.close()
+
+
+class GposttlPool:
+    """
+    A pool of resident gposttl workers. Safe to use from many threads; each
+    query borrows a worker for as long as it takes to lemmatize it.
+    """
+
+    def __init__(self, size=2, timeout=None):
+        """
+        __init__(self, size=2, timeout=None): Keep up to 'size' gposttl
+        processes running. They are started the first time they're needed.
+        """
+        self._size = size
+        self._timeout = timeout
+        self._started = 0
+        self._lock = threading.Lock()
+        self._idle = Queue.Queue()
+
+    def _checkout(self):
+        """Return an idle worker, starting a new one if we may."""
+        try:
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            pass
+        with self._lock:
+            if self._started < self._size:
+                self._started += 1
+                start = True
+            else:
+                start = False
+        if start:
+            try:
+                return GposttlWorker(self._timeout)
+            except OSError:
+                with self._lock:
+                    self._started -= 1
+                raise
+        return self._idle.get()
+
+    def lemmatize(self, query):
+        """
+        lemmatize(self, query): Return the list of lemmas in 'query', a
+        string.
+        """
+        return self.lemmatize_many([query])[0]
+
+    def lemmatize_many(self, queries):
+        """
+        lemmatize_many(self, queries): Return a list with the list of lemmas
+        of every query in 'queries', all lemmatized by the same worker.
+        """
+        worker = self._checkout()
+        try:
+            results = worker.lemmatize_many(queries)
+        except LemmatizerError:
+            # the worker is broken: replace it and do these queries the slow
+            # way
+            worker.close()
+            with self._lock:
+                self._started -= 1
+            return [lemmatize_once(query) for query in queries]
+        self._idle.put(worker)
+        return results
+
+    def close(self):
+        """close(self): Stop all idle workers."""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except Queue.Empty:
+                break
+            worker.close()
+            with self._lock:
+                self._started -= 1
+
+
+# a few irregular forms the suffix rules below would get wrong
+_IRREGULAR = {'men': 'man', 'women': 'woman', 'children': 'child',
+              'people': 'person', 'feet': 'foot', 'teeth': 'tooth',
+              'mice': 'mouse', 'was': 'be', 'were': 'be', 'is': 'be',
+              'are': 'be', 'am': 'be', 'been': 'be', 'has': 'have',
+              'had': 'have', 'did': 'do', 'does': 'do', 'done': 'do',
+              'went': 'go', 'gone': 'go', 'made': 'make', 'said': 'say',
+              'got': 'get', 'took': 'take', 'taken': 'take',
+              'better': 'good', 'best': 'good'}
+_VOWELS = 'aeiou'
+
+
+class PythonLemmatizer:
+    """A pure-Python, rule-based English lemmatizer (a rough fallback)."""
+
+    def lemmatize_word(self, word):
+        """lemmatize_word(self, word): Return the lemma of 'word'."""
+        word = word.lower()
+        if word in _IRREGULAR:
+            return _IRREGULAR[word]
+        if len(word) <= 3 or not word.isalpha():
+            return word
+        if word.endswith('ies') and len(word) > 4:
+            return word[:-3] + 'y'
+        if word.endswith(('sses', 'shes', 'ches', 'xes', 'zes')):
+            return word[:-2]
+        if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+            return word[:-1]
+        for suffix in ('ing', 'ed'):
+            if word.endswith(suffix):
+                stem = word[:-len(suffix)]
+                if len(stem) < 3 or not any(c in _VOWELS for c in stem):
+                    return word
+                if stem[-1] == stem[-2] and stem[-1] not in 'lsz':
+                    # running -> run
+                    return stem[:-1]
+                return stem
+        return word
+
+    def lemmatize(self, query):
+        """
+        lemmatize(self, query): Return the list of lemmas in 'query', a
+        string.
+        """
+        return [self.lemmatize_word(word) for word in query.split()]
+
+    def lemmatize_many(self, queries):
+        """
+        lemmatize_many(self, queries): Return a list with the list of lemmas
+        of every query in 'queries'.
+        """
+        return [self.lemmatize(query) for query in queries]
+
+    def close(self):
+        pass
+
+
+def make_lemmatizer(name=None):
+    """
+    make_lemmatizer(name=None): Return a new lemmatizer. 'name' can be
+    'gposttl' or 'python'; if it isn't given use gposttl if it's installed
+    and the pure-Python lemmatizer otherwise.
+    """
+    if name is None:
+        if gposttl_available():
+            name = 'gposttl'
+        else:
+            name = 'python'
+    if name == 'gposttl':
+        return GposttlPool()
+    elif name == 'python':
+        return PythonLemmatizer()
+    raise ValueError('unknown lemmatizer: ' + str(name))
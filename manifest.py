@@ -0,0 +1,208 @@
+"""
+The corpus manifest: a table of the corpus's documents.
+
+Every document has a line in 'manifest.tsv':
+
+    id <tab> length <tab> md5 <tab> url <tab> path
+
+where 'length' is the size of the page's html in bytes and 'md5' the hex
+md5 of it. The manifest is made by scanning the html directory (see
+scan()) and is always read and written one line at a time, so the
+number of documents is only limited by the disk.
+
+The pipeline stages (preprocessor, morphosyntactic, vector_space and
+indexer) get their document ids from iter_doc_ids(): the manifest's ids
+if there is a manifest, otherwise the ids of the files found in the
+stage's input directory.
+"""
+
+import os
+import sys
+import hashlib
+from collections import namedtuple
+# modules I've written:
+import url_table
+
+MANIFEST_FILE = 'manifest.tsv'
+# scan() gives up after this many missing ids in a row
+MAX_GAP = 100
+
+Document = namedtuple('Document', 'id length hash url path')
+
+
+class BadManifestError(Exception):
+    """Exception raised when a manifest line can't be parsed."""
+
+    def __init__(self, filename, line_number):
+        self.filename = filename
+        self.line_number = line_number
+
+    def __str__(self):
+        return '\'' + self.filename + '\' line ' + str(self.line_number) + \
+               ' is not a valid manifest line'
+
+
+def _file_hash_and_length(pathname):
+    """Return the hex md5 and the length of file 'pathname'."""
+    md5 = hashlib.md5()
+    length = 0
+    with open(pathname, 'rb') as f:
+        while True:
+            block = f.read(65536)
+            if not block:
+                break
+            md5.update(block)
+            length += len(block)
+    return md5.hexdigest(), length
+
+def iter_existing_ids(directory, extension, max_gap=MAX_GAP):
+    """
+    iter_existing_ids(directory, extension, max_gap=MAX_GAP): Yield the ids
+    0, 1, 2, ... for which a file '<directory>/<id><extension>' exists,
+    until 'max_gap' ids in a row are missing. (the directory is probed one
+    file at a time instead of being listed)
+    """
+    id = 0
+    missing = 0
+    while missing < max_gap:
+        if os.path.isfile(os.path.join(directory, str(id) + extension)):
+            missing = 0
+            yield id
+        else:
+            missing += 1
+        id += 1
+
+def scan(directory='html', extension='.html', urls=None, max_gap=MAX_GAP):
+    """
+    scan(directory='html', extension='.html', urls=None, max_gap=MAX_GAP):
+    Yield a Document for every page '<directory>/<id><extension>' (see
+    iter_existing_ids()). 'urls' is the list mapping ids to urls (the
+    crawler's url table); without it the urls are left empty.
+    """
+    for id in iter_existing_ids(directory, extension, max_gap):
+        path = os.path.join(directory, str(id) + extension)
+        hash, length = _file_hash_and_length(path)
+        url = ''
+        if urls is not None and id < len(urls) and urls[id] is not None:
+            url = urls[id]
+        yield Document(id, length, hash, url, path)
+
+def write_manifest(documents, filename=MANIFEST_FILE):
+    """
+    write_manifest(documents, filename=MANIFEST_FILE): Write the Documents
+    'documents' (any iterable) to 'filename'. Return how many there were.
+    """
+    count = 0
+    with open(filename + '.tmp', 'w') as f:
+        f.write('# id\tlength\tmd5\turl\tpath\n')
+        for doc in documents:
+            f.write('%d\t%d\t%s\t%s\t%s\n' % (doc.id, doc.length, doc.hash,
+                                              doc.url, doc.path))
+            count += 1
+    os.rename(filename + '.tmp', filename)
+    return count
+
+def iter_manifest(filename=MANIFEST_FILE):
+    """
+    iter_manifest(filename=MANIFEST_FILE): Yield the Documents in manifest
+    'filename', reading it line by line.
+    """
+    with open(filename, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if line.startswith('#') or not line.strip():
+                continue
+            try:
+                id, length, hash, url, path = line.rstrip('\n').split('\t', 4)
+                yield Document(int(id), int(length), hash, url, path)
+            except ValueError:
+                raise BadManifestError(filename, line_number)
+
+def make_manifest(directory='html', filename=MANIFEST_FILE, urls=None):
+    """
+    make_manifest(directory='html', filename=MANIFEST_FILE, urls=None):
+    Scan 'directory' and write the manifest 'filename'. 'urls' defaults to
+    the url map in 'urls.bin' or 'urls.pickle' (if there is one). Return
+    the number of documents.
+    """
+    if urls is None and (os.path.isfile(url_table.URLS_FILE) or
+                         os.path.isfile(url_table.PICKLE_FILE)):
+        urls = url_table.load_urls()
+    return write_manifest(scan(directory, urls=urls), filename)
+
+def iter_doc_ids(directory, extension, filename=MANIFEST_FILE):
+    """
+    iter_doc_ids(directory, extension, filename=MANIFEST_FILE): Yield the ids
+    of the documents to process: those in manifest 'filename' if it exists,
+    otherwise those with a file '<directory>/<id><extension>'.
+    """
+    if os.path.isfile(filename):
+        for doc in iter_manifest(filename):
+            yield doc.id
+    else:
+        for id in iter_existing_ids(directory, extension):
+            yield id
+
+
+class Manifest:
+    """
+    A manifest file. Iterating over it reads it again every time; the
+    totals are computed by one pass the first time they're asked for.
+    """
+
+    def __init__(self, filename=MANIFEST_FILE):
+        self.filename = filename
+        self._num_docs = None
+        self._total_length = None
+
+    def __iter__(self):
+        return iter_manifest(self.filename)
+
+    def ids(self):
+        """ids(self): Yield the documents' ids."""
+        for doc in self:
+            yield doc.id
+
+    def _count(self):
+        num_docs = 0
+        total_length = 0
+        for doc in self:
+            num_docs += 1
+            total_length += doc.length
+        self._num_docs = num_docs
+        self._total_length = total_length
+
+    def num_docs(self):
+        """num_docs(self): Return the number of documents (N)."""
+        if self._num_docs is None:
+            self._count()
+        return self._num_docs
+
+    def total_length(self):
+        """total_length(self): Return the total length of the documents."""
+        if self._total_length is None:
+            self._count()
+        return self._total_length
+
+    def average_length(self):
+        """average_length(self): Return the average document length."""
+        if not self.num_docs():
+            return 0.0
+        return self.total_length() / float(self.num_docs())
+
+
+def main():
+    """
+    Scan './html/' (or the directory given as the first argument) and write
+    the manifest 'manifest.tsv'.
+    """
+    directory = 'html'
+    if len(sys.argv) > 1:
+        directory = sys.argv[1]
+    print 'Scanning \'' + directory + '\' ... ',
+    num_docs = make_manifest(directory)
+    print '   done! (' + str(num_docs) + ' documents)'
+    return 0
+
+if __name__ == '__main__':
+    status = main()
+    sys.exit(status)
@@ -0,0 +1,309 @@
+"""
+Lightweight instrumentation: counters, timers and histograms.
+
+    with metrics.timer('query.score'):
+        ...
+    metrics.count('crawl.fetch_errors')
+    metrics.observe('crawl.page_bytes', len(html))
+
+Everything is off until enable() is called; until then timer() returns a
+shared do-nothing object and count() / observe() return at once, so the
+calls can stay in the hot paths.
+
+What was collected can be printed with dump(), or exported in the
+Prometheus text format with prometheus_text(). A worker process can send
+what it collected to its parent with take(), and the parent add it to its
+own with merge(). start_profile() and
+stop_profile() run cProfile over whatever happens in between.
+"""
+
+import sys
+import time
+import threading
+import cProfile
+import pstats
+
+# upper bounds of the histogram buckets: 100 us ... 10 s for timers
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_profile = None
+
+
+class Histogram:
+    """
+    Counts observed values in buckets (cumulative, like Prometheus) and
+    keeps their count, sum, minimum and maximum.
+    """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """observe(self, value): Count 'value'."""
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+    def merge(self, other):
+        """
+        merge(self, other): Add the values counted by the Histogram 'other'
+        (with the same buckets).
+        """
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+        for i, bucket_count in enumerate(other.bucket_counts):
+            self.bucket_counts[i] += bucket_count
+
+    def quantile(self, fraction):
+        """
+        quantile(self, fraction): Return an estimate of the 'fraction'
+        quantile: the upper bound of the bucket it falls in (or the maximum
+        if it's past the last bucket).
+        """
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            if count >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'min': self.min, 'max': self.max,
+                'p50': self.quantile(0.50), 'p95': self.quantile(0.95),
+                'p99': self.quantile(0.99)}
+
+
+class _NullTimer:
+    """What timer() returns while metrics are off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """Observes the seconds between __enter__ and __exit__ in a histogram."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self._name, time.time() - self._start)
+        return False
+
+
+def enable(on=True):
+    """enable(on=True): Turn collecting metrics on (or off)."""
+    global _enabled
+    _enabled = on
+
+def is_enabled():
+    """is_enabled(): True if metrics are being collected."""
+    return _enabled
+
+def reset():
+    """reset(): Forget everything collected so far."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def after_fork():
+    """
+    after_fork(): Call in a new child process first thing: forget what the
+    parent collected and make a new lock (another thread of the parent may
+    have held the old one when it forked, and it would never be released).
+    """
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+
+def take():
+    """
+    take(): Return what was collected so far, as a (counters, histograms)
+    tuple for merge(), and forget it.
+    """
+    with _lock:
+        taken = (dict(_counters), dict(_histograms))
+        _counters.clear()
+        _histograms.clear()
+    return taken
+
+def merge(taken):
+    """
+    merge(taken): Add what take() returned (in this or another process) to
+    what was collected here.
+    """
+    counters, histograms = taken
+    with _lock:
+        for name, value in counters.iteritems():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, histogram in histograms.iteritems():
+            mine = _histograms.get(name)
+            if mine is None:
+                _histograms[name] = histogram
+            else:
+                mine.merge(histogram)
+
+def count(name, amount=1):
+    """count(name, amount=1): Add 'amount' to counter 'name'."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def observe(name, value, buckets=TIME_BUCKETS):
+    """
+    observe(name, value, buckets=TIME_BUCKETS): Add 'value' to histogram
+    'name' (made with the bucket bounds 'buckets' the first time).
+    """
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram(buckets)
+        histogram.observe(value)
+
+def timer(name):
+    """
+    timer(name): Return a context manager that adds the seconds its block
+    takes to histogram 'name'.
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+def timed(name):
+    """timed(name): A decorator timing every call with timer(name)."""
+    def decorate(func):
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorate
+
+def stats():
+    """
+    stats(): Return a dict {'counters': {name: value}, 'histograms': {name:
+    {count, sum, mean, min, max, p50, p95, p99}}}.
+    """
+    with _lock:
+        return {'counters': dict(_counters),
+                'histograms': dict([(name, histogram.as_dict()) for
+                                    name, histogram in _histograms.iteritems()])}
+
+def dump(file=None):
+    """dump(file=None): Print the metrics to 'file' (default stderr)."""
+    if file is None:
+        file = sys.stderr
+    current = stats()
+    if current['counters']:
+        print >>file, 'Counters:'
+        for name in sorted(current['counters']):
+            print >>file, '  %-32s %12d' % (name, current['counters'][name])
+    if current['histograms']:
+        print >>file, 'Timers (total in seconds, the rest in ms) and ' \
+                      'histograms:'
+        print >>file, '  %-32s %9s %11s %10s %10s %10s %10s' % \
+            ('name', 'count', 'total', 'mean', 'p50', 'p95', 'p99')
+        with _lock:
+            timers = set([name for name, histogram in _histograms.iteritems()
+                          if histogram.buckets == TIME_BUCKETS])
+        for name in sorted(current['histograms']):
+            h = current['histograms'][name]
+            scale = 1
+            if name in timers:
+                scale = 1000
+            print >>file, '  %-32s %9d %11.3f %10.3f %10.3f %10.3f %10.3f' % \
+                (name, h['count'], h['sum'], scale * h['mean'],
+                 scale * h['p50'], scale * h['p95'], scale * h['p99'])
+
+def _prometheus_name(name):
+    return 'swse_' + ''.join([c if c.isalnum() else '_' for c in name])
+
+def prometheus_text():
+    """
+    prometheus_text(): Return the metrics in the Prometheus text exposition
+    format. Timers become '<name>_seconds' histograms.
+    """
+    lines = []
+    with _lock:
+        for name in sorted(_counters):
+            metric = _prometheus_name(name) + '_total'
+            lines.append('# TYPE %s counter' % metric)
+            lines.append('%s %d' % (metric, _counters[name]))
+        for name in sorted(_histograms):
+            histogram = _histograms[name]
+            metric = _prometheus_name(name)
+            if histogram.buckets == TIME_BUCKETS:
+                metric += '_seconds'
+            lines.append('# TYPE %s histogram' % metric)
+            for bound, bucket_count in zip(histogram.buckets,
+                                           histogram.bucket_counts):
+                lines.append('%s_bucket{le="%g"} %d' % (metric, bound,
+                                                        bucket_count))
+            lines.append('%s_bucket{le="+Inf"} %d' % (metric, histogram.count))
+            lines.append('%s_sum %r' % (metric, histogram.sum))
+            lines.append('%s_count %d' % (metric, histogram.count))
+    return '\n'.join(lines) + '\n'
+
+def start_profile():
+    """start_profile(): Start profiling this thread with cProfile."""
+    global _profile
+    _profile = cProfile.Profile()
+    _profile.enable()
+
+def stop_profile(filename=None, file=None, limit=30):
+    """
+    stop_profile(filename=None, file=None, limit=30): Stop the profiler
+    start_profile() started. Save the raw profile to 'filename' (for
+    pstats or a viewer) if it's given, and print the 'limit' functions
+    with the largest cumulative time to 'file' (default stderr).
+    """
+    global _profile
+    if _profile is None:
+        return
+    _profile.disable()
+    if filename is not None:
+        _profile.dump_stats(filename)
+    if file is None:
+        file = sys.stderr
+    pstats.Stats(_profile, stream=file).sort_stats('cumulative') \
+        .print_stats(limit)
+    _profile = None
@@ -2,11 +2,27 @@
 A simple morphosyntactic analyser.
 
 Will call gposttl (works on linux and mac os x).
+
+Queries are lemmatized by a resident lemmatizer (see lemmatizer.py), so
+gposttl isn't started again for every query.
 """
 
 import os
 import sys
 import subprocess
+import itertools
+import threading
+from multiprocessing.pool import ThreadPool
+# modules I've written:
+import lemmatizer
+import parallel
+import manifest
+import metrics
+
+# the lemmatizer lemmatize_query() uses (made the first time it's needed)
+_query_lemmatizer = None
+# so that threads lemmatizing their first queries make only one
+_query_lemmatizer_lock = threading.Lock()
 
 def tag_file(filename, to_file=None):
     """
@@ -29,45 +45,125 @@ def tag_file(filename, to_file=None):
         p.wait()                # not really needed this time
         return tagged_text.rstrip()
 
+def iter_tagged_lines(filename):
+    """
+    Tag and lemmatize every word in the tokenized file 'filename' and yield
+    gposttl's output line by line, as gposttl writes it. (nothing is kept
+    in memory)
+    """
+    with open(os.devnull, 'w') as devnull:
+        p = subprocess.Popen(['gposttl', '--silent', filename], shell=False,
+                             stdout=subprocess.PIPE, stderr=devnull)
+        try:
+            for line in iter(p.stdout.readline, ''):
+                yield line
+        finally:
+            p.stdout.close()
+            p.wait()
+
+def tag_text(text):
+    """
+    Tag and lemmatize the tokenized text 'text' (a string, one word per 
+    line) and return gposttl's output as a string.
+    """
+    p = subprocess.Popen(['gposttl', '--silent'], shell=False,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    tagged_text = p.communicate(text + '\n')[0]
+    return tagged_text.rstrip()
+
+def set_query_lemmatizer(name=None):
+    """
+    set_query_lemmatizer(name=None): Choose the lemmatizer lemmatize_query()
+    will use: 'gposttl' (a pool of resident gposttl processes), 'python' 
+    (the pure-Python fallback) or None (gposttl if it's installed).
+    """
+    global _query_lemmatizer
+    with _query_lemmatizer_lock:
+        if _query_lemmatizer is not None:
+            _query_lemmatizer.close()
+        _query_lemmatizer = lemmatizer.make_lemmatizer(name)
+        return _query_lemmatizer
+
+def get_query_lemmatizer():
+    """
+    get_query_lemmatizer(): Return the lemmatizer lemmatize_query() uses,
+    making the default one (see set_query_lemmatizer()) if there's none.
+    """
+    global _query_lemmatizer
+    if _query_lemmatizer is None:
+        with _query_lemmatizer_lock:
+            if _query_lemmatizer is None:
+                _query_lemmatizer = lemmatizer.make_lemmatizer()
+    return _query_lemmatizer
+
 def lemmatize_query(query):
     """
     lemmatize_query(query): 'query' is a string. Lemmatize it using gposttl
-    and return a tuple of lemmas.
-    """
-    p = subprocess.Popen('gposttl --silent << -end- \n' + query + '\n', 
-                         shell=True, executable='/bin/bash', 
-                         stdout=subprocess.PIPE)
-    # -end- is a delimiter but we don't have to use one at the end too
-    # I think subprocess sends a Ctrl-D to gposttl when the input string ends
-    lemmas = []
-    for line in p.stdout.read().splitlines():
-        if '<unknown>' in line:
-            continue
-        else:
-            (word, tag, lemma) = line.split()
-            lemmas.append(lemma)
-    return lemmas
+    (or the lemmatizer chosen with set_query_lemmatizer()) and return a 
+    list of lemmas. Words gposttl doesn't know are lemmatizer.UNKNOWN (see
+    lemmatizer.known_lemmas()).
+    """
+    return get_query_lemmatizer().lemmatize(query)
 
-def tag_and_lemmatize_all(verbose=True):
+def lemmatize_queries(queries):
     """
-    Tag and lemmatize files 'tokenized/0.txt' - 'tokenized/999.txt'.
-    The result of tagging 'tokenized/x.txt' will be saved as 'tagged/x.txt'.
+    lemmatize_queries(queries): Same as lemmatize_query() for every string 
+    in 'queries', in one go. Return a list of lists of lemmas.
+    """
+    return get_query_lemmatizer().lemmatize_many(queries)
+
+def _tag_id(id):
+    """Tag 'tokenized/<id>.txt' into 'tagged/<id>.txt'. Return (id, size)."""
+    filename = 'tokenized/' + str(id) + '.txt'
+    with metrics.timer('index.tag'):
+        tag_file(filename, 'tagged/' + str(id) + '.txt')
+    try:
+        return id, os.path.getsize(filename)
+    except OSError:
+        return id, 0
+
+def tag_and_lemmatize_all(verbose=True, processes=None):
+    """
+    Tag and lemmatize the files 'tokenized/<id>.txt' of the documents in
+    the corpus manifest (or of all the tokenized files there are, if there 
+    is no manifest - see manifest.iter_doc_ids()). The result of tagging 
+    'tokenized/x.txt' will be saved as 'tagged/x.txt'.
+    
+    Up to 'processes' gposttl processes (default: one per CPU core) run at
+    the same time. They are started by threads, since the tagging happens 
+    in gposttl, not in Python.
     """
     try:
         os.mkdir('tagged')
     except OSError:
         pass
-    for id in xrange(1000):
-        if verbose:
-            print 'Tagging \'tokenized/' + str(id) + '.txt\' ... ',
-        tag_file('tokenized/' + str(id) + '.txt', 'tagged/' + str(id) + '.txt')
-        if verbose:
-            print '   done!'
+    if processes is None:
+        processes = parallel.cpu_count()
+    stats = parallel.StageStats('tag and lemmatize')
+    ids = manifest.iter_doc_ids('tokenized', '.txt')
+    pool = None
+    if processes > 1:
+        pool = ThreadPool(processes)
+        results = parallel.bounded_imap(pool, _tag_id, ids)
+    else:
+        results = itertools.imap(_tag_id, ids)
+    try:
+        for id, size in results:
+            if verbose:
+                print 'Tagging \'tokenized/' + str(id) + '.txt\' ...    done!'
+            stats.add(size)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if verbose:
+        print stats.report()
     return True
 
 def main():
     """
-    Tag and lemmatize files 'tokenized/0.txt' - 'tokenized/999.txt'.
+    Tag and lemmatize files 'tokenized/0.txt', 'tokenized/1.txt', ...
     The result of tagging 'tokenized/x.txt' will be saved as 'tagged/x.txt'.
     
     If a single filename is given as an argument tag and lemmatize the
@@ -90,7 +186,7 @@ def main():
             return 1
     else:
         # no arguments were given - tag and lemmatize files
-        # 'tokenized/0.txt' - 'tokenized/999.txt'
+        # 'tokenized/0.txt', 'tokenized/1.txt', ...
         tag_and_lemmatize_all()
         return 0
 
@@ -0,0 +1,195 @@
+"""
+An optional NumPy backend for scoring queries.
+
+DenseIndex copies the postings of an index into two contiguous NumPy
+arrays (doc ids as int32, weights as float32) and remembers where every
+lemma's postings start and end. A query's scores are then accumulated
+into a dense score vector (one entry per doc id) with numpy.bincount, and
+the top k are picked with numpy.argpartition, with no Python code running
+per posting. score_many() does the same for a batch of queries at once:
+every query gets a row of a score matrix, one bincount fills them all and
+one argpartition finds the top k of every row.
+
+NumPy is not required by the rest of the search engine; numpy_available()
+tells whether it can be used.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the most score matrix cells score_many() fills at once
+MAX_BATCH_CELLS = 1 << 18
+
+
+def numpy_available():
+    """numpy_available(): True if NumPy can be imported."""
+    return numpy is not None
+
+
+class DenseIndex:
+    """The postings of an index in contiguous NumPy arrays."""
+
+    def __init__(self, index):
+        """
+        __init__(self, index): Copy the postings of 'index' (a dict of
+        postings, a binary_index.BinaryIndex or anything else with
+        iteritems() yielding (lemma, postings)).
+        """
+        if numpy is None:
+            raise ImportError('the NumPy backend needs numpy')
+        self._spans = {}
+        ids = []
+        weights = []
+        size = 0
+        for lemma, postings in index.iteritems():
+            count = len(postings)
+            self._spans[lemma] = (size, size + count)
+            ids.append(numpy.frombuffer(postings.ids, dtype=numpy.int32))
+            weights.append(numpy.frombuffer(postings.weights,
+                                            dtype=numpy.float32))
+            size += count
+        if size:
+            self.ids = numpy.concatenate(ids)
+            self.weights = numpy.concatenate(weights)
+            self.num_docs = int(self.ids.max()) + 1
+        else:
+            self.ids = numpy.zeros(0, dtype=numpy.int32)
+            self.weights = numpy.zeros(0, dtype=numpy.float32)
+            self.num_docs = 0
+
+    def __len__(self):
+        return len(self._spans)
+
+    def _query_postings(self, lemmas):
+        """
+        Return the doc ids and the weights (times the number of times the
+        lemma is in the query) of all the postings of 'lemmas', as two
+        arrays.
+        """
+        multiplicity = {}
+        for lemma in lemmas:
+            multiplicity[lemma] = multiplicity.get(lemma, 0) + 1
+        ids = []
+        weights = []
+        for lemma, times in multiplicity.iteritems():
+            span = self._spans.get(lemma)
+            if span is None:
+                # 'lemma' was not in the index
+                continue
+            start, end = span
+            ids.append(self.ids[start:end])
+            if times == 1:
+                weights.append(self.weights[start:end])
+            else:
+                weights.append(self.weights[start:end] * times)
+        if not ids:
+            return None, None
+        if len(ids) == 1:
+            return ids[0], weights[0]
+        return numpy.concatenate(ids), numpy.concatenate(weights)
+
+    def score(self, lemmas, top_k=None):
+        """
+        score(self, lemmas, top_k=None): Return a list of (doc_id, score)
+        tuples for the documents matching 'lemmas', sorted by score in
+        descending order (ties go to the smaller doc id); only the 'top_k'
+        best if 'top_k' is given.
+        """
+        ids, weights = self._query_postings(lemmas)
+        if ids is None:
+            return []
+        scores = numpy.bincount(ids, weights, self.num_docs)
+        matched = numpy.zeros(self.num_docs, dtype=bool)
+        matched[ids] = True
+        return _top_k(numpy.flatnonzero(matched), scores, top_k)
+
+    def score_many(self, queries, top_k=None):
+        """
+        score_many(self, queries, top_k=None): Same as score() for every
+        list of lemmas in 'queries'. Return a list with a result list for
+        each. Queries are scored together, in batches of up to
+        MAX_BATCH_CELLS / (number of documents) queries.
+        """
+        results = []
+        batch_size = max(1, MAX_BATCH_CELLS // max(1, self.num_docs))
+        for i in xrange(0, len(queries), batch_size):
+            results.extend(self._score_batch(queries[i:i + batch_size],
+                                             top_k))
+        return results
+
+    def _score_batch(self, queries, top_k):
+        """
+        Score 'queries' with one bincount over a score matrix (a row per
+        query) and pick the top k of every row with one argpartition.
+        """
+        n = self.num_docs
+        ids = []
+        weights = []
+        for row, lemmas in enumerate(queries):
+            query_ids, query_weights = self._query_postings(lemmas)
+            if query_ids is None:
+                continue
+            # query 'row' owns cells row * n ... row * n + n - 1
+            ids.append(query_ids.astype(numpy.int64) + row * n)
+            weights.append(query_weights)
+        if not ids:
+            return [[] for lemmas in queries]
+        ids = numpy.concatenate(ids)
+        cells = len(queries) * n
+        scores = numpy.full(cells, -numpy.inf)
+        # documents a query matches start at 0.0, the rest stay at -inf
+        scores[ids] = 0.0
+        scores += numpy.bincount(ids, numpy.concatenate(weights), cells)
+        scores = scores.reshape(len(queries), n)
+        if top_k is not None and top_k <= 0:
+            return [[] for lemmas in queries]
+        if top_k is None or top_k >= n:
+            return [_top_k(numpy.flatnonzero(row > -numpy.inf), row, top_k)
+                    for row in scores]
+        # the k-th best score of every row
+        queries_range = numpy.arange(len(queries))
+        kth = scores[queries_range,
+                     numpy.argpartition(-scores, top_k - 1,
+                                        axis=1)[:, top_k - 1]][:, None]
+        # everything above it, and as many documents scoring exactly that as
+        # it takes to make k, smaller doc ids first
+        above = scores > kth
+        equal = (scores == kth) & (kth > -numpy.inf)
+        needed = top_k - above.sum(axis=1)
+        selected = above | (equal & (numpy.cumsum(equal, axis=1) <=
+                                     needed[:, None]))
+        rows, ids = numpy.nonzero(selected)
+        selected_scores = scores[rows, ids]
+        order = numpy.lexsort((ids, -selected_scores, rows))
+        bounds = numpy.searchsorted(rows[order], numpy.arange(len(queries) + 1))
+        ids = ids[order].tolist()
+        selected_scores = selected_scores[order].tolist()
+        return [zip(ids[bounds[row]:bounds[row + 1]],
+                    selected_scores[bounds[row]:bounds[row + 1]])
+                for row in xrange(len(queries))]
+
+
+def _top_k(candidates, scores, top_k):
+    """
+    Return the (doc_id, score) tuples of the doc ids 'candidates' (sorted)
+    with the 'top_k' largest of 'scores' (all of them if 'top_k' is None),
+    best first, ties going to the smaller doc id.
+    """
+    candidate_scores = scores[candidates]
+    if top_k is not None:
+        if top_k <= 0:
+            return []
+        if top_k < len(candidates):
+            # argpartition finds the k-th largest score; keep everything
+            # scoring at least that, so ties are broken by doc id below
+            partition = numpy.argpartition(-candidate_scores, top_k - 1)
+            kth = candidate_scores[partition[top_k - 1]]
+            keep = candidate_scores >= kth
+            candidates = candidates[keep]
+            candidate_scores = candidate_scores[keep]
+    order = numpy.lexsort((candidates, -candidate_scores))
+    if top_k is not None:
+        order = order[:top_k]
+    return zip(candidates[order].tolist(), candidate_scores[order].tolist())
@@ -0,0 +1,60 @@
+"""
+Helpers for running the corpus-building stages on all CPU cores.
+
+bounded_imap() is like Pool.imap(), but never has more than a fixed number
+of tasks in flight, so a huge corpus doesn't get queued up in memory all
+at once. StageStats measures a stage's throughput.
+"""
+
+import time
+import multiprocessing
+from collections import deque
+
+
+def cpu_count():
+    """cpu_count(): Return the number of CPU cores (at least 1)."""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def bounded_imap(pool, func, iterable, max_in_flight=None):
+    """
+    bounded_imap(pool, func, iterable, max_in_flight=None): Apply 'func' to
+    every item of 'iterable' on 'pool' and yield the results in the order of
+    the items. At most 'max_in_flight' items (default: 4 per process) are
+    handed to the pool at any time.
+    """
+    if max_in_flight is None:
+        max_in_flight = 4 * max(1, getattr(pool, '_processes', 1))
+    in_flight = deque()
+    for item in iterable:
+        in_flight.append(pool.apply_async(func, (item,)))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().get()
+    while in_flight:
+        yield in_flight.popleft().get()
+
+
+class StageStats:
+    """Counts the items and bytes a stage went through, and the time."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self._start = time.time()
+        self.seconds = 0.0
+
+    def add(self, num_bytes=0):
+        """add(self, num_bytes=0): One more item (of 'num_bytes' bytes)."""
+        self.items += 1
+        self.bytes += num_bytes
+        self.seconds = time.time() - self._start
+
+    def report(self):
+        """report(self): Return a line describing the stage's throughput."""
+        seconds = max(self.seconds, 1e-6)
+        return '%s: %d files, %.1f MB in %.1f s (%.1f files/s, %.2f MB/s)' % \
+               (self.name, self.items, self.bytes / 1e6, self.seconds,
+                self.items / seconds, self.bytes / 1e6 / seconds)
@@ -0,0 +1,179 @@
+"""
+Stream pages from the crawler straight into the index.
+
+Instead of crawling everything into 'html/', then cleaning it into
+'tokenized/', then tagging it into 'tagged/' and then indexing, every
+page the crawler keeps goes through cleaning, tagging and counting (in a
+pool of worker processes) and into an indexer.IndexBuilder as soon as
+it's downloaded. The intermediate directories are only written if asked
+for, and a queryable index of the pages so far can be published every
+few pages while the crawl goes on.
+"""
+
+import os
+import time
+import threading
+import Queue
+import multiprocessing
+# modules I've written:
+import crawler
+import preprocessor
+import morphosyntactic
+import vector_space
+import indexer
+import parallel
+
+# end of stream marker
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised in the crawler's thread to end a crawl nobody's reading."""
+
+
+def iter_pages(c, max_queued=64):
+    """
+    iter_pages(c, max_queued=64): Run crawler 'c' in a background thread
+    and yield (id, url, html) for every page it keeps, as it keeps them.
+    The crawler waits if more than 'max_queued' pages haven't been consumed.
+    If the consumer stops early (or fails) the crawl is ended, so that the
+    crawler checkpoints and its thread exits.
+    """
+    pages = Queue.Queue(max_queued)
+    stop = threading.Event()
+    failure = []
+
+    def on_page(id, url, html):
+        while True:
+            if stop.is_set():
+                raise _Stopped
+            try:
+                pages.put((id, url, html), True, 0.1)
+                return
+            except Queue.Full:
+                continue
+
+    def run():
+        try:
+            c.crawl(on_page=on_page)
+        except _Stopped:
+            pass
+        except Exception as e:
+            failure.append(e)
+        finally:
+            pages.put(_DONE)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            page = pages.get()
+            if page is _DONE:
+                break
+            yield page
+    finally:
+        stop.set()
+        # make room for whatever the crawler still puts, until it's done
+        while thread.is_alive():
+            try:
+                pages.get(True, 0.1)
+            except Queue.Empty:
+                pass
+        thread.join()
+    if failure and not isinstance(failure[0], crawler.OutOfUrlsError):
+        raise failure[0]
+
+def _ensure_dir(dirname):
+    if not os.path.isdir(dirname):
+        os.mkdir(dirname)
+
+def page_term_freqs(page, keep_files=False):
+    """
+    page_term_freqs(page, keep_files=False): Clean, tokenize, tag and count
+    the lemmas of 'page', an (id, url, html) tuple. Return a tuple
+    (id, url, {lemma: tf}, number of lemmas, size of the html).
+
+    If 'keep_files' == True, also save the tokenized and tagged text as
+    'tokenized/<id>.txt' and 'tagged/<id>.txt'.
+    """
+    id, url, html = page
+    tokenized_text = preprocessor.clean_and_tokenize(html)
+    tagged_text = morphosyntactic.tag_text(tokenized_text)
+    if keep_files:
+        _ensure_dir('tokenized')
+        _ensure_dir('tagged')
+        with open('tokenized/' + str(id) + '.txt', 'w') as f:
+            f.write(tokenized_text)
+        with open('tagged/' + str(id) + '.txt', 'w') as f:
+            f.write(tagged_text)
+    term_freqs, length = vector_space.count_lemmas(tagged_text.splitlines(),
+                                                   True)
+    return id, url, term_freqs, length, len(html)
+
+def _page_term_freqs_keep_files(page):
+    return page_term_freqs(page, True)
+
+def iter_term_freqs(pages, processes=None, keep_files=False):
+    """
+    iter_term_freqs(pages, processes=None, keep_files=False): Yield
+    page_term_freqs() of every page in 'pages' (in the same order),
+    computed by 'processes' worker processes (default: one per CPU core).
+    """
+    if processes is None:
+        processes = parallel.cpu_count()
+    if keep_files:
+        func = _page_term_freqs_keep_files
+    else:
+        func = page_term_freqs
+    if processes <= 1:
+        for page in pages:
+            yield func(page)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in parallel.bounded_imap(pool, func, pages):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+def stream_index(c=None, processes=None, keep_files=False,
+                 publish_every=None, on_publish=None, verbose=True):
+    """
+    stream_index(c=None, processes=None, keep_files=False,
+    publish_every=None, on_publish=None, verbose=True): Crawl with crawler
+    'c' (a new crawler.Crawler by default) and index the pages as they
+    come. Return a tuple (index, urls).
+
+    If 'publish_every' is given, call on_publish(index, urls) with an index
+    of the pages so far every 'publish_every' pages.
+    """
+    if c is None:
+        c = crawler.Crawler(save_pages=keep_files)
+    urls = c.get_page_urls()
+    builder = indexer.IndexBuilder()
+    stats = parallel.StageStats('crawl, clean, tag and count')
+    start = time.time()
+    pages = iter_pages(c)
+    try:
+        for id, url, term_freqs, length, size in \
+                iter_term_freqs(pages, processes, keep_files):
+            builder.add_document(id, term_freqs, length)
+            stats.add(size)
+            if verbose:
+                print 'Indexed page ' + str(id) + ' (' + url + ')'
+            if publish_every and on_publish is not None and \
+               builder.get_num_docs() % publish_every == 0:
+                if builder.get_num_docs() == publish_every and verbose:
+                    print 'First index ready after %.1f seconds' % \
+                          (time.time() - start)
+                on_publish(builder.snapshot(), list(urls))
+    finally:
+        # ends the crawl if indexing failed or was interrupted
+        pages.close()
+    index = builder.finish()
+    urls = c.get_page_urls()
+    if verbose:
+        print stats.report()
+    return index, urls
@@ -0,0 +1,608 @@
+"""
+An optional positional index: where in every document each lemma occurs.
+
+The position of a word is its line number in the document's tagged file
+(every word counts, stop words too, so "whale in the sea" keeps 'sea' three
+words after 'whale'); positions are only kept for the lemmas the inverted
+index has, i.e. open class words.
+
+Layout of a positional index file (all numbers little-endian):
+
+    header        magic, version, number of lemmas, offsets of the lemma
+                  table and of the lemma strings, offset of the document
+                  lengths and number of doc ids, offset and size of the 
+                  stop words
+    postings      for every lemma: its doc ids (int32, sorted), the offset
+                  of every document's position list in the position bytes
+                  (uint32, one more than there are documents) and the
+                  position bytes: every document's positions as varints of
+                  the gaps between them (see postings.encode_ids())
+    lemma table   one fixed size entry per lemma, sorted by lemma:
+                  (string offset, string length, postings offset,
+                  number of documents, number of position bytes)
+    strings       the lemmas, utf-8 encoded, one after the other
+    lengths       every document's number of words (int32 per doc id)
+    stop words    the lemmas of the closed class words of the documents,
+                  utf-8 encoded, one per line
+
+A phrase query's stop words (and words gposttl doesn't know) aren't in the
+index; they only keep the distance between the other words, and the
+document lengths tell whether a phrase starting or ending with them fits
+in the document. A query lemma that is neither in the index nor a stop
+word isn't in any document, so the phrase matches nothing.
+
+Like a binary index, the file is memory-mapped. A position list is only
+decoded when a query needs that document, so phrase_match() and
+proximity_top_k() skip most of the postings they'd otherwise have to scan.
+"""
+
+import os
+import sys
+import mmap
+import heapq
+import array
+import bisect
+import struct
+import getopt
+# modules I've written:
+import postings
+import manifest
+import vector_space
+from lemmatizer import UNKNOWN
+from binary_index import BadIndexFileError, _to_bytes, _write_array, \
+    _read_array
+
+MAGIC = 'SWSEPOS\x00'
+VERSION = 1
+POSITIONS_FILE = 'positions.bin'
+
+_HEADER = struct.Struct('<8sIIQQQIQI')
+_ENTRY = struct.Struct('<IIQII')
+
+
+class PositionalPostings(object):
+    """
+    A lemma's doc ids and, for each of them, its positions in the document.
+    """
+
+    __slots__ = ('ids', '_offsets', '_positions')
+
+    def __init__(self, ids, offsets, positions):
+        """
+        __init__(self, ids, offsets, positions): 'ids' is an array('i') of
+        sorted doc ids, 'positions' the encoded position lists one after the
+        other and 'offsets' an array of len(ids) + 1 offsets into it.
+        """
+        self.ids = ids
+        self._offsets = offsets
+        self._positions = positions
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, i):
+        """
+        positions(self, i): Return the positions (an array('i')) in the
+        document self.ids[i].
+        """
+        return postings.decode_ids(
+            self._positions[self._offsets[i]:self._offsets[i + 1]])
+
+    def positions_of(self, id):
+        """
+        positions_of(self, id): Return the positions in document 'id', or
+        None if the lemma isn't in it.
+        """
+        i = bisect.bisect_left(self.ids, id)
+        if i < len(self.ids) and self.ids[i] == id:
+            return self.positions(i)
+        return None
+
+
+class PositionalIndexWriter:
+    """
+    Write a positional index one lemma at a time, in sorted (utf-8 byte)
+    order.
+    """
+
+    def __init__(self, file):
+        """
+        __init__(self, file): 'file' is a file object opened for writing
+        in binary mode.
+        """
+        self._file = file
+        self._entries = []
+        self._strings = []
+        self._strings_size = 0
+        self._last_lemma = None
+        # leave room for the header, we'll write it when we're done
+        self._file.write('\x00' * _HEADER.size)
+        self._offset = _HEADER.size
+
+    def add(self, lemma, ids, position_lists):
+        """
+        add(self, lemma, ids, position_lists): Add the positions of 'lemma':
+        'ids' is a sorted sequence of doc ids and 'position_lists' the
+        matching encoded position lists (see postings.encode_ids()).
+        """
+        lemma = _to_bytes(lemma)
+        if self._last_lemma is not None and lemma <= self._last_lemma:
+            raise ValueError('lemmas must be added in sorted order')
+        self._last_lemma = lemma
+        offsets = array.array('I', [0])
+        for encoded in position_lists:
+            offsets.append(offsets[-1] + len(encoded))
+        count = len(ids)
+        size = offsets[-1]
+        self._entries.append((self._strings_size, len(lemma), self._offset,
+                              count, size))
+        self._strings.append(lemma)
+        self._strings_size += len(lemma)
+        _write_array(self._file, 'i', ids)
+        _write_array(self._file, 'I', offsets)
+        for encoded in position_lists:
+            self._file.write(encoded)
+        self._offset += 4 * count + 4 * (count + 1) + size
+
+    def close(self, lengths=(), stop_words=()):
+        """
+        close(self, lengths=(), stop_words=()): Write the lemma table, 
+        strings, the document lengths 'lengths' (number of words of doc id
+        i at position i), the lemmas 'stop_words' and the header.
+        """
+        table_offset = self._offset
+        for entry in self._entries:
+            self._file.write(_ENTRY.pack(*entry))
+        strings_offset = table_offset + _ENTRY.size * len(self._entries)
+        for lemma in self._strings:
+            self._file.write(lemma)
+        lengths_offset = strings_offset + self._strings_size
+        _write_array(self._file, 'i', lengths)
+        stop_offset = lengths_offset + 4 * len(lengths)
+        stop_bytes = ''.join([_to_bytes(lemma) + '\n' for lemma in
+                              sorted(stop_words, key=_to_bytes)])
+        self._file.write(stop_bytes)
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(MAGIC, VERSION, len(self._entries),
+                                      table_offset, strings_offset,
+                                      lengths_offset, len(lengths),
+                                      stop_offset, len(stop_bytes)))
+        self._file.flush()
+
+
+class PositionalIndexBuilder:
+    """
+    Collect the positions of the lemmas of one document at a time and write
+    them as a positional index with finish().
+    """
+
+    def __init__(self):
+        # positions[lemma] is a list of (doc id, encoded positions)
+        self._positions = {}
+        self._lengths = {}
+        self._stop_words = set()
+        self._num_docs = 0
+
+    def add_document(self, id, words):
+        """
+        add_document(self, id, words): Add document 'id'. 'words' is an
+        iterable of (position, lemma, is_stop_word) tuples in position
+        order, one for every word (see vector_space.iter_word_positions()).
+        """
+        doc = {}
+        length = 0
+        for position, lemma, is_stop_word in words:
+            length = position + 1
+            if is_stop_word:
+                self._stop_words.add(lemma)
+            elif lemma != UNKNOWN:
+                doc.setdefault(lemma, []).append(position)
+        for lemma, positions in doc.iteritems():
+            self._positions.setdefault(lemma, []).append(
+                (id, postings.encode_ids(positions)))
+        self._lengths[id] = length
+        self._num_docs += 1
+
+    def get_num_docs(self):
+        """get_num_docs(self): Return the number of documents added."""
+        return self._num_docs
+
+    def finish(self, file):
+        """
+        finish(self, file): Write the positional index to 'file' (opened for
+        writing in binary mode). The builder can't be used after that.
+        """
+        writer = PositionalIndexWriter(file)
+        for lemma in sorted(self._positions.iterkeys(), key=_to_bytes):
+            docs = sorted(self._positions[lemma])
+            writer.add(lemma, [id for id, encoded in docs],
+                       [encoded for id, encoded in docs])
+        lengths = [0] * (max(self._lengths) + 1 if self._lengths else 0)
+        for id, length in self._lengths.iteritems():
+            lengths[id] = length
+        writer.close(lengths, self._stop_words)
+        self._positions = None
+
+
+def is_positional_index(filename):
+    """is_positional_index(filename): True if 'filename' starts with MAGIC."""
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class PositionalIndex:
+    """
+    A read-only positional index backed by a memory-mapped file.
+    index[lemma] returns the lemma's PositionalPostings and raises KeyError
+    if the lemma is not in the index.
+    """
+
+    def __init__(self, filename=POSITIONS_FILE):
+        """__init__(self, filename=POSITIONS_FILE): Map file 'filename'."""
+        self._filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # empty file
+            self._file.close()
+            raise BadIndexFileError(filename, 'file is empty')
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise BadIndexFileError(filename, 'file is too short')
+        magic, version = _HEADER.unpack_from(self._map, 0)[:2]
+        if magic != MAGIC:
+            self.close()
+            raise BadIndexFileError(filename, 'not a positional index')
+        if version != VERSION:
+            self.close()
+            raise BadIndexFileError(filename, 'unsupported version ' +
+                                    str(version))
+        magic, version, self._num_lemmas, self._table_offset, \
+            self._strings_offset, lengths_offset, num_lengths, stop_offset, \
+            stop_size = _HEADER.unpack_from(self._map, 0)
+        self._lengths = _read_array(self._map, 'i', lengths_offset,
+                                    num_lengths)
+        self._stop_words = frozenset(
+            self._map[stop_offset:stop_offset + stop_size].splitlines())
+
+    def close(self):
+        """close(self): Unmap and close the index file."""
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._num_lemmas
+
+    def length(self, id):
+        """length(self, id): Return the number of words of document 'id'."""
+        if 0 <= id < len(self._lengths):
+            return self._lengths[id]
+        return 0
+
+    def is_stop_word(self, lemma):
+        """
+        is_stop_word(self, lemma): True if 'lemma' is the lemma of a closed
+        class word of some document.
+        """
+        return _to_bytes(lemma) in self._stop_words
+
+    def _entry(self, i):
+        """Return the i-th entry of the lemma table."""
+        return _ENTRY.unpack_from(self._map,
+                                  self._table_offset + i * _ENTRY.size)
+
+    def _lemma(self, entry):
+        """Return the lemma (a str) an entry of the lemma table points to."""
+        start = self._strings_offset + entry[0]
+        return self._map[start:start + entry[1]]
+
+    def _find(self, lemma):
+        """Return the lemma table entry for 'lemma' or None."""
+        lemma = _to_bytes(lemma)
+        low, high = 0, self._num_lemmas
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            found = self._lemma(entry)
+            if found < lemma:
+                low = middle + 1
+            elif found > lemma:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def _postings(self, entry):
+        """Read the postings an entry of the lemma table points to."""
+        offset, count, size = entry[2], entry[3], entry[4]
+        ids = _read_array(self._map, 'i', offset, count)
+        offset += 4 * count
+        offsets = _read_array(self._map, 'I', offset, count + 1)
+        offset += 4 * (count + 1)
+        return PositionalPostings(ids, offsets,
+                                  self._map[offset:offset + size])
+
+    def __getitem__(self, lemma):
+        entry = self._find(lemma)
+        if entry is None:
+            raise KeyError(lemma)
+        return self._postings(entry)
+
+    def get(self, lemma, default=None):
+        try:
+            return self[lemma]
+        except KeyError:
+            return default
+
+    def __contains__(self, lemma):
+        return self._find(lemma) is not None
+
+    def iterkeys(self):
+        """iterkeys(self): Iterate over the lemmas in sorted order."""
+        for i in xrange(self._num_lemmas):
+            yield self._lemma(self._entry(i))
+
+    __iter__ = iterkeys
+
+
+def _gallop(ids, id, low):
+    """
+    Return the position of the first doc id >= 'id' in the sorted array
+    'ids', starting at position 'low': the step doubles until it overshoots,
+    then a binary search narrows it down.
+    """
+    n = len(ids)
+    step = 1
+    high = low
+    while high < n and ids[high] < id:
+        low = high + 1
+        high += step
+        step *= 2
+    return bisect.bisect_left(ids, id, low, min(high, n))
+
+def _phrase_terms(index, lemmas):
+    """
+    Return [(postings, offset)] for the lemmas of the phrase 'lemmas' the
+    index has, with each lemma's offset in the phrase; stop words and 
+    UNKNOWN only keep the distance between the others. Return None if the 
+    phrase has no lemma the index has, or has a lemma that is in no 
+    document.
+    """
+    terms = []
+    for offset, lemma in enumerate(lemmas):
+        if lemma == UNKNOWN:
+            continue
+        lemma_postings = index.get(lemma)
+        if lemma_postings is not None:
+            terms.append((lemma_postings, offset))
+        elif not index.is_stop_word(lemma):
+            return None
+    if not terms:
+        return None
+    return terms
+
+def _fitting(index, id, starts, size):
+    """
+    Return the positions of 'starts' where a phrase of 'size' words fits in
+    document 'id' (from its first word to its last).
+    """
+    last_start = index.length(id) - size
+    return [start for start in starts if 0 <= start <= last_start]
+
+def phrase_match(index, lemmas):
+    """
+    phrase_match(index, lemmas): Return a list of (doc_id, occurrences)
+    tuples, sorted by doc id, for the documents of the positional index
+    'index' containing the phrase 'lemmas' (a list of lemmas, in order).
+
+    The doc ids of the lemma in the fewest documents are looked up in the
+    others by galloping search, and the position lists of a document are
+    only decoded once it contains every lemma; checking stops at the first
+    lemma that isn't where the phrase needs it.
+    """
+    terms = _phrase_terms(index, lemmas)
+    if terms is None:
+        return []
+    terms.sort(key=lambda (lemma_postings, offset): len(lemma_postings))
+    first, first_offset = terms[0]
+    others = terms[1:]
+    cursors = [0] * len(others)
+    matches = []
+    for i, id in enumerate(first.ids):
+        found = True
+        for j, (lemma_postings, offset) in enumerate(others):
+            p = _gallop(lemma_postings.ids, id, cursors[j])
+            cursors[j] = p
+            if p == len(lemma_postings.ids):
+                # no more documents with this lemma
+                return matches
+            if lemma_postings.ids[p] != id:
+                found = False
+                break
+        if not found:
+            continue
+        # where the phrase would start
+        starts = set([position - first_offset
+                      for position in first.positions(i)])
+        for j, (lemma_postings, offset) in enumerate(others):
+            starts.intersection_update(
+                [position - offset for position in
+                 lemma_postings.positions(cursors[j])])
+            if not starts:
+                break
+        if starts:
+            starts = _fitting(index, id, starts, len(lemmas))
+        if starts:
+            matches.append((id, len(starts)))
+    return matches
+
+def naive_phrase_match(index, lemmas):
+    """
+    naive_phrase_match(index, lemmas): Same as phrase_match(), decoding the
+    position lists of every document of every lemma. (for comparison)
+    """
+    terms = _phrase_terms(index, lemmas)
+    if terms is None:
+        return []
+    starts = None
+    for lemma_postings, offset in terms:
+        term_starts = {}
+        for i, id in enumerate(lemma_postings.ids):
+            term_starts[id] = set([position - offset for position in
+                                   lemma_postings.positions(i)])
+        if starts is None:
+            starts = term_starts
+            continue
+        for id in starts.keys():
+            if id in term_starts:
+                starts[id] &= term_starts[id]
+            if id not in term_starts or not starts[id]:
+                del starts[id]
+    matches = []
+    for id, s in sorted(starts.iteritems()):
+        s = _fitting(index, id, s, len(lemmas))
+        if s:
+            matches.append((id, len(s)))
+    return matches
+
+def min_span(position_lists):
+    """
+    min_span(position_lists): Return the length (last position - first) of
+    the smallest window holding a position from every sorted list in
+    'position_lists'.
+    """
+    heap = [(positions[0], i, 0) for i, positions in
+            enumerate(position_lists)]
+    heapq.heapify(heap)
+    highest = max([positions[0] for positions in position_lists])
+    best = highest - heap[0][0]
+    while True:
+        lowest, i, p = heapq.heappop(heap)
+        best = min(best, highest - lowest)
+        if p + 1 == len(position_lists[i]):
+            return best
+        following = position_lists[i][p + 1]
+        highest = max(highest, following)
+        heapq.heappush(heap, (following, i, p + 1))
+
+def _proximity_factor(matched, span, alpha):
+    """
+    Return what a score is multiplied by when 'matched' distinct query
+    lemmas are within a window of length 'span': 1 + alpha * (matched - 1)
+    when they're next to each other, going down to 1 as they move apart.
+    """
+    if matched < 2:
+        return 1.0
+    return 1.0 + alpha * (matched - 1) / float(span - matched + 2)
+
+def proximity_top_k(weights_index, index, lemmas, top_k=None, alpha=1.0):
+    """
+    proximity_top_k(weights_index, index, lemmas, top_k=None, alpha=1.0):
+    Score the documents matching 'lemmas' and return a list of (doc_id,
+    score) tuples sorted by score in descending order (ties go to the
+    smaller doc id), the 'top_k' best only if 'top_k' is given.
+
+    A document's score is its tf-idf score from 'weights_index' (the
+    inverted index) multiplied by a proximity factor: the closer the query
+    lemmas are in the document (according to the positional index
+    'index'), the larger (see _proximity_factor()).
+
+    Documents are visited from the largest tf-idf score down; since the
+    factor is at most 1 + alpha * (lemmas in the document - 1), positions
+    are only decoded for documents that could still make it into the top k,
+    and the search stops as soon as none can.
+    """
+    multiplicity = {}
+    for lemma in lemmas:
+        multiplicity[lemma] = multiplicity.get(lemma, 0) + 1
+    scores = {}
+    matched = {}
+    positional = {}
+    for lemma, times in multiplicity.iteritems():
+        lemma_postings = weights_index.get(lemma)
+        if lemma_postings is None:
+            continue
+        for id, weight in lemma_postings.iteritems():
+            scores[id] = scores.get(id, 0.0) + times * weight
+            matched[id] = matched.get(id, 0) + 1
+        positions = index.get(lemma)
+        if positions is not None:
+            positional[lemma] = positions
+    candidates = sorted(scores.iteritems(),
+                        key=lambda (id, score): (-score, id))
+    best_factor = _proximity_factor(len(positional), len(positional) - 1,
+                                    alpha)
+    # min-heap of the best (score, -doc_id) found so far
+    heap = []
+    for id, score in candidates:
+        if top_k is not None and len(heap) == top_k:
+            threshold = heap[0][0]
+            if score * best_factor < threshold:
+                # nothing after this document can make it either
+                break
+            if score * _proximity_factor(matched[id], matched[id] - 1,
+                                         alpha) < threshold:
+                continue
+        position_lists = []
+        for positions in positional.itervalues():
+            doc_positions = positions.positions_of(id)
+            if doc_positions is not None:
+                position_lists.append(doc_positions)
+        if len(position_lists) > 1:
+            score *= _proximity_factor(len(position_lists),
+                                       min_span(position_lists), alpha)
+        entry = (score, -id)
+        if top_k is None or len(heap) < top_k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+    return [(-negative_id, score) for score, negative_id in
+            sorted(heap, reverse=True)]
+
+def make_positional_index_file(filename=POSITIONS_FILE):
+    """
+    make_positional_index_file(filename=POSITIONS_FILE): Make the positional
+    index of the tagged files 'tagged/<id>.txt' of the documents in the
+    corpus manifest and save it as 'filename'. Return the number of
+    documents.
+    """
+    builder = PositionalIndexBuilder()
+    for id in manifest.iter_doc_ids('tagged', '.txt'):
+        with open('tagged/' + str(id) + '.txt', 'r') as f:
+            builder.add_document(id, vector_space.iter_word_positions(f))
+    with open(filename + '.tmp', 'wb') as f:
+        builder.finish(f)
+    os.rename(filename + '.tmp', filename)
+    return builder.get_num_docs()
+
+def main(argv):
+    """
+    Make 'positions.bin' (or the file given with -o) from the files in
+    'tagged/'. preprocessor.py and morphosyntactic.py must have already
+    been called.
+    """
+    try:
+        opts, args = getopt.getopt(argv, 'o:', ['output='])
+    except getopt.GetoptError:
+        sys.stderr.write('usage: positional_index.py [-o file]\n')
+        return 2
+    filename = POSITIONS_FILE
+    for opt, arg in opts:
+        if opt in ('-o', '--output'):
+            filename = arg
+    print 'Making positional index \'' + filename + '\' ... ',
+    num_docs = make_positional_index_file(filename)
+    print '   done! (' + str(num_docs) + ' documents)'
+    return 0
+
+if __name__ == '__main__':
+    status = main(sys.argv[1:])
+    sys.exit(status)
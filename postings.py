@@ -0,0 +1,234 @@
+"""
+Compact postings lists for the inverted index.
+
+A postings list holds a lemma's doc ids in a sorted array('i') and the
+matching weights in an array('f'), instead of a {doc_id: weight} dict.
+That's 8 bytes per posting instead of the hundreds a dict entry and its
+int and float objects cost.
+
+CompressedPostings goes further and keeps the doc ids as varint-encoded
+gaps between consecutive ids (usually a single byte each).
+
+Every postings list also remembers its largest weight, which query
+evaluation uses as an upper bound on what the lemma can add to a score.
+"""
+
+import array
+import bisect
+from itertools import izip
+
+
+def _max_weight(weights):
+    """Return the largest of 'weights' (0.0 if there are none)."""
+    if len(weights):
+        return max(weights)
+    return 0.0
+
+def _sorted_pairs(pairs):
+    """Return 'pairs' (doc_id, weight) sorted by doc id as two arrays."""
+    ids = array.array('i')
+    weights = array.array('f')
+    for id, weight in sorted(pairs):
+        ids.append(id)
+        weights.append(weight)
+    return ids, weights
+
+
+class Postings(object):
+    """
+    A lemma's postings: sorted doc ids and their weights, in two arrays.
+
+    Supports the parts of the dict interface the rest of the code uses
+    (iteritems, iterkeys, get, in, len, [doc_id]), so it can stand in for
+    the {doc_id: weight} dicts the index used to be made of.
+    """
+
+    __slots__ = ('ids', 'weights', 'max_weight')
+
+    def __init__(self, ids=None, weights=None, max_weight=None):
+        """
+        __init__(self, ids=None, weights=None, max_weight=None): 'ids' is an
+        array('i') of sorted doc ids and 'weights' an array('f') of the 
+        matching weights. 'max_weight' is the largest weight; it will be
+        computed if it isn't given.
+        """
+        if ids is None:
+            ids = array.array('i')
+        if weights is None:
+            weights = array.array('f')
+        if max_weight is None:
+            max_weight = _max_weight(weights)
+        self.ids = ids
+        self.weights = weights
+        self.max_weight = max_weight
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """from_pairs(cls, pairs): Make postings from (doc_id, weight) pairs."""
+        return cls(*_sorted_pairs(pairs))
+
+    @classmethod
+    def from_dict(cls, d):
+        """from_dict(cls, d): Make postings from a {doc_id: weight} dict."""
+        return cls.from_pairs(d.iteritems())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _position(self, id):
+        """Return the position of doc id 'id' in self.ids or -1."""
+        i = bisect.bisect_left(self.ids, id)
+        if i < len(self.ids) and self.ids[i] == id:
+            return i
+        return -1
+
+    def __getitem__(self, id):
+        i = self._position(id)
+        if i < 0:
+            raise KeyError(id)
+        return self.weights[i]
+
+    def get(self, id, default=None):
+        i = self._position(id)
+        if i < 0:
+            return default
+        return self.weights[i]
+
+    def __contains__(self, id):
+        return self._position(id) >= 0
+
+    def iterkeys(self):
+        return iter(self.ids)
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        return iter(self.weights)
+
+    def iteritems(self):
+        return izip(self.ids, self.weights)
+
+    def compress(self):
+        """compress(self): Return a CompressedPostings copy of self."""
+        return CompressedPostings(encode_ids(self.ids),
+                                  self.weights.tostring(), len(self.ids),
+                                  self.max_weight)
+
+
+class CompressedPostings(object):
+    """
+    Postings with delta/varint encoded doc ids.
+
+    'ids' and 'weights' are decoded every time they are asked for, so this
+    trades query time for memory.
+    """
+
+    __slots__ = ('_ids', '_weights', '_count', 'max_weight')
+
+    def __init__(self, encoded_ids, weights, count, max_weight):
+        """
+        __init__(self, encoded_ids, weights, count, max_weight): 'encoded_ids'
+        is what encode_ids() returned for the doc ids, 'weights' the weights'
+        array('f') as a string, 'count' the number of postings and 
+        'max_weight' the largest weight.
+        """
+        self._ids = encoded_ids
+        self._weights = weights
+        self._count = count
+        self.max_weight = max_weight
+
+    @property
+    def ids(self):
+        return decode_ids(self._ids)
+
+    @property
+    def weights(self):
+        weights = array.array('f')
+        weights.fromstring(self._weights)
+        return weights
+
+    def decompress(self):
+        """decompress(self): Return a Postings copy of self."""
+        return Postings(self.ids, self.weights, self.max_weight)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, id):
+        return self.decompress()[id]
+
+    def get(self, id, default=None):
+        return self.decompress().get(id, default)
+
+    def __contains__(self, id):
+        return id in self.decompress()
+
+    def iterkeys(self):
+        return iter(self.ids)
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        return iter(self.weights)
+
+    def iteritems(self):
+        return izip(self.ids, self.weights)
+
+
+def encode_ids(ids):
+    """
+    encode_ids(ids): Encode the sorted doc ids 'ids' as varints of the gaps
+    between them and return the result as a string.
+
+    Every varint byte holds 7 bits of the number; the high bit is set on all
+    bytes but the last.
+    """
+    out = bytearray()
+    previous = 0
+    for id in ids:
+        gap = id - previous
+        previous = id
+        while gap >= 0x80:
+            out.append((gap & 0x7f) | 0x80)
+            gap >>= 7
+        out.append(gap)
+    return str(out)
+
+def decode_ids(encoded):
+    """decode_ids(encoded): Decode what encode_ids() returned to an array."""
+    ids = array.array('i')
+    previous = 0
+    gap = 0
+    shift = 0
+    for byte in bytearray(encoded):
+        gap |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            previous += gap
+            ids.append(previous)
+            gap = 0
+            shift = 0
+    return ids
+
+def as_postings(value):
+    """
+    as_postings(value): Return 'value' as postings. 'value' can already be
+    postings or a {doc_id: weight} dict.
+    """
+    if isinstance(value, dict):
+        return Postings.from_dict(value)
+    return value
+
+def freeze_index(index, compress=False):
+    """
+    freeze_index(index, compress=False): Turn every {doc_id: weight} dict in
+    'index' into Postings (CompressedPostings if 'compress' is True), in
+    place, and return 'index'.
+    """
+    for lemma, value in index.iteritems():
+        value = as_postings(value)
+        if compress and isinstance(value, Postings):
+            value = value.compress()
+        index[lemma] = value
+    return index
@@ -10,6 +10,11 @@ import string
 import re
 import nltk
 import glob
+import itertools
+import multiprocessing
+# modules I've written:
+import parallel
+import manifest
 
 _HTML_APOSTROPHE_RE = re.compile('(&rsquo;)|(&apos;)|(&#39;)')
 _HTML_OR_URL_ENTITY_RE = re.compile(r'(&[a-zA-Z]+;)|(&#\d+;)|(%[\da-fA-F]{2})')
@@ -70,33 +75,69 @@ def clean_query(query):
     query = query.translate(_TO_HYPHENS_AND_APOSTROPHES_TRANS)
     return query
 
-def clean_and_tokenize_all(webpages_dir=None):
+def clean_and_tokenize_file(pathname):
+    """
+    Clean and tokenize the '.html' file 'pathname' and save it as 
+    'tokenized/x.txt', where 'x' is the file's name without the extension.
+    
+    Return a tuple (pathname, size of the html in bytes).
+    """
+    with open(pathname, 'r') as f:
+        html = f.read()
+    tokenized_text = clean_and_tokenize(html)
+    # keep only the file's name, without path and '.html' extension
+    name = os.path.split(pathname)[1].rstrip('.html')
+    with open('./tokenized/' + name + '.txt', 'w') as f:
+        f.write(tokenized_text)
+    return pathname, len(html)
+
+def clean_and_tokenize_all(webpages_dir=None, processes=None):
     """
     Clean and tokenize all '.html' files inside the webpages_dir directory.
     
     After file '<webpages_dir>/x.html' is tokenized it will be saved as 
     'tokenized/x.txt'.
+
+    Without 'webpages_dir' the pages are those of the corpus manifest (see 
+    manifest.py), or './html/0.html', './html/1.html', ... if there is no 
+    manifest.
+    
+    The files are processed by 'processes' worker processes (default: one
+    per CPU core); progress is still printed in the order of the files.
     """
-    # default dir where crawled webpages have been stored
-    if webpages_dir is None:
-        webpages_dir = './html/'
+    if processes is None:
+        processes = parallel.cpu_count()
     # make directory 'tokenized/' if it doesn't already exist
-    os.mkdir('./tokenized/')
-    # process '.html' files inside webpages_dir
-    for pathname in glob.glob(webpages_dir + '/*.html'):
-        print 'processing ' + pathname + ' ...',
-        with open(pathname, 'r') as f:
-            html = f.read()
-        tokenized_text = clean_and_tokenize(html)
-        # keep only the file's name, without path and '.html' extension
-        name = os.path.split(pathname)[1].rstrip('.html')
-        with open('./tokenized/' + name + '.txt', 'w') as f:
-            f.write(tokenized_text)
-        print '     done!'
+    if not os.path.isdir('./tokenized/'):
+        os.mkdir('./tokenized/')
+    if webpages_dir is None:
+        # default dir where crawled webpages have been stored
+        pathnames = ('./html/' + str(id) + '.html' for id in 
+                     manifest.iter_doc_ids('html', '.html'))
+    else:
+        # process '.html' files inside webpages_dir
+        pathnames = glob.iglob(webpages_dir + '/*.html')
+    stats = parallel.StageStats('clean and tokenize')
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = parallel.bounded_imap(pool, clean_and_tokenize_file,
+                                        pathnames)
+    else:
+        results = itertools.imap(clean_and_tokenize_file, pathnames)
+    try:
+        for pathname, size in results:
+            print 'processing ' + pathname + ' ...     done!'
+            stats.add(size)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print stats.report()
 
 def main():
     """
-    Clean and tokenize files '0.html' - '999.html' inside the './html/' dir. 
+    Clean and tokenize files '0.html', '1.html', ... inside the './html/' dir.
     
     If an argument was given, assume it's the name of a directory containing
     the html pages we want to clean and tokenize (instead of the default
@@ -0,0 +1,91 @@
+"""
+Top-k query evaluation with MaxScore dynamic pruning.
+
+Documents are scored one at a time, in doc id order, over the postings of
+every query lemma. Each lemma's largest weight (stored by the indexer) is
+an upper bound on what it can add to a document's score. Once the k best
+documents found so far all score above the sum of the upper bounds of
+the "smallest" lemmas, a document that only contains those lemmas can't
+make it into the top k any more: their postings stop producing candidates
+and are only probed (with a binary search) for documents the other lemmas
+found.
+"""
+
+import heapq
+import bisect
+
+
+def max_score_top_k(terms, k):
+    """
+    max_score_top_k(terms, k): Return the 'k' documents with the largest
+    scores as a list of (doc_id, score) tuples, sorted by score in
+    descending order (ties go to the smaller doc id).
+
+    'terms' is a list of (postings, multiplicity) tuples, one per distinct
+    query lemma; a document's score is the sum of multiplicity * weight
+    over the lemmas it contains.
+    """
+    if k <= 0:
+        return []
+    # sort the lemmas by upper bound, smallest first
+    terms = sorted([(postings.max_weight * multiplicity, postings,
+                     multiplicity) for postings, multiplicity in terms
+                    if len(postings)])
+    n = len(terms)
+    ids = [postings.ids for _, postings, _ in terms]
+    weights = [postings.weights for _, postings, _ in terms]
+    lengths = [len(postings) for _, postings, _ in terms]
+    multiplicities = [multiplicity for _, _, multiplicity in terms]
+    # bound[i]: upper bound of the sum of lemmas 0..i
+    bound = []
+    total = 0.0
+    for upper, _, _ in terms:
+        total += upper
+        bound.append(total)
+    position = [0] * n
+    # lemmas 0..first_essential-1 can't get a document in the top k alone
+    first_essential = 0
+    # min-heap of the best (score, -doc_id) found so far
+    heap = []
+    threshold = None
+    while first_essential < n:
+        # next candidate: the smallest doc id the essential lemmas point to
+        candidate = None
+        for i in xrange(first_essential, n):
+            if position[i] < lengths[i]:
+                id = ids[i][position[i]]
+                if candidate is None or id < candidate:
+                    candidate = id
+        if candidate is None:
+            break
+        score = 0.0
+        for i in xrange(first_essential, n):
+            p = position[i]
+            if p < lengths[i] and ids[i][p] == candidate:
+                score += multiplicities[i] * weights[i][p]
+                position[i] = p + 1
+        # probe the non-essential lemmas, largest upper bound first, while
+        # the candidate can still make it into the top k
+        for i in xrange(first_essential - 1, -1, -1):
+            if threshold is not None and score + bound[i] < threshold:
+                break
+            p = bisect.bisect_left(ids[i], candidate, position[i],
+                                   lengths[i])
+            position[i] = p
+            if p < lengths[i] and ids[i][p] == candidate:
+                score += multiplicities[i] * weights[i][p]
+                position[i] = p + 1
+        entry = (score, -candidate)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+            if len(heap) < k:
+                continue
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+        else:
+            continue
+        threshold = heap[0][0]
+        while first_essential < n and bound[first_essential] < threshold:
+            first_essential += 1
+    return [(-negative_id, score) for score, negative_id in
+            sorted(heap, reverse=True)]
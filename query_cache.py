@@ -0,0 +1,67 @@
+"""A small LRU cache for query results (used by search_engine.py)."""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A dict-like cache holding at most 'max_size' entries. When it is full
+    the least recently used entry is evicted. Counts hits and misses. Safe
+    to use from several threads at once.
+    """
+
+    def __init__(self, max_size=1000):
+        """
+        __init__(self, max_size=1000): Make an empty cache. A 'max_size' of 0
+        makes a cache that never stores anything.
+        """
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        get(self, key, default=None): Return the value cached for 'key'
+        (making it the most recently used entry) or 'default'.
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """put(self, key, value): Cache 'value' for 'key'."""
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """clear(self): Drop every entry. (the counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def stats(self):
+        """stats(self): Return a dict with the cache's size and counters."""
+        return {'size': len(self._entries), 'max_size': self._max_size,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
@@ -0,0 +1,222 @@
+"""
+Answer many queries at the same time against one snapshot of the index.
+
+A QueryExecutor has a pool of threads that lemmatize queries (lemmatizing
+is mostly waiting for gposttl, so threads are enough; see lemmatizer.py)
+and a pool of worker processes that score them (scoring is pure Python, so
+it needs processes to use more than one core).
+
+The worker processes are forked from the process holding the search
+engine, so they share its index instead of loading a copy each: a binary
+index is a memory-mapped file and its pages are shared through the page
+cache, and an in-memory index is shared copy-on-write. A snapshot is a
+search engine and the pool of workers forked from it; it must not be
+changed once it's handed to the executor.
+
+swap() (or reload()) forks a pool for the new search engine and then swaps
+it in with one assignment. Queries that started on the old snapshot finish
+on it; the old workers are stopped when the last of them is done.
+
+The first pool is forked before the threads are made, and the lemmatizer
+is only made when the first query string comes in (evaluating lists of
+lemmas never starts one). A later swap() forks while they may be running,
+so a worker starts with metrics.after_fork() (a lemmatizing thread may
+have held the metrics lock) and never touches the lemmatizer or the search
+engine's caches. The
+metrics a worker collects go back with every batch it scores and are
+merged into the executor's process.
+
+Only plain queries go through the executor (no phrase, boolean or pattern
+queries; see search_engine.py).
+"""
+
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+# modules I've written:
+import search_engine
+import preprocessor
+import morphosyntactic
+import lemmatizer
+import parallel
+import metrics
+
+# the search engine of the snapshot a worker process was forked from
+_worker_searcher = None
+
+
+def _init_worker(searcher):
+    """Remember the snapshot's search engine in a new worker process."""
+    global _worker_searcher
+    metrics.after_fork()
+    _worker_searcher = searcher
+
+def _score(task):
+    """
+    Answer a (lemmas, top_k) task in a worker process. Return a tuple 
+    (results, metrics collected meanwhile or None).
+    """
+    lemmas, top_k = task
+    results = _worker_searcher.simple_query(lemmas, top_k, use_cache=False)
+    if metrics.is_enabled():
+        return results, metrics.take()
+    return results, None
+
+
+class _Snapshot:
+    """A search engine and the worker processes forked from it."""
+
+    def __init__(self, searcher, processes):
+        self.searcher = searcher
+        # with fork, the search engine is inherited, not pickled
+        self.pool = multiprocessing.Pool(processes, _init_worker,
+                                         (searcher,))
+        self.users = 0
+        self.retired = False
+
+    def close(self):
+        """close(self): Stop the worker processes."""
+        self.pool.close()
+        self.pool.join()
+
+
+class QueryExecutor:
+    """
+    Answers queries concurrently: a thread pool lemmatizes them and a pool
+    of processes sharing the index scores them.
+    """
+
+    def __init__(self, searcher, processes=None, threads=4, lemmatize=None):
+        """
+        __init__(self, searcher, processes=None, threads=4, lemmatize=None):
+        Answer queries with the SimpleSearchEngine 'searcher' (with an
+        index and a url map), in 'processes' worker processes (default:
+        one per CPU core). 'threads' threads lemmatize queries with
+        'lemmatize' (default: morphosyntactic.lemmatize_query).
+        """
+        if processes is None:
+            processes = parallel.cpu_count()
+        self.processes = processes
+        self._lock = threading.Lock()
+        # fork the workers while this is the only thread
+        self._snapshot = _Snapshot(searcher, processes)
+        self.generation = 0
+        if lemmatize is None:
+            # the lemmatizer is made by the first query that needs it
+            # (morphosyntactic.get_query_lemmatizer() holds a lock for that)
+            lemmatize = morphosyntactic.lemmatize_query
+        self._lemmatize_query = lemmatize
+        self._threads = ThreadPool(threads)
+
+    def _acquire(self):
+        """Return the current snapshot, counting one more user."""
+        with self._lock:
+            snapshot = self._snapshot
+            snapshot.users += 1
+            return snapshot
+
+    def _release(self, snapshot):
+        """Count one user less, and stop a retired snapshot's last one."""
+        with self._lock:
+            snapshot.users -= 1
+            done = snapshot.retired and snapshot.users == 0
+        if done:
+            snapshot.close()
+
+    def swap(self, searcher):
+        """
+        swap(self, searcher): Answer new queries with the SimpleSearchEngine
+        'searcher'. Queries already started finish on the old one.
+        """
+        snapshot = _Snapshot(searcher, self.processes)
+        with self._lock:
+            old, self._snapshot = self._snapshot, snapshot
+            self.generation += 1
+            old.retired = True
+            done = old.users == 0
+        if done:
+            old.close()
+
+    def reload(self, index_file=None, urls_file=None, index_format=None):
+        """
+        reload(self, index_file=None, urls_file=None, index_format=None):
+        Load the index and url map from files (see
+        SimpleSearchEngine.load_index_and_urls()) and swap() them in.
+        """
+        searcher = search_engine.SimpleSearchEngine()
+        searcher.load_index_and_urls(index_file, urls_file, index_format)
+        self.swap(searcher)
+
+    def get_searcher(self):
+        """get_searcher(self): Return the current snapshot's search engine."""
+        return self._snapshot.searcher
+
+    def _lemmatize(self, input):
+        """Clean and lemmatize the query string 'input'."""
+        with metrics.timer('query.lemmatize'):
+            return lemmatizer.known_lemmas(
+                self._lemmatize_query(preprocessor.clean_query(input)))
+
+    def query_many(self, inputs, top_k=None):
+        """
+        query_many(self, inputs, top_k=None): Clean, lemmatize and answer
+        every query string in 'inputs'. Return a list with a list of
+        (url, weight) tuples for each (see SimpleSearchEngine.query()).
+        """
+        return self.simple_query_many(self._threads.map(self._lemmatize,
+                                                        inputs), top_k)
+
+    def query(self, input, top_k=None):
+        """query(self, input, top_k=None): Same as query_many() for one query."""
+        return self.query_many([input], top_k)[0]
+
+    def simple_query_many(self, queries, top_k=None):
+        """
+        simple_query_many(self, queries, top_k=None): Answer every list of
+        lemmas in 'queries' (see SimpleSearchEngine.simple_query(), without
+        the cache), all of them against the same snapshot. Return a list
+        with a list of (url, weight) tuples for each.
+        """
+        snapshot = self._acquire()
+        try:
+            with metrics.timer('query.score_many'):
+                answers = snapshot.pool.map(_score, [(lemmas, top_k)
+                                                     for lemmas in queries])
+        finally:
+            self._release(snapshot)
+        for results, taken in answers:
+            if taken is not None:
+                metrics.merge(taken)
+        return [results for results, taken in answers]
+
+    def evaluate(self, queries, repeat=1, top_k=None):
+        """
+        evaluate(self, queries, repeat=1, top_k=None): Answer the lists of
+        lemmas 'queries' 'repeat' times, all at once, and return a dict with
+        the number of queries answered, the seconds it took and the
+        aggregate queries per second.
+        """
+        tasks = list(queries) * repeat
+        start = default_timer()
+        self.simple_query_many(tasks, top_k)
+        seconds = default_timer() - start
+        return {'queries': len(tasks), 'seconds': seconds,
+                'qps': len(tasks) / max(seconds, 1e-9)}
+
+    def close(self):
+        """close(self): Stop the threads and the worker processes."""
+        self._threads.close()
+        self._threads.join()
+        with self._lock:
+            snapshot = self._snapshot
+            snapshot.retired = True
+            done = snapshot.users == 0
+        if done:
+            snapshot.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
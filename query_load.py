@@ -0,0 +1,121 @@
+"""
+A load generator for query_server.py.
+
+A number of client threads, each with its own keep-alive connection, send
+search requests as fast as the server answers them. At the end the
+throughput, the latency percentiles and the number of failed (or
+rejected) requests are printed.
+"""
+
+import sys
+import json
+import time
+import random
+import getopt
+import urllib
+import httplib
+import urlparse
+import threading
+# modules I've written:
+import evaluate_index
+
+
+def _percentile(sorted_values, fraction):
+    """Return the value 'fraction' of the way into 'sorted_values'."""
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[i]
+
+def _client(netloc, queries, num_requests, top_k, latencies, failures, seed):
+    """One client: send 'num_requests' searches over one connection."""
+    rng = random.Random(seed)
+    connection = httplib.HTTPConnection(netloc)
+    for i in xrange(num_requests):
+        path = '/search?' + urllib.urlencode({'q': rng.choice(queries),
+                                              'k': top_k})
+        start = time.time()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            body = response.read()
+        except (httplib.HTTPException, IOError):
+            failures.append('connection')
+            connection.close()
+            connection = httplib.HTTPConnection(netloc)
+            continue
+        latencies.append(time.time() - start)
+        if response.status != 200:
+            failures.append(response.status)
+        else:
+            json.loads(body)
+    connection.close()
+
+def run(url, queries=None, clients=8, requests=1000, top_k=10):
+    """
+    run(url, queries=None, clients=8, requests=1000, top_k=10): Send
+    'requests' searches (random picks from 'queries', a list of strings) to
+    the server at 'url' from 'clients' threads. Return a dict with the
+    queries per second, the latency percentiles (in ms) and the failures.
+    """
+    if queries is None:
+        queries = [' '.join(query) for query in
+                   evaluate_index.DEFAULT_QUERIES]
+    netloc = urlparse.urlsplit(url)[1]
+    latencies = []
+    failures = []
+    threads = []
+    start = time.time()
+    for i in xrange(clients):
+        count = requests // clients + (i < requests % clients)
+        thread = threading.Thread(target=_client,
+                                  args=(netloc, queries, count, top_k,
+                                        latencies, failures, i))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+    latencies.sort()
+    return {'requests': requests, 'seconds': seconds,
+            'qps': len(latencies) / max(seconds, 1e-9),
+            'p50': 1000 * _percentile(latencies, 0.50),
+            'p95': 1000 * _percentile(latencies, 0.95),
+            'p99': 1000 * _percentile(latencies, 0.99),
+            'failures': len(failures)}
+
+def main(argv):
+    """
+    Load the server at '--url' with 1, 2, 4, ... up to '--clients' clients
+    and print the throughput and latencies for each.
+    """
+    try:
+        opts, args = getopt.getopt(argv, 'u:c:n:k:', ['url=', 'clients=',
+                                                      'requests=', 'top-k='])
+    except getopt.GetoptError:
+        sys.stderr.write('usage: query_load.py [-u url] [-c clients] '
+                         '[-n requests] [-k top_k]\n')
+        return 2
+    url, max_clients, requests, top_k = 'http://127.0.0.1:8080', 16, 2000, 10
+    for opt, arg in opts:
+        if opt in ('-u', '--url'):
+            url = arg
+        elif opt in ('-c', '--clients'):
+            max_clients = int(arg)
+        elif opt in ('-n', '--requests'):
+            requests = int(arg)
+        elif opt in ('-k', '--top-k'):
+            top_k = int(arg)
+    clients = 1
+    while clients <= max_clients:
+        stats = run(url, clients=clients, requests=requests, top_k=top_k)
+        print '%3d clients: %8.1f queries/second   p50 %6.2f ms   ' \
+              'p95 %6.2f ms   p99 %6.2f ms   %d failed' % \
+              (clients, stats['qps'], stats['p50'], stats['p95'],
+               stats['p99'], stats['failures'])
+        clients *= 2
+    return 0
+
+if __name__ == '__main__':
+    status = main(sys.argv[1:])
+    sys.exit(status)
@@ -0,0 +1,338 @@
+"""
+A long-running HTTP/JSON query server around SimpleSearchEngine.
+
+Endpoints:
+
+    GET  /search?q=<query>&k=<top k>&offset=<n>
+         or   POST /search {"q": ..., "k": ..., "offset": ...}
+         {"query": ..., "results": [{"url": .., "score": ..}, ...],
+          "seconds": ...}
+    GET  /health   {"status": "ok", ...}
+    GET  /stats    request counters, latency, lemmatizer batches and the
+                   search engine's cache statistics
+    GET  /metrics  per-stage timers and counters in the Prometheus text
+                   format (with --metrics; see metrics.py)
+
+Every connection gets a thread and is kept alive (HTTP/1.1). At most
+'max_concurrency' searches run at the same time; a search arriving when
+all slots are taken is answered with 503 right away instead of queueing
+up. Queries arriving at about the same time are lemmatized together: a
+LemmaBatcher collects them for a moment and hands them to the lemmatizer
+in one call, so one gposttl round trip serves many requests.
+"""
+
+import sys
+import time
+import json
+import getopt
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+# modules I've written:
+import search_engine
+import morphosyntactic
+import metrics
+from boolean_query import BooleanQueryError
+
+
+class LemmaBatcher:
+    """
+    Lemmatizes the queries of many threads in batches. lemmatize() blocks
+    until the batch its query went into is done.
+    """
+
+    def __init__(self, lemmatize_many=None, max_batch=32, max_delay=0.002):
+        """
+        __init__(self, lemmatize_many=None, max_batch=32, max_delay=0.002):
+        Call lemmatize_many(queries) (default:
+        morphosyntactic.lemmatize_queries) with up to 'max_batch' queries,
+        waiting up to 'max_delay' seconds after the first one for more.
+        """
+        if lemmatize_many is None:
+            lemmatize_many = morphosyntactic.lemmatize_queries
+        self._lemmatize_many = lemmatize_many
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._pending = []          # [query, event, lemmas, error] lists
+        self._cond = threading.Condition()
+        self._closed = False
+        self.batches = 0
+        self.queries = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def lemmatize(self, query):
+        """lemmatize(self, query): Return the list of lemmas of 'query'."""
+        request = [query, threading.Event(), None, None]
+        with self._cond:
+            self._pending.append(request)
+            self._cond.notify()
+        request[1].wait()
+        if request[3] is not None:
+            raise request[3]
+        return request[2]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # give other requests a moment to join the batch
+                deadline = time.time() + self._max_delay
+                while len(self._pending) < self._max_batch:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self._max_batch]
+                del self._pending[:self._max_batch]
+            try:
+                results = self._lemmatize_many([request[0] for request
+                                                in batch])
+                for request, lemmas in zip(batch, results):
+                    request[2] = lemmas
+            except Exception as e:
+                for request in batch:
+                    request[3] = e
+            self.batches += 1
+            self.queries += len(batch)
+            for request in batch:
+                request[1].set()
+
+    def close(self):
+        """close(self): Stop the batching thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+class QueryServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """An HTTP server answering queries with a SimpleSearchEngine."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, searcher, max_concurrency=16, top_k=10,
+                 batcher=None):
+        """
+        __init__(self, address, searcher, max_concurrency=16, top_k=10,
+        batcher=None): Serve on 'address' (a (host, port) tuple) with the
+        search engine 'searcher'. 'top_k' is the number of results when a
+        request doesn't say.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, _QueryHandler)
+        self.searcher = searcher
+        self.top_k = top_k
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        if batcher is None:
+            batcher = LemmaBatcher()
+        self.batcher = batcher
+        self.started = time.time()
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'searches': 0, 'errors': 0,
+                       'rejected': 0, 'in_flight': 0, 'search_seconds': 0.0}
+
+    def count(self, name, amount=1):
+        """count(self, name, amount=1): Add 'amount' to counter 'name'."""
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        """stats(self): Return a dict with the server's statistics."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        searches = stats['searches']
+        stats['mean_search_ms'] = \
+            1000.0 * stats.pop('search_seconds') / max(1, searches)
+        stats['uptime'] = time.time() - self.started
+        stats['max_concurrency'] = self.max_concurrency
+        stats['lemmatizer'] = {'batches': self.batcher.batches,
+                               'queries': self.batcher.queries}
+        stats['cache'] = self.searcher.cache_stats()
+        return stats
+
+    def search(self, query, top_k, offset=0):
+        """
+        search(self, query, top_k, offset=0): Answer the string 'query' with
+        the 'top_k' results after the 'offset' best. Return the dict the 
+        /search endpoint sends back.
+        """
+        start = time.time()
+        results = self.searcher.query(query, top_k, self.batcher.lemmatize,
+                                      offset)
+        seconds = time.time() - start
+        self.count('search_seconds', seconds)
+        return {'query': query,
+                'results': [{'url': url, 'score': score}
+                            for url, score in results],
+                'seconds': seconds}
+
+
+class _QueryHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles the requests of one (keep-alive) connection."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # don't write a line to stderr for every request
+        pass
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.count('requests')
+        url = urlparse.urlsplit(self.path)
+        if url.path == '/search':
+            params = urlparse.parse_qs(url.query)
+            self._search(params.get('q', [''])[0], params.get('k', [None])[0],
+                         params.get('offset', [0])[0])
+        elif url.path == '/health':
+            self._send_json(200, {'status': 'ok',
+                                  'uptime': time.time() - self.server.started})
+        elif url.path == '/stats':
+            self._send_json(200, self.server.stats())
+        elif url.path == '/metrics':
+            body = metrics.prometheus_text()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        self.server.count('requests')
+        length = int(self.headers.getheader('content-length', 0))
+        body = self.rfile.read(length)
+        if urlparse.urlsplit(self.path).path != '/search':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            request = json.loads(body)
+            query = request['q']
+            if not isinstance(query, basestring):
+                raise TypeError(query)
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'error': 'expected {"q": ..., "k": ...}'})
+            return
+        if isinstance(query, unicode):
+            query = query.encode('utf-8')
+        self._search(query, request.get('k'), request.get('offset', 0))
+
+    def _search(self, query, top_k, offset=0):
+        if top_k is None:
+            top_k = self.server.top_k
+        try:
+            top_k = int(top_k)
+            offset = int(offset)
+        except (ValueError, TypeError):
+            self._send_json(400, {'error': 'k and offset must be integers'})
+            return
+        if offset < 0:
+            self._send_json(400, {'error': 'offset must not be negative'})
+            return
+        if not self.server.slots.acquire(False):
+            self.server.count('rejected')
+            self._send_json(503, {'error': 'too many concurrent searches'})
+            return
+        self.server.count('in_flight')
+        try:
+            answer = self.server.search(query, top_k, offset)
+            self.server.count('searches')
+        except BooleanQueryError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self.server.count('errors')
+            self._send_json(500, {'error': str(e)})
+            return
+        finally:
+            self.server.count('in_flight', -1)
+            self.server.slots.release()
+        self._send_json(200, answer)
+
+
+def _print_help():
+    print 'HTTP/JSON query server. (query_server.py)\n'
+    print 'usage: query_server.py [arguments]\n'
+    print 'Arguments: '
+    print '   -h or --help                      display this help message'
+    print '   -i <file> or --index=<file>       load index from file <file>'
+    print '   -u <file> or --urls=<file>        load url-map from file <file>'
+    print '   -f <fmt> or --format=<fmt>        index file format, \'xml\' or '
+    print '                                     \'binary\''
+    print '   -l <name> or --lemmatizer=<name>  \'gposttl\' or \'python\''
+    print '   -p <port> or --port=<port>        port to listen on (8080)'
+    print '   -c <n> or --concurrency=<n>       searches at the same time (16)'
+    print '   -k <n> or --top-k=<n>             default number of results (10)'
+    print '   --metrics                         collect per-stage timings for '
+    print '                                     /metrics'
+
+def main(argv):
+    """
+    Load the index and url-map and serve queries until Ctrl-C is pressed.
+    (see _print_help() for the arguments)
+    """
+    try:
+        opts, args = getopt.getopt(argv, 'hi:u:f:l:p:c:k:',
+                                   ['help', 'index=', 'urls=', 'format=',
+                                    'lemmatizer=', 'port=', 'concurrency=',
+                                    'top-k=', 'metrics'])
+    except getopt.GetoptError:
+        _print_help()
+        return 2
+    index_file = None
+    urls_file = None
+    index_format = None
+    port = 8080
+    concurrency = 16
+    top_k = 10
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            _print_help()
+            return 0
+        elif opt in ('-i', '--index'):
+            index_file = arg
+        elif opt in ('-u', '--urls'):
+            urls_file = arg
+        elif opt in ('-f', '--format'):
+            index_format = arg
+        elif opt in ('-l', '--lemmatizer'):
+            morphosyntactic.set_query_lemmatizer(arg)
+        elif opt in ('-p', '--port'):
+            port = int(arg)
+        elif opt in ('-c', '--concurrency'):
+            concurrency = int(arg)
+        elif opt in ('-k', '--top-k'):
+            top_k = int(arg)
+        elif opt == '--metrics':
+            metrics.enable()
+    searcher = search_engine.SimpleSearchEngine()
+    print 'Loading index and url-map..'
+    searcher.load_index_and_urls(index_file, urls_file, index_format)
+    server = QueryServer(('', port), searcher, concurrency, top_k)
+    print 'Serving on port ' + str(port) + ' (Ctrl-C to stop)'
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    server.batcher.close()
+    return 0
+
+if __name__ == '__main__':
+    status = main(sys.argv[1:])
+    sys.exit(status)
@@ -1,9 +1,16 @@
-"""Subsystem #6: save and load the index."""
+"""
+Subsystem #6: save and load the index.
 
+The index can be saved as an xml file (easy to read, slow to load) or in
+the binary format of binary_index.py (compact, opened with mmap).
+"""
+
+import sys
 from xml.sax import make_parser
 from xml.sax.handler import feature_namespaces
 # modules I've written:
 import index_loader
+import binary_index
 
 
 def save_index(index, file):
@@ -39,3 +46,62 @@ def load_index(file):
     parser.parse(file)
     # return the index:
     return handler.get_index()
+
+def save_index_binary(index, file):
+    """
+    save_index_binary(index, file): Save the index in the binary format.
+
+    'file' is a file object opened for writing in binary mode.
+    """
+    binary_index.write_index(index, file)
+
+def load_index_binary(filename):
+    """
+    load_index_binary(filename): Open the binary index file 'filename'.
+
+    The file is memory-mapped, so this returns almost immediately; postings
+    are read from the file as they are needed.
+    """
+    return binary_index.BinaryIndex(filename)
+
+def index_format(filename):
+    """
+    index_format(filename): Return 'binary' if 'filename' is a binary index 
+    file and 'xml' otherwise.
+    """
+    if binary_index.is_binary_index(filename):
+        return 'binary'
+    return 'xml'
+
+def convert_index(from_filename, to_filename):
+    """
+    convert_index(from_filename, to_filename): Convert an xml index file to
+    the binary format or a binary index file to xml.
+    """
+    if index_format(from_filename) == 'binary':
+        with binary_index.BinaryIndex(from_filename) as index:
+            with open(to_filename, 'w') as f:
+                save_index(index, f)
+    else:
+        with open(from_filename, 'r') as f:
+            index = load_index(f)
+        with open(to_filename, 'wb') as f:
+            save_index_binary(index, f)
+
+def main():
+    """
+    Convert the index file given as the first argument to the other format
+    and save it as the file given as the second argument.
+    """
+    if len(sys.argv) != 3:
+        sys.stderr.write('usage: save_and_load.py <from_file> <to_file>\n')
+        return 2
+    print 'Converting \'' + sys.argv[1] + '\' to \'' + sys.argv[2] + \
+          '\' ... ',
+    convert_index(sys.argv[1], sys.argv[2])
+    print '   done!'
+    return 0
+
+if __name__ == '__main__':
+    status = main()
+    sys.exit(status)
@@ -1,14 +1,59 @@
 """A simple engine to query the index."""
 
-import time
-import operator
-import pickle
+import os
+import re
+import heapq
+from math import log, log10, sqrt
+from itertools import izip
+from timeit import default_timer
 
 import crawler
 import preprocessor
 import morphosyntactic
+import lemmatizer
 import indexer
 import save_and_load
+import postings
+import pruning
+import query_cache
+import pipeline
+import incremental_index
+import manifest
+import metrics
+import positional_index
+import numpy_scoring
+import url_table
+import docinfo
+import boolean_query
+import term_dictionary
+
+SCORING_MODES = ('tfidf', 'cosine', 'bm25')
+
+# the wildcards and the fuzzy suffix of a pattern (see term_dictionary.py)
+_PATTERN_SYNTAX_RE = re.compile(r'([*?]|~\d?$)')
+
+def _best(results, top_k):
+    """
+    Return the (page id, weight) items of the dict 'results' sorted by 
+    weight in descending order (ties going to the smaller id), only the 
+    'top_k' best if 'top_k' is given.
+    """
+    key = lambda (id, weight): (-weight, id)
+    if top_k is not None:
+        return heapq.nsmallest(top_k, results.iteritems(), key=key)
+    return sorted(results.iteritems(), key=key)
+
+def _clean_pattern(word):
+    """
+    Clean (see preprocessor.clean_query()) and lowercase the literal parts
+    of the pattern 'word', the way the words of a plain query are, and 
+    return the pattern.
+    """
+    parts = _PATTERN_SYNTAX_RE.split(word)
+    # the odd parts are the wildcards and the fuzzy suffix
+    for i in xrange(0, len(parts), 2):
+        parts[i] = ''.join(preprocessor.clean_query(parts[i]).lower().split())
+    return ''.join(parts)
 
 class NoIndexError(Exception):
     """
@@ -33,104 +78,825 @@ class NoUrlMapError(Exception):
     def __str__(self):
         return 'The search engine\'s id-to-url map has not been initialized.'
 
+class NoPositionalIndexError(Exception):
+    """
+    Exception produced when a phrase query is made without a positional 
+    index.
+    """
+    
+    def __init__(self):
+        pass
+    
+    def __str__(self):
+        return 'The search engine has no positional index.'
+
+class NoDocInfoError(Exception):
+    """
+    Exception produced when cosine or BM25 scoring is asked for without the
+    documents' norms and lengths (see docinfo.py).
+    """
+    
+    def __init__(self):
+        pass
+    
+    def __str__(self):
+        return 'The search engine has no document norms and lengths.'
+
+class ResultCursor:
+    """
+    The results of a query, found a page at a time.
+
+    A cursor asks the search engine for the best page_size results first,
+    and for twice as many as it has every time more are needed, so a user
+    who only looks at the first page never pays for scoring the rest. Urls
+    are only looked up for the results handed out.
+    """
+    
+    def __init__(self, searcher, lemmas, page_size=10):
+        """
+        __init__(self, searcher, lemmas, page_size=10): Go through the 
+        results of searcher.simple_query(lemmas).
+        """
+        self._searcher = searcher
+        self._lemmas = lemmas
+        self._page_size = page_size
+        self._hits = []
+        self._complete = False
+    
+    def _fetch(self, count):
+        """Make sure the best 'count' results (or all of them) are known."""
+        if self._complete or len(self._hits) >= count:
+            return
+        count = max(count, 2 * len(self._hits))
+        self._hits = self._searcher.query_ids(self._lemmas, count)
+        self._complete = len(self._hits) < count
+    
+    def page(self, offset, limit=None):
+        """
+        page(self, offset, limit=None): Return the (url, weight) tuples 
+        ranked 'offset' to 'offset' + 'limit' - 1. ('limit' defaults to the
+        page size)
+        """
+        if limit is None:
+            limit = self._page_size
+        self._fetch(offset + limit)
+        return self._searcher._resolve(self._hits[offset:offset + limit])
+    
+    def __iter__(self):
+        """Yield the (url, weight) tuples, best first."""
+        offset = 0
+        while True:
+            page = self.page(offset)
+            for result in page:
+                yield result
+            if len(page) < self._page_size:
+                return
+            offset += len(page)
+
 class SimpleSearchEngine:
     """A simple engine to query the index."""
     
-    def __init__(self, index=None, urls=None):
+    def __init__(self, index=None, urls=None, cache_size=1000):
         """
-        __init__(self, index=None, urls=None): Create a new SearchEngine.
+        __init__(self, index=None, urls=None, cache_size=1000): Create a new
+        SearchEngine.
         'index' can be an existing index
         'urls' can be a list mapping page ids to urls
+        'cache_size' is the number of query results (and of lemmatized 
+        queries) to keep in memory; 0 turns caching off
         """
-        self._index = index
-        self._urls = urls
+        self._index = None
+        self._urls = None
+        # an optional positional_index.PositionalIndex:
+        self._positions = None
+        # with use_numpy(), a numpy_scoring.DenseIndex copy of the index,
+        # made when the first query needs it:
+        self._use_numpy = False
+        self._dense = None
+        # an optional docinfo.DocInfo, for cosine and BM25 scoring:
+        self._docinfo = None
+        # 'tfidf', 'cosine' or 'bm25' (see set_scoring()):
+        self._scoring = 'tfidf'
+        self._bm25_params = (1.2, 0.75)
+        # k1 * (1 - b + b * length / average length) for every doc id:
+        self._bm25_norms = None
+        # a term_dictionary.TermDictionary of the index's lemmas, made when
+        # the first pattern needs it:
+        self._terms = None
+        # results of recent queries, keyed on (sorted lemmas, top_k):
+        self._result_cache = query_cache.LRUCache(cache_size)
+        # lemmas of recent raw query strings, keyed on (lemmatize, input):
+        self._lemma_cache = query_cache.LRUCache(cache_size)
+        # bumped every time a new index is swapped in or the index changes:
+        self._generation = 0
+        if index is not None or urls is not None:
+            self.set_index_and_urls(index, urls)
     
-    def query(self, input):
+    def query(self, input, top_k=None, lemmatize=None, offset=0):
         """
-        query(input): 'input' is a string. Clean, tokenize and lemmatize it, 
-        make the query and print the results.
+        query(input, top_k=None, lemmatize=None, offset=0): 'input' is a 
+        string. Clean, tokenize and lemmatize it, make the query and print 
+        the results.
+        
+        If 'top_k' is given only the 'top_k' best results are returned, 
+        skipping the 'offset' best (see search()).
+        'lemmatize' is the function that turns the cleaned query into a list
+        of lemmas (default: morphosyntactic.lemmatize_query).
+
+        A query in double quotes is a phrase query (see phrase_query()) if
+        a positional index was loaded. A query with AND, OR, NOT or 
+        parentheses is a boolean query (see boolean_query()). Words like
+        'whal*', 'wh?le' and 'whle~1' are expanded into the lemmas they
+        match (see expand_pattern()).
         """
-        # clean input:
-        query = preprocessor.clean_query(input)
-        lemmas = morphosyntactic.lemmatize_query(query)
+        metrics.count('query.queries')
+        stripped = input.strip()
+        phrase = len(stripped) > 1 and stripped[0] == stripped[-1] == '"'
+        if not phrase and boolean_query.is_boolean(stripped):
+            tree = boolean_query.lemmatize(
+                boolean_query.parse(stripped),
+                lambda word: self._boolean_lemmas(word, lemmatize),
+                self.expand_pattern)
+            return self.boolean_query(tree, top_k, offset=offset)
+        if not phrase and term_dictionary.has_pattern(stripped):
+            lemmas = self._expand_patterns(stripped, lemmatize)
+        else:
+            lemmas = self._lemmatize(input, lemmatize)
         # make the query:
-        results = self.simple_query(lemmas)
+        if phrase and self._positions is not None:
+            # unknown words keep their place in the phrase
+            return self.phrase_query(lemmas, top_k, offset=offset)
+        lemmas = lemmatizer.known_lemmas(lemmas)
+        if offset:
+            return self.search(lemmas, offset, top_k)
+        results = self.simple_query(lemmas, top_k)
         return results
     
-    def simple_query(self, lemmas):
+    def _lemmatize(self, input, lemmatize=None):
+        """
+        _lemmatize(self, input, lemmatize=None): Clean and lemmatize the 
+        string 'input' with 'lemmatize' (see query()) and return a tuple of 
+        lemmas, lemmatizer.UNKNOWN for the words it doesn't know. Lemmas of
+        recent strings are cached (for every lemmatize function 
+        separately).
+        """
+        if lemmatize is None:
+            lemmatize = morphosyntactic.lemmatize_query
+        # bound methods of the same object compare (and hash) equal, so
+        # e.g. a LemmaBatcher's lemmatize gets the same entries every time
+        key = (lemmatize, input)
+        lemmas = self._lemma_cache.get(key)
+        if lemmas is None:
+            # clean input:
+            with metrics.timer('query.clean'):
+                query = preprocessor.clean_query(input)
+            with metrics.timer('query.lemmatize'):
+                lemmas = tuple(lemmatize(query))
+            self._lemma_cache.put(key, lemmas)
+        return lemmas
+    
+    def _boolean_lemmas(self, word, lemmatize=None):
+        """
+        _boolean_lemmas(self, word, lemmatize=None): Return the known lemmas
+        of the word 'word' of a boolean query, as a tuple. If a positional 
+        index is loaded, stop words (closed class lemmas the index has no 
+        postings for) are left out, so 'whale AND the' is 'whale'; without 
+        one they stay, and such an AND matches no page.
+        """
+        lemmas = lemmatizer.known_lemmas(self._lemmatize(word, lemmatize))
+        if self._positions is None:
+            return lemmas
+        return tuple([lemma for lemma in lemmas
+                      if lemma in self._index or
+                      not self._positions.is_stop_word(lemma)])
+    
+    def _expand_patterns(self, input, lemmatize=None):
+        """
+        _expand_patterns(self, input, lemmatize=None): Lemmatize the plain 
+        words of the string 'input' and add the lemmas its patterns match.
+        Return a tuple of lemmas.
+        """
+        words = []
+        lemmas = []
+        for word in input.split():
+            expanded = self.expand_pattern(word)
+            if expanded is None:
+                words.append(word)
+            else:
+                lemmas.extend(expanded)
+        if words:
+            lemmas[:0] = lemmatizer.known_lemmas(
+                self._lemmatize(' '.join(words), lemmatize))
+        return tuple(lemmas)
+    
+    def expand_pattern(self, word, limit=term_dictionary.MAX_EXPANSIONS):
+        """
+        expand_pattern(self, word, limit=term_dictionary.MAX_EXPANSIONS): 
+        Return the lemmas of the index the prefix ('whal*'), wildcard 
+        ('wh?le') or fuzzy ('whle~1') pattern 'word' matches, at most 
+        'limit' of them, or None if 'word' isn't a pattern. See 
+        term_dictionary.py. The pattern is cleaned and lowercased like a
+        plain word first, so 'Whal*' matches what 'whal*' does.
+        """
+        if self._index == None:
+            raise NoIndexError
+        if term_dictionary.parse_pattern(word) is None:
+            return None
+        with metrics.timer('query.expand'):
+            return self.term_dictionary().expand(_clean_pattern(word), limit)
+    
+    def term_dictionary(self):
         """
-        simple_query(self, lemmas): Make a query to the index. 'lemmas' is 
-        a list of lemmas to search for.
+        term_dictionary(self): Return a term_dictionary.TermDictionary of 
+        the index's lemmas (made again after every change to the index).
+        """
+        if self._index == None:
+            raise NoIndexError
+        if self._terms is None:
+            self._terms = term_dictionary.TermDictionary(
+                term_dictionary.sorted_terms(self._index))
+        return self._terms
+    
+    def simple_query(self, lemmas, top_k=None, use_cache=True):
+        """
+        simple_query(self, lemmas, top_k=None, use_cache=True): Make a query 
+        to the index. 'lemmas' is a list of lemmas to search for.
         
         simple_query() returns a list of (url, weight) tuples sorted by weight
-        in descending order.
+        in descending order (ties go to the smaller page id). If 'top_k' is 
+        given only the 'top_k' tuples with the largest weights are returned;
+        they are found with MaxScore pruning (see pruning.py) instead of 
+        scoring every matching page.
+        With a positional index, pages where the lemmas are close to each 
+        other score higher (see positional_index.proximity_top_k()).
+        
+        Results are cached (the order of the lemmas doesn't matter) unless 
+        'use_cache' == False.
+        """
+        return self._resolve(self.query_ids(lemmas, top_k, use_cache))
+    
+    def query_ids(self, lemmas, top_k=None, use_cache=True):
+        """
+        query_ids(self, lemmas, top_k=None, use_cache=True): Same as 
+        simple_query(), returning (page id, weight) tuples. Pages are scored
+        by id; no url is looked up.
+        """
+        if self._index == None:
+            raise NoIndexError
+        if self._urls == None:
+            raise NoUrlMapError
+        if len(lemmas) == 0:
+            return []
+        if not use_cache:
+            with metrics.timer('query.score'):
+                return self._score(lemmas, top_k)
+        key = (tuple(sorted(lemmas)), top_k)
+        results = self._result_cache.get(key)
+        if results is None:
+            metrics.count('query.cache_misses')
+            generation = self._generation
+            with metrics.timer('query.score'):
+                results = self._score(lemmas, top_k)
+            # don't cache results of an index that changed meanwhile
+            if generation == self._generation:
+                self._result_cache.put(key, results)
+        # return a copy, so the caller can't change what's in the cache
+        return list(results)
+    
+    def search(self, lemmas, offset=0, limit=10):
+        """
+        search(self, lemmas, offset=0, limit=10): Return a page of the 
+        results of simple_query(lemmas): the (url, weight) tuples ranked 
+        'offset' to 'offset' + 'limit' - 1 (all of them from 'offset' on if
+        'limit' is None). Only the best 'offset' + 'limit' pages are found,
+        and only the urls of the page's results are looked up.
+        """
+        if limit is None:
+            hits = self.query_ids(lemmas)
+            return self._resolve(hits[offset:])
+        hits = self.query_ids(lemmas, offset + limit)
+        return self._resolve(hits[offset:offset + limit])
+    
+    def cursor(self, lemmas, page_size=10):
+        """
+        cursor(self, lemmas, page_size=10): Return a ResultCursor over the
+        results of simple_query(lemmas).
+        """
+        return ResultCursor(self, lemmas, page_size)
+    
+    def _resolve(self, hits):
+        """
+        _resolve(self, hits): Turn the (page id, weight) tuples 'hits' into
+        (url, weight) tuples.
+        """
+        urls = self._urls
+        return [(urls[id], weight) for id, weight in hits]
+    
+    def simple_query_many(self, queries, top_k=None):
+        """
+        simple_query_many(self, queries, top_k=None): Same as simple_query()
+        (without the cache) for every list of lemmas in 'queries'; return a
+        list with a result list for each. With the NumPy backend (see 
+        use_numpy()) the whole batch is scored at once.
+        """
+        if self._index == None:
+            raise NoIndexError
+        if self._urls == None:
+            raise NoUrlMapError
+        with metrics.timer('query.score_many'):
+            if self._use_numpy and self._positions is None and \
+               self._scoring == 'tfidf':
+                return [self._resolve(hits) for hits in
+                        self._dense_index().score_many(queries, top_k)]
+            return [self._resolve(self._score(lemmas, top_k))
+                    if len(lemmas) else [] for lemmas in queries]
+    
+    def use_numpy(self, on=True):
+        """
+        use_numpy(self, on=True): Score queries with the NumPy backend (see
+        numpy_scoring.py), or go back to the pure-Python one. The index is 
+        copied into NumPy arrays by the first query, and again after every
+        change, so this is for an index that doesn't change. Raises 
+        ImportError if NumPy isn't installed.
+        """
+        if on and not numpy_scoring.numpy_available():
+            raise ImportError('the NumPy backend needs numpy')
+        self._use_numpy = on
+        self._results_changed()
+    
+    def _dense_index(self):
+        """_dense_index(self): Return the index as a DenseIndex."""
+        if self._dense is None:
+            self._dense = numpy_scoring.DenseIndex(self._index)
+        return self._dense
+    
+    def phrase_query(self, lemmas, top_k=None, use_cache=True, offset=0):
+        """
+        phrase_query(self, lemmas, top_k=None, use_cache=True, offset=0): 
+        Return the (url, weight) tuples of the pages containing the lemmas 
+        'lemmas' next to each other, in that order, sorted by weight (the 
+        sum of the lemmas' weights) in descending order; the 'top_k' best 
+        after the 'offset' best if 'top_k' is given. Needs a positional 
+        index (see load_positional_index()).
         """
         if self._index == None:
             raise NoIndexError
         if self._urls == None:
             raise NoUrlMapError
+        if self._positions is None:
+            raise NoPositionalIndexError
         if len(lemmas) == 0:
             return []
-        # a dict mapping urls to importance according to the query:
+        key = ('"', tuple(lemmas))
+        results = None
+        if use_cache:
+            results = self._result_cache.get(key)
+        if results is None:
+            if use_cache:
+                metrics.count('query.cache_misses')
+            generation = self._generation
+            with metrics.timer('query.phrase'):
+                results = self._phrase_score(lemmas)
+            if use_cache and generation == self._generation:
+                self._result_cache.put(key, results)
+        if top_k is None:
+            return self._resolve(results[offset:])
+        return self._resolve(results[offset:offset + top_k])
+    
+    def boolean_query(self, tree, top_k=None, use_cache=True, offset=0):
+        """
+        boolean_query(self, tree, top_k=None, use_cache=True, offset=0): 
+        Return the (url, weight) tuples of the pages matching the 
+        lemmatized boolean query 'tree' (see boolean_query.py), sorted by 
+        weight (the sum of the weights of the lemmas not under a NOT) in 
+        descending order; the 'top_k' best after the 'offset' best if 
+        'top_k' is given. AND is evaluated by galloping through the sorted
+        postings, in time proportional to the shortest list.
+        """
+        if self._index == None:
+            raise NoIndexError
+        if self._urls == None:
+            raise NoUrlMapError
+        if tree is None:
+            return []
+        key = ('bool', tree)
+        results = None
+        if use_cache:
+            results = self._result_cache.get(key)
+        if results is None:
+            if use_cache:
+                metrics.count('query.cache_misses')
+            generation = self._generation
+            with metrics.timer('query.boolean'):
+                results = boolean_query.score(self._index, tree)
+            if use_cache and generation == self._generation:
+                self._result_cache.put(key, results)
+        if top_k is None:
+            return self._resolve(results[offset:])
+        return self._resolve(results[offset:offset + top_k])
+    
+    def _phrase_score(self, lemmas):
+        """
+        _phrase_score(self, lemmas): Score the pages matching the phrase 
+        'lemmas' and return a list of (page id, weight) tuples, best first.
+        """
+        lemma_postings = []
+        for lemma in lemmatizer.known_lemmas(lemmas):
+            try:
+                lemma_postings.append(self._index[lemma])
+            except KeyError:
+                # a stop word - it's only in the phrase to keep its place
+                continue
+        results = []
+        for id, occurrences in positional_index.phrase_match(self._positions,
+                                                             lemmas):
+            weight = 0.0
+            for p in lemma_postings:
+                weight += p.get(id, 0.0)
+            results.append((id, weight))
+        results.sort(key=lambda (id, weight): (-weight, id))
+        return results
+    
+    def _score(self, lemmas, top_k):
+        """
+        _score(self, lemmas, top_k): Score the pages matching 'lemmas' and 
+        return a list of (page id, weight) tuples, best first (the 'top_k'
+        best if 'top_k' is given).
+        """
+        if self._scoring == 'cosine':
+            return self._cosine_score(lemmas, top_k)
+        if self._scoring == 'bm25':
+            return self._bm25_score(lemmas, top_k)
+        if self._positions is not None and len(set(lemmas)) > 1:
+            return positional_index.proximity_top_k(self._index,
+                                                    self._positions,
+                                                    lemmas, top_k)
+        if self._use_numpy:
+            return self._dense_index().score(lemmas, top_k)
+        if top_k is not None:
+            return self._top_k_query(lemmas, top_k)
+        # a dict mapping page ids to importance according to the query:
         results = {}
         for lemma in lemmas:
             try:
-                for id, weight in self._index[lemma].iteritems():
-                    # increase the page's importance by 'weight':
-                    results[self._urls[id]] = results.get(self._urls[id], 
-                                                          0.0) + weight
+                lemma_postings = self._index[lemma]
             except KeyError:
                 # 'lemma' was not in the index
                 continue
+            for id, weight in izip(lemma_postings.ids, 
+                                   lemma_postings.weights):
+                # increase the page's importance by 'weight':
+                results[id] = results.get(id, 0.0) + weight
         # sort by weight (descending order) and return
-        return sorted(results.iteritems(), key=operator.itemgetter(1), 
-                      reverse=True)
+        return sorted(results.iteritems(), key=lambda (id, weight): 
+                      (-weight, id))
+    
+    def _query_terms(self, lemmas):
+        """
+        _query_terms(self, lemmas): Return a (postings, times, idf) tuple for
+        every distinct lemma of 'lemmas' in the index, 'times' being the 
+        number of times it's in the query and 'idf' log10(N / df), the idf 
+        its weights were multiplied by.
+        """
+        multiplicity = {}
+        for lemma in lemmas:
+            multiplicity[lemma] = multiplicity.get(lemma, 0) + 1
+        num_docs = float(self._docinfo.num_docs)
+        terms = []
+        for lemma, times in multiplicity.iteritems():
+            try:
+                lemma_postings = self._index[lemma]
+            except KeyError:
+                # 'lemma' was not in the index
+                continue
+            df = len(lemma_postings)
+            if df:
+                terms.append((lemma_postings, times, log10(num_docs / df)))
+        return terms
+    
+    def _cosine_score(self, lemmas, top_k):
+        """
+        _cosine_score(self, lemmas, top_k): Same as _score(), the weight 
+        being the cosine of the angle between the query's and the page's 
+        tf-idf vectors. The pages' norms are precomputed (see docinfo.py),
+        so this costs one pass over the postings, like plain tf-idf.
+        """
+        norms = self._docinfo.norms
+        results = {}
+        query_square = 0.0
+        for lemma_postings, times, idf in self._query_terms(lemmas):
+            query_weight = times * idf
+            query_square += query_weight * query_weight
+            for id, weight in izip(lemma_postings.ids, 
+                                   lemma_postings.weights):
+                results[id] = results.get(id, 0.0) + query_weight * weight
+        query_norm = sqrt(query_square)
+        for id, dot in results.iteritems():
+            norm = norms[id] * query_norm
+            if norm:
+                results[id] = dot / norm
+            else:
+                results[id] = 0.0
+        return _best(results, top_k)
+    
+    def _bm25_score(self, lemmas, top_k):
+        """
+        _bm25_score(self, lemmas, top_k): Same as _score(), the weight being
+        the page's Okapi BM25 score. A page's count of a lemma is worked out
+        from its tf-idf weight and length (see docinfo.py).
+        """
+        k1 = self._bm25_params[0]
+        lengths = self._docinfo.lengths
+        length_norms = self._bm25_length_norms()
+        num_docs = self._docinfo.num_docs
+        results = {}
+        for lemma_postings, times, idf in self._query_terms(lemmas):
+            df = len(lemma_postings)
+            bm25_idf = times * log((num_docs - df + 0.5) / (df + 0.5) + 1)
+            if idf <= 0:
+                # the lemma is in every page: its weights are all 0, so its
+                # counts can't be worked out and it only adds matches
+                for id in lemma_postings.ids:
+                    results[id] = results.get(id, 0.0)
+                continue
+            for id, weight in izip(lemma_postings.ids, 
+                                   lemma_postings.weights):
+                count = weight / idf * lengths[id]
+                results[id] = results.get(id, 0.0) + bm25_idf * \
+                              count * (k1 + 1) / (count + length_norms[id])
+        return _best(results, top_k)
+    
+    def _bm25_length_norms(self):
+        """
+        _bm25_length_norms(self): Return (and remember) k1 * (1 - b + b * 
+        length / average length) for every doc id.
+        """
+        if self._bm25_norms is None:
+            k1, b = self._bm25_params
+            average = self._docinfo.average_length or 1.0
+            self._bm25_norms = [k1 * (1 - b + b * length / average) 
+                                for length in self._docinfo.lengths]
+        return self._bm25_norms
+    
+    def set_scoring(self, mode='tfidf', k1=1.2, b=0.75):
+        """
+        set_scoring(self, mode='tfidf', k1=1.2, b=0.75): Rank pages by 
+        'mode': 'tfidf' (the sum of the lemmas' tf-idf weights), 'cosine' 
+        (cosine similarity of the tf-idf vectors) or 'bm25' (Okapi BM25, 
+        with parameters 'k1' and 'b'). 'cosine' and 'bm25' need the 
+        documents' norms and lengths (see load_docinfo()) and take the
+        place of proximity and NumPy scoring.
+        """
+        if mode not in SCORING_MODES:
+            raise ValueError('unknown scoring mode: ' + repr(mode))
+        if mode != 'tfidf' and self._docinfo is None:
+            raise NoDocInfoError
+        self._scoring = mode
+        self._bm25_params = (k1, b)
+        self._bm25_norms = None
+        self._results_changed()
+    
+    def load_docinfo(self, filename=None):
+        """
+        load_docinfo(self, filename=None): Load the documents' norms and 
+        lengths from 'filename' (default 'docinfo.bin'; see docinfo.py).
+        """
+        if filename is None:
+            filename = docinfo.DOCINFO_FILE
+        self.set_docinfo(docinfo.load_docinfo(filename))
+    
+    def set_docinfo(self, info):
+        """
+        set_docinfo(self, info): Use the docinfo.DocInfo 'info' (None to go
+        back to tf-idf scoring).
+        """
+        self._docinfo = info
+        self._bm25_norms = None
+        if info is None:
+            self._scoring = 'tfidf'
+        self._results_changed()
+    
+    def _top_k_query(self, lemmas, top_k):
+        """
+        _top_k_query(self, lemmas, top_k): Return the 'top_k' best 
+        (page id, weight) tuples for the query 'lemmas'.
+        """
+        # a lemma given twice counts twice
+        multiplicity = {}
+        for lemma in lemmas:
+            multiplicity[lemma] = multiplicity.get(lemma, 0) + 1
+        terms = []
+        for lemma, times in multiplicity.iteritems():
+            try:
+                terms.append((self._index[lemma], times))
+            except KeyError:
+                # 'lemma' was not in the index
+                continue
+        return pruning.max_score_top_k(terms, top_k)
     
-    def evaluate(self, queries, repeat=1):
+    def evaluate(self, queries, repeat=1, top_k=None):
         """
-        evaluate(self, queries, repeat=1): Run a series of queries 'repeat' 
-        times and return the average time. 'queries' is a list of lists 
-        containing strings. 
+        evaluate(self, queries, repeat=1, top_k=None): Run a series of 
+        queries 'repeat' times and return the average time. 'queries' is a 
+        list of lists containing strings. 
         
         Each list is a query and each string (inside the lists) is a lemma 
-        to search for.
+        to search for. 'top_k' is passed on to simple_query(). The result 
+        cache is bypassed, so every query is actually evaluated.
+
+        See benchmark.time_queries() for the latency percentiles and 
+        benchmark.py for the full benchmark.
         """
-        start = time.clock()
+        start = default_timer()
         for i in xrange(repeat):
             for query in queries:
-                self.simple_query(query)
-        stop = time.clock()
-        return (stop - start) / (len(queries) * repeat)
+                self.simple_query(query, top_k, use_cache=False)
+        stop = default_timer()
+        return (stop - start) / max(1, len(queries) * repeat)
     
-    def load_index_and_urls(self, index_file=None, urls_file=None):
+    def load_index_and_urls(self, index_file=None, urls_file=None,
+                            index_format=None):
         """
-        load_index(self, index_file=None, urls_file=None): Load the index
-        and urls from files.
+        load_index(self, index_file=None, urls_file=None, index_format=None):
+        Load the index and urls from files.
+        
+        'index_format' can be 'xml' or 'binary'. If it isn't given it will be
+        guessed from the index file's contents. A binary index is only 
+        memory-mapped; its postings are read when a query needs them.
+        The url map can be a url table ('urls.bin', memory-mapped too; see
+        url_table.py) or an old 'urls.pickle'; without 'urls_file' whichever
+        of them exists is loaded. The documents' norms and lengths are 
+        loaded too if there's a 'docinfo.bin' next to the index.
         """
         if index_file is None:
-            index_file = 'index.xml'
-        with open(index_file, 'r') as f:
-            self._index = save_and_load.load_index(f)
-        if urls_file is None:
-            urls_file = 'urls.pickle'
-        with open(urls_file, 'r') as f:
-            self._urls = pickle.load(f)
+            if index_format == 'binary':
+                index_file = 'index.bin'
+            else:
+                index_file = 'index.xml'
+        if index_format is None:
+            index_format = save_and_load.index_format(index_file)
+        if index_format == 'binary':
+            self._index = save_and_load.load_index_binary(index_file)
+        else:
+            with open(index_file, 'r') as f:
+                self._index = save_and_load.load_index(f)
+        self._urls = url_table.load_urls(urls_file)
+        self._set_docinfo_file(docinfo.docinfo_file(index_file))
+        self._invalidate_caches()
+    
+    def load_positional_index(self, filename=None):
+        """
+        load_positional_index(self, filename=None): Map the positional index
+        file 'filename' (default 'positions.bin'; see positional_index.py)
+        for phrase queries and proximity scoring.
+        """
+        if filename is None:
+            filename = positional_index.POSITIONS_FILE
+        self.set_positional_index(positional_index.PositionalIndex(filename))
     
-    def set_index_and_urls(self, index, urls):
+    def set_positional_index(self, index):
         """
-        set_index_and_urls(self, index, urls): Use an existing index
-        and url map.
+        set_positional_index(self, index): Use the positional index 'index'
+        (None to go back to plain tf-idf scoring).
         """
+        if self._positions is not None:
+            self._positions.close()
+        self._positions = index
+        self._results_changed()
+    
+    def _set_docinfo_file(self, filename):
+        """
+        _set_docinfo_file(self, filename): Use the docinfo file 'filename' if
+        it exists, or no norms and lengths if it doesn't.
+        """
+        if os.path.exists(filename):
+            self._docinfo = docinfo.load_docinfo(filename)
+        else:
+            self._docinfo = None
+            self._scoring = 'tfidf'
+        self._bm25_norms = None
+    
+    def set_index_and_urls(self, index, urls, info=None):
+        """
+        set_index_and_urls(self, index, urls, info=None): Use an existing 
+        index and url map, and the docinfo.DocInfo 'info' of its pages (for
+        cosine and BM25 scoring).
+        
+        If 'index' is a dict of {doc_id: weight} dicts, they are turned into
+        postings lists in place.
+        """
+        if isinstance(index, dict):
+            postings.freeze_index(index)
         self._index = index
         self._urls = urls
+        self._docinfo = info
+        self._bm25_norms = None
+        if info is None:
+            self._scoring = 'tfidf'
+        self._invalidate_caches()
+    
+    def use_incremental_index(self, index=None, urls=None):
+        """
+        use_incremental_index(self, index=None, urls=None): Switch to an
+        incremental_index.IncrementalIndex (a new, empty one by default), so
+        pages can be added and deleted with add_page() and delete_page()
+        while the search engine answers queries.
+        """
+        if index is None:
+            index = incremental_index.IncrementalIndex()
+        if urls is None:
+            urls = []
+        self.set_index_and_urls(index, urls)
+        return index
+    
+    def add_page(self, id, url, term_freqs):
+        """
+        add_page(self, id, url, term_freqs): Add page 'id' (at 'url', with 
+        the term frequencies 'term_freqs' - see vector_space.count_lemmas())
+        to the index, or re-index it if it's already there. Only works on 
+        an incremental index (see use_incremental_index()).
+        """
+        self._check_incremental()
+        if not isinstance(self._urls, list):
+            # a url table can't be changed
+            self._urls = list(self._urls)
+        while len(self._urls) <= id:
+            self._urls.append(None)
+        self._urls[id] = url
+        self._index.add_document(id, term_freqs)
+        self._results_changed()
+    
+    def delete_page(self, id):
+        """
+        delete_page(self, id): Delete page 'id' from the (incremental) 
+        index. Return False if it wasn't there.
+        """
+        self._check_incremental()
+        deleted = self._index.delete_document(id)
+        self._results_changed()
+        return deleted
+    
+    def _check_incremental(self):
+        if self._index is None:
+            raise NoIndexError
+        if not isinstance(self._index, incremental_index.IncrementalIndex):
+            raise TypeError('the search engine\'s index is not incremental')
+    
+    def _results_changed(self):
+        """
+        _results_changed(self): Forget cached query results after the index
+        changed. (the lemmas of cached queries are still good)
+        """
+        self._generation += 1
+        self._result_cache.clear()
+        self._dense = None
+        self._terms = None
     
-    def make_index_and_urls(self):
+    def _invalidate_caches(self):
+        """
+        _invalidate_caches(self): Forget all cached queries. (called every 
+        time a new index is swapped in)
         """
-        make_index_and_urls(self): Make an index and a url-map from scratch.
+        self._generation += 1
+        self._result_cache.clear()
+        self._lemma_cache.clear()
+        self._dense = None
+        self._terms = None
+    
+    def cache_stats(self):
+        """
+        cache_stats(self): Return a dict with the index generation and the 
+        sizes, hits and misses of the result and lemma caches.
+        """
+        return {'generation': self._generation,
+                'results': self._result_cache.stats(),
+                'lemmas': self._lemma_cache.stats()}
+    
+    def make_index_and_urls(self, streaming=False, publish_every=None):
+        """
+        make_index_and_urls(self, streaming=False, publish_every=None): Make
+        an index and a url-map from scratch.
+        
+        If 'streaming' == True, pages are indexed as they are crawled, 
+        without the 'html/', 'tokenized/' and 'tagged/' directories (see
+        pipeline.py). Then, if 'publish_every' is given, the search engine 
+        switches to an index of the pages so far every 'publish_every' 
+        pages, so it can answer queries (from another thread) long before 
+        the crawl ends.
         """
+        if streaming:
+            index, urls = pipeline.stream_index(
+                publish_every=publish_every, 
+                on_publish=self.set_index_and_urls)
+            self.set_index_and_urls(index, urls)
+            return
         c = crawler.Crawler()
         c.crawl()
         self._urls = c.get_page_urls()
+        manifest.make_manifest(urls=self._urls)
         preprocessor.clean_and_tokenize_all()
-        self._index = indexer.make_index(tagged=False)
+        self._index = indexer.make_index(tagged=False,
+                                         docinfo_file=docinfo.DOCINFO_FILE)
+        self._set_docinfo_file(docinfo.DOCINFO_FILE)
+        self._invalidate_caches()
 
@@ -0,0 +1,232 @@
+"""
+Answer queries with several processes, each owning a shard of the index.
+
+split_index() partitions a binary index by document (doc id modulo the
+number of shards) into one binary index file per shard. The weights keep
+the idfs of the whole corpus, so scores from different shards can be
+compared.
+
+ShardedSearchEngine starts a worker process per shard. Every worker maps
+its shard file (so the shards are shared through the page cache instead
+of being copied into every process) and answers with the top k documents
+of its shard; the coordinator sends each batch of queries to all the
+workers at once and merges their answers.
+"""
+
+import os
+import time
+import heapq
+import array
+import itertools
+import multiprocessing
+# modules I've written:
+import binary_index
+import pruning
+import preprocessor
+import morphosyntactic
+import lemmatizer
+import url_table
+import boolean_query
+
+
+def shard_files(index_file, num_shards):
+    """
+    shard_files(index_file, num_shards): Return the names of the shard
+    files of 'index_file' split in 'num_shards'.
+    """
+    return ['%s.%d-of-%d' % (index_file, shard, num_shards)
+            for shard in xrange(num_shards)]
+
+def split_index(index_file, num_shards):
+    """
+    split_index(index_file, num_shards): Split the binary index 'index_file'
+    into 'num_shards' binary index files (see shard_files()); document 'id'
+    goes to shard id % num_shards. Lemmas are read and written one at a
+    time. Return the shard files' names.
+    """
+    filenames = shard_files(index_file, num_shards)
+    files = [open(filename + '.tmp', 'wb') for filename in filenames]
+    try:
+        writers = [binary_index.BinaryIndexWriter(f) for f in files]
+        with binary_index.BinaryIndex(index_file) as index:
+            for lemma, postings in index.iteritems():
+                ids = [array.array('i') for shard in xrange(num_shards)]
+                weights = [array.array('f') for shard in xrange(num_shards)]
+                for id, weight in postings.iteritems():
+                    ids[id % num_shards].append(id)
+                    weights[id % num_shards].append(weight)
+                for shard in xrange(num_shards):
+                    if len(ids[shard]):
+                        writers[shard].add(lemma, ids[shard], weights[shard])
+        for writer in writers:
+            writer.close()
+    finally:
+        for f in files:
+            f.close()
+    for filename in filenames:
+        os.rename(filename + '.tmp', filename)
+    return filenames
+
+def _up_to_date(filenames, index_file):
+    """True if all 'filenames' exist and are newer than 'index_file'."""
+    mtime = os.path.getmtime(index_file)
+    for filename in filenames:
+        if not os.path.exists(filename) or os.path.getmtime(filename) < mtime:
+            return False
+    return True
+
+def score_ids(index, lemmas, top_k=None):
+    """
+    score_ids(index, lemmas, top_k=None): Score the documents of 'index'
+    matching 'lemmas' and return a list of (doc_id, score) tuples sorted by
+    score in descending order (ties go to the smaller doc id). If 'top_k'
+    is given only the 'top_k' best are returned (found with MaxScore).
+    """
+    # a lemma given twice counts twice
+    multiplicity = {}
+    for lemma in lemmas:
+        multiplicity[lemma] = multiplicity.get(lemma, 0) + 1
+    terms = []
+    for lemma, times in multiplicity.iteritems():
+        postings = index.get(lemma)
+        if postings is not None:
+            terms.append((postings, times))
+    if top_k is not None:
+        return pruning.max_score_top_k(terms, top_k)
+    scores = {}
+    for postings, times in terms:
+        for id, weight in postings.iteritems():
+            scores[id] = scores.get(id, 0.0) + times * weight
+    return sorted(scores.iteritems(), key=lambda (id, score): (-score, id))
+
+def _serve_shard(filename, connection):
+    """
+    A worker's main loop: answer (queries, top_k) requests on 'connection'
+    with a list of score_ids() results, until it receives None.
+    """
+    index = binary_index.BinaryIndex(filename)
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            queries, top_k = request
+            connection.send([score_ids(index, lemmas, top_k)
+                             for lemmas in queries])
+    finally:
+        index.close()
+        connection.close()
+
+
+class ShardedSearchEngine:
+    """
+    Answers queries like SimpleSearchEngine, with a worker process per shard
+    of a binary index.
+    """
+
+    def __init__(self, index_file='index.bin', urls_file=None,
+                 num_shards=None):
+        """
+        __init__(self, index_file='index.bin', urls_file=None,
+        num_shards=None): Split the binary index 'index_file' into
+        'num_shards' shards (default: one per CPU core), unless that was
+        already done, and start a worker for each.
+        """
+        if num_shards is None:
+            num_shards = multiprocessing.cpu_count()
+        self.num_shards = num_shards
+        filenames = shard_files(index_file, num_shards)
+        if not _up_to_date(filenames, index_file):
+            split_index(index_file, num_shards)
+        # see url_table.load_urls()
+        self._urls = url_table.load_urls(urls_file)
+        self._workers = []
+        self._connections = []
+        for filename in filenames:
+            parent_end, child_end = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_serve_shard,
+                                             args=(filename, child_end))
+            worker.daemon = True
+            worker.start()
+            child_end.close()
+            self._workers.append(worker)
+            self._connections.append(parent_end)
+
+    def close(self):
+        """close(self): Stop the workers."""
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except (IOError, EOFError):
+                pass
+        for worker in self._workers:
+            worker.join()
+        for connection in self._connections:
+            connection.close()
+        self._workers = []
+        self._connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def query_ids(self, queries, top_k=None):
+        """
+        query_ids(self, queries, top_k=None): Answer every query in 'queries'
+        (a list of lists of lemmas) and return a list with a list of
+        (doc_id, score) tuples for each. All shards work on the batch at the
+        same time.
+        """
+        for connection in self._connections:
+            connection.send((queries, top_k))
+        answers = [connection.recv() for connection in self._connections]
+        results = []
+        for i in xrange(len(queries)):
+            # every shard's list is already sorted, best first
+            merged = heapq.merge(*[[(-score, id) for id, score in answer[i]]
+                                   for answer in answers])
+            if top_k is not None:
+                merged = itertools.islice(merged, top_k)
+            results.append([(id, -negative_score)
+                            for negative_score, id in merged])
+        return results
+
+    def simple_query(self, lemmas, top_k=None):
+        """
+        simple_query(self, lemmas, top_k=None): Same as
+        SimpleSearchEngine.simple_query() (without the cache).
+        """
+        if len(lemmas) == 0:
+            return []
+        return [(self._urls[id], score) for id, score in
+                self.query_ids([lemmas], top_k)[0]]
+
+    def query(self, input, top_k=None):
+        """
+        query(self, input, top_k=None): Clean, tokenize and lemmatize the
+        string 'input' and make the query. Boolean queries (see 
+        boolean_query.py) aren't supported.
+        """
+        if boolean_query.is_boolean(input):
+            raise boolean_query.BooleanQueryError('boolean queries are not '
+                                                  'supported with shards')
+        query = preprocessor.clean_query(input)
+        return self.simple_query(lemmatizer.known_lemmas(
+            morphosyntactic.lemmatize_query(query)), top_k)
+
+    def evaluate(self, queries, repeat=1, top_k=None, batch_size=64):
+        """
+        evaluate(self, queries, repeat=1, top_k=None, batch_size=64): Run the
+        queries 'queries' (lists of lemmas) 'repeat' times, in batches of
+        'batch_size', and return the average time per query (wall clock
+        time, since the work is done by other processes).
+        """
+        queries = [query for query in queries if len(query)]
+        work = queries * repeat
+        start = time.time()
+        for i in xrange(0, len(work), batch_size):
+            self.query_ids(work[i:i + batch_size], top_k)
+        stop = time.time()
+        return (stop - start) / max(1, len(work))
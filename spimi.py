@@ -0,0 +1,219 @@
+"""
+Build a binary index of a corpus bigger than the memory (SPIMI, single-pass
+in-memory indexing).
+
+Documents are added to an in-memory block of {term: postings} until the
+block's estimated size reaches the memory limit. Then the block is sorted
+by term and written to disk as a run, and a new block is started. When all
+documents have been added the runs are merged (a k-way merge, reading
+every run one term at a time) straight into a binary index file (see
+binary_index.py), multiplying by the idfs on the way.
+
+Run files are made of one record per term, in sorted term order:
+
+    term length (uint32), term, number of postings (uint32),
+    doc ids (int32), term frequencies (float32)
+"""
+
+import os
+import sys
+import heapq
+import array
+import struct
+import resource
+import tempfile
+from math import log10
+# modules I've written:
+import binary_index
+import docinfo
+
+# rough sizes (in bytes) of the python objects a block is made of
+_POSTING_COST = 16          # one id and one tf in the term's arrays
+_TERM_COST = 200            # a term's string, arrays and dict entry
+
+_UINT = struct.Struct('<I')
+
+
+def peak_rss():
+    """
+    peak_rss(): Return the peak resident set size of this process (in
+    bytes) so far.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss              # already in bytes
+    return rss * 1024           # in kilobytes everywhere else
+
+def _write_run(block, filename):
+    """Write 'block' ({term: (ids, tfs)}) to run file 'filename'."""
+    with open(filename, 'wb') as f:
+        for term in sorted(block, key=binary_index._to_bytes):
+            ids, tfs = block[term]
+            if len(ids) > 1 and any(ids[i] > ids[i + 1]
+                                    for i in xrange(len(ids) - 1)):
+                pairs = sorted(zip(ids, tfs))
+                ids = array.array('i', [id for id, tf in pairs])
+                tfs = array.array('f', [tf for id, tf in pairs])
+            term = binary_index._to_bytes(term)
+            f.write(_UINT.pack(len(term)))
+            f.write(term)
+            f.write(_UINT.pack(len(ids)))
+            binary_index._write_array(f, 'i', ids)
+            binary_index._write_array(f, 'f', tfs)
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise IOError('run file \'' + f.name + '\' is truncated')
+    return data
+
+def iter_run(filename, run_number=0):
+    """
+    iter_run(filename, run_number=0): Yield (term, run_number, ids, tfs)
+    for every term in run file 'filename', in sorted order, reading one
+    term at a time.
+    """
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(_UINT.size)
+            if not data:
+                break
+            if len(data) != _UINT.size:
+                raise IOError('run file \'' + f.name + '\' is truncated')
+            term = _read_exactly(f, _UINT.unpack(data)[0])
+            count = _UINT.unpack(_read_exactly(f, _UINT.size))[0]
+            data = _read_exactly(f, 8 * count)
+            ids = binary_index._read_array(data, 'i', 0, count)
+            tfs = binary_index._read_array(data, 'f', 4 * count, count)
+            yield term, run_number, ids, tfs
+
+
+class BlockIndexBuilder:
+    """
+    Build a binary index one document at a time, using at most about
+    'memory_limit' bytes for the postings in memory.
+
+    Has the add_document() / get_num_docs() interface of
+    indexer.IndexBuilder; finish() writes the index to a file instead of
+    returning it.
+    """
+
+    def __init__(self, memory_limit=64 * 1024 * 1024, run_dir=None):
+        """
+        __init__(self, memory_limit=64 * 1024 * 1024, run_dir=None): Write a
+        run every time the block in memory takes about 'memory_limit'
+        bytes. Run files go to 'run_dir' (default: a temporary directory).
+        """
+        self._memory_limit = memory_limit
+        self._run_dir = run_dir
+        self._made_run_dir = False
+        self._runs = []
+        self._block = {}
+        self._block_size = 0
+        self._num_docs = 0
+        self._docinfo = docinfo.DocInfoBuilder()
+        self.doc_info = None
+        self.stats = {'runs': 0, 'postings': 0, 'peak_rss': 0}
+
+    def add_document(self, id, term_freqs, length):
+        """
+        add_document(self, id, term_freqs, length): Add document 'id' with
+        the term frequencies 'term_freqs' ({lemma: tf}) and 'length' lemmas.
+        """
+        block = self._block
+        for term, tf in term_freqs.iteritems():
+            postings = block.get(term)
+            if postings is None:
+                postings = block[term] = (array.array('i'), array.array('f'))
+                self._block_size += _TERM_COST + len(term)
+            postings[0].append(id)
+            postings[1].append(tf)
+            self._block_size += _POSTING_COST
+        self._docinfo.add_document(id, length)
+        self._num_docs += 1
+        self.stats['postings'] += len(term_freqs)
+        if self._block_size >= self._memory_limit:
+            self._flush()
+
+    def get_num_docs(self):
+        """get_num_docs(self): Return the number of documents added."""
+        return self._num_docs
+
+    def _flush(self):
+        """Write the block in memory to a new run file."""
+        if not self._block:
+            return
+        if self._run_dir is None:
+            self._run_dir = tempfile.mkdtemp(prefix='spimi-')
+            self._made_run_dir = True
+        elif not os.path.isdir(self._run_dir):
+            os.makedirs(self._run_dir)
+        filename = os.path.join(self._run_dir,
+                                'run%06d.bin' % len(self._runs))
+        _write_run(self._block, filename)
+        self._runs.append(filename)
+        self.stats['runs'] += 1
+        self.stats['peak_rss'] = max(self.stats['peak_rss'], peak_rss())
+        self._block = {}
+        self._block_size = 0
+
+    def finish(self, file):
+        """
+        finish(self, file): Merge the runs into a binary index, written to
+        'file' (a file object opened for writing in binary mode), and
+        delete the runs. Return self.stats (number of runs and postings,
+        and peak RSS in bytes). The documents' norms and lengths are left
+        in self.doc_info (see docinfo.py).
+        """
+        self._flush()
+        num_docs = float(self._num_docs)
+        writer = binary_index.BinaryIndexWriter(file)
+        merged = heapq.merge(*[iter_run(filename, i) for i, filename
+                               in enumerate(self._runs)])
+        term = None
+        parts = []
+        for entry in merged:
+            if entry[0] != term:
+                self._write_term(writer, term, parts, num_docs)
+                term = entry[0]
+                parts = []
+            parts.append(entry)
+        self._write_term(writer, term, parts, num_docs)
+        writer.close()
+        self._remove_runs()
+        self.doc_info = self._docinfo.finish()
+        self.stats['peak_rss'] = max(self.stats['peak_rss'], peak_rss())
+        return self.stats
+
+    def _write_term(self, writer, term, parts, num_docs):
+        """Add 'term''s postings (from the runs in 'parts') to the index."""
+        # gposttl's <unknown> lemma isn't indexed (see indexer.py)
+        if term is None or term == '<unknown>':
+            return
+        ids = array.array('i')
+        tfs = array.array('f')
+        # runs are in the order the documents were added, so this is
+        # sorted by id as long as the documents were added in id order
+        for t, run_number, run_ids, run_tfs in parts:
+            ids.extend(run_ids)
+            tfs.extend(run_tfs)
+        if len(parts) > 1 and any(ids[i] > ids[i + 1]
+                                  for i in xrange(len(ids) - 1)):
+            pairs = sorted(zip(ids, tfs))
+            ids = array.array('i', [id for id, tf in pairs])
+            tfs = array.array('f', [tf for id, tf in pairs])
+        # idf(term) = log10(N / df(term))
+        idf = log10(num_docs / len(ids))
+        weights = array.array('f', [tf * idf for tf in tfs])
+        writer.add(term, ids, weights)
+        self._docinfo.add_weights(ids, weights)
+
+    def _remove_runs(self):
+        for filename in self._runs:
+            if os.path.exists(filename):
+                os.remove(filename)
+        self._runs = []
+        if self._made_run_dir:
+            os.rmdir(self._run_dir)
+            self._run_dir = None
+            self._made_run_dir = False
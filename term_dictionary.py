@@ -0,0 +1,236 @@
+"""
+A sorted term dictionary for prefix, wildcard and fuzzy lemma lookup.
+
+    whal*       prefix: every lemma starting with 'whal'
+    wh?le       wildcard: '?' is any one character, '*' any number of them
+    whle~1      fuzzy: every lemma at most 1 edit (insertion, deletion or
+                substitution) away from 'whle'; 'whle~' means ~2
+
+The dictionary is the index's lemmas in sorted order. A binary index
+already keeps its lemma table sorted, so the dictionary just reads it
+through the mapped file; any other index has its lemmas sorted once into
+a list, which shares the lemma strings with the index.
+
+A prefix is a range of the sorted lemmas, found with two binary searches.
+A wildcard pattern only looks at the range of its literal prefix (the part
+before the first '*' or '?'). Fuzzy lookup walks the sorted lemmas as if
+they were a trie: lemmas sharing a prefix with the previous one reuse its
+rows of the edit distance table, and once no extension of a prefix can
+come within the distance (what a Levenshtein automaton would tell) all the
+lemmas starting with it are skipped with a binary search.
+
+A '?' at the end of a word is taken for a question mark, not a wildcard.
+"""
+
+import re
+import bisect
+
+# the largest edit distance fuzzy lookup allows
+MAX_DISTANCE = 2
+# the most lemmas a pattern expands into
+MAX_EXPANSIONS = 64
+
+_FUZZY_RE = re.compile(r'^([^~*?]+)~(\d?)$')
+
+
+class _LemmaTable:
+    """The sorted lemma table of a binary_index.BinaryIndex, as a sequence."""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        return self._index.lemma(i)
+
+
+def sorted_terms(index):
+    """
+    sorted_terms(index): Return the lemmas of 'index' as a sorted sequence:
+    a view of the lemma table of a binary index, a sorted list otherwise.
+    """
+    if hasattr(index, 'lemma'):
+        return _LemmaTable(index)
+    return sorted(index.iterkeys())
+
+def parse_pattern(word):
+    """
+    parse_pattern(word): Return ('prefix', prefix), ('wildcard', pattern) or
+    ('fuzzy', word, distance) if 'word' is a pattern (see above), None if
+    it's a plain word.
+    """
+    match = _FUZZY_RE.match(word)
+    if match is not None:
+        distance = MAX_DISTANCE
+        if match.group(2):
+            distance = min(int(match.group(2)), MAX_DISTANCE)
+        return ('fuzzy', match.group(1), distance)
+    if word.endswith('?'):
+        # a question mark
+        return None
+    if not word.strip('*?'):
+        return None
+    if '?' not in word and word.find('*') == len(word) - 1:
+        return ('prefix', word[:-1])
+    if '*' in word or '?' in word:
+        return ('wildcard', word)
+    return None
+
+def has_pattern(input):
+    """
+    has_pattern(input): True if a word of the query string 'input' is a
+    pattern.
+    """
+    for word in input.split():
+        if parse_pattern(word) is not None:
+            return True
+    return False
+
+def _prefix_end(prefix):
+    """
+    Return the smallest string that's larger than every string starting
+    with 'prefix' (None if there's none).
+    """
+    while prefix and prefix[-1] == '\xff':
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class TermDictionary:
+    """The lemmas of an index in sorted order, for pattern lookups."""
+
+    def __init__(self, terms):
+        """
+        __init__(self, terms): 'terms' is a sorted sequence of lemmas
+        (see sorted_terms()).
+        """
+        self._terms = terms
+
+    def __len__(self):
+        return len(self._terms)
+
+    def _range(self, prefix, low=0):
+        """Return the (start, end) positions of the lemmas with 'prefix'."""
+        terms = self._terms
+        start = bisect.bisect_left(terms, prefix, low)
+        end = _prefix_end(prefix)
+        if end is None:
+            return start, len(terms)
+        return start, bisect.bisect_left(terms, end, start)
+
+    def prefix(self, prefix, limit=None):
+        """
+        prefix(self, prefix, limit=None): Return the lemmas starting with
+        'prefix' in sorted order (the first 'limit' if 'limit' is given).
+        """
+        start, end = self._range(prefix)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [self._terms[i] for i in xrange(start, end)]
+
+    def wildcard(self, pattern, limit=None):
+        """
+        wildcard(self, pattern, limit=None): Return the lemmas matching
+        'pattern' ('?' is any character, '*' any number of them) in sorted
+        order (the first 'limit' if 'limit' is given).
+        """
+        literal = re.split(r'[*?]', pattern, 1)[0]
+        regex = re.compile(''.join([{'*': '.*', '?': '.'}.get(c, re.escape(c))
+                                    for c in pattern]) + '$', re.DOTALL)
+        start, end = self._range(literal)
+        matches = []
+        for i in xrange(start, end):
+            term = self._terms[i]
+            if regex.match(term):
+                matches.append(term)
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
+
+    def fuzzy(self, word, max_distance=1, limit=None):
+        """
+        fuzzy(self, word, max_distance=1, limit=None): Return (lemma,
+        distance) tuples for the lemmas at most 'max_distance' edits away
+        from 'word', closest first (ties in sorted order); the first
+        'limit' if 'limit' is given.
+        """
+        terms = self._terms
+        n = len(terms)
+        # rows[d] is the row of the edit distance table for the first d
+        # characters of 'previous'
+        rows = [range(len(word) + 1)]
+        previous = ''
+        matches = []
+        i = 0
+        while i < n:
+            term = terms[i]
+            common = 0
+            most = min(len(term), len(previous), len(rows) - 1)
+            while common < most and term[common] == previous[common]:
+                common += 1
+            del rows[common + 1:]
+            previous = term
+            skipped = False
+            for depth in xrange(common, len(term)):
+                c = term[depth]
+                above = rows[-1]
+                row = [above[0] + 1]
+                for j in xrange(1, len(word) + 1):
+                    row.append(min(row[j - 1] + 1, above[j] + 1,
+                                   above[j - 1] + (word[j - 1] != c)))
+                rows.append(row)
+                if min(row) > max_distance:
+                    # no lemma starting with term[:depth + 1] can match
+                    i = self._range(term[:depth + 1], i)[1]
+                    skipped = True
+                    break
+            if skipped:
+                continue
+            if rows[-1][-1] <= max_distance:
+                matches.append((term, rows[-1][-1]))
+            i += 1
+        matches.sort(key=lambda (term, distance): (distance, term))
+        if limit is not None:
+            return matches[:limit]
+        return matches
+
+    def expand(self, word, limit=MAX_EXPANSIONS):
+        """
+        expand(self, word, limit=MAX_EXPANSIONS): Return the lemmas the
+        pattern 'word' matches (at most 'limit'; the closest ones for a
+        fuzzy pattern), or None if 'word' isn't a pattern.
+        """
+        pattern = parse_pattern(word)
+        if pattern is None:
+            return None
+        if pattern[0] == 'prefix':
+            return self.prefix(pattern[1], limit)
+        if pattern[0] == 'wildcard':
+            return self.wildcard(pattern[1], limit)
+        return [term for term, distance in
+                self.fuzzy(pattern[1], pattern[2], limit)]
+
+
+def naive_fuzzy(terms, word, max_distance=1):
+    """
+    naive_fuzzy(terms, word, max_distance=1): Same as TermDictionary.fuzzy()
+    (without a limit), computing the edit distance of every lemma in
+    'terms'. Used to check fuzzy() and to compare its speed.
+    """
+    matches = []
+    for term in terms:
+        above = range(len(word) + 1)
+        for c in term:
+            row = [above[0] + 1]
+            for j in xrange(1, len(word) + 1):
+                row.append(min(row[j - 1] + 1, above[j] + 1,
+                               above[j - 1] + (word[j - 1] != c)))
+            above = row
+        if above[-1] <= max_distance:
+            matches.append((term, above[-1]))
+    matches.sort(key=lambda (term, distance): (distance, term))
+    return matches
@@ -0,0 +1,185 @@
+"""
+The id-to-url map as a compact string table, read through mmap.
+
+Layout of a url table file (all numbers little-endian):
+
+    header        magic, version, number of urls
+    offsets       one more than there are urls (uint32): where every url
+                  starts in the strings, and where the last one ends
+    strings       the urls, one after the other
+
+Opening a url table only maps the file and reads the header, however many
+urls there are; table[id] reads two offsets and slices the url out of the
+mapped file. Ids without a url (e.g. deleted pages) have an empty string
+and come back as None.
+
+load_urls() also reads the old 'urls.pickle' files, so both kinds of url
+map can be loaded the same way.
+"""
+
+import os
+import sys
+import mmap
+import pickle
+import struct
+import getopt
+# modules I've written:
+from binary_index import _to_bytes, _write_array
+
+MAGIC = 'SWSEURL\x00'
+VERSION = 1
+URLS_FILE = 'urls.bin'
+PICKLE_FILE = 'urls.pickle'
+
+_HEADER = struct.Struct('<8sII')
+_OFFSETS = struct.Struct('<II')
+
+
+class BadUrlTableError(Exception):
+    """Exception raised when a file is not a url table we can read."""
+
+    def __init__(self, filename, reason):
+        self.filename = filename
+        self.reason = reason
+
+    def __str__(self):
+        return 'File \'' + str(self.filename) + '\' is not a url table: ' + \
+               self.reason
+
+
+def write_url_table(urls, file):
+    """
+    write_url_table(urls, file): Write the list 'urls' (url of page id i at
+    position i, or None) as a url table to 'file', opened for writing in
+    binary mode.
+    """
+    offsets = [0]
+    strings = []
+    for url in urls:
+        url = _to_bytes(url or '')
+        strings.append(url)
+        offsets.append(offsets[-1] + len(url))
+    if offsets[-1] >= 1 << 32:
+        raise ValueError('a url table holds up to 4 GB of urls')
+    file.write(_HEADER.pack(MAGIC, VERSION, len(strings)))
+    _write_array(file, 'I', offsets)
+    file.write(''.join(strings))
+    file.flush()
+
+def save_url_table(urls, filename=URLS_FILE):
+    """
+    save_url_table(urls, filename=URLS_FILE): Save 'urls' as the url table
+    'filename' (written to a temporary file first, then renamed).
+    """
+    with open(filename + '.tmp', 'wb') as f:
+        write_url_table(urls, f)
+    os.rename(filename + '.tmp', filename)
+
+def is_url_table(filename):
+    """is_url_table(filename): True if 'filename' starts with MAGIC."""
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class UrlTable:
+    """
+    A read-only id-to-url map backed by a memory-mapped url table file.
+    Behaves like the list of urls the crawler makes.
+    """
+
+    def __init__(self, filename=URLS_FILE):
+        """__init__(self, filename=URLS_FILE): Map the url table 'filename'."""
+        self._filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # empty file
+            self._file.close()
+            raise BadUrlTableError(filename, 'file is empty')
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise BadUrlTableError(filename, 'file is too short')
+        magic, version, self._count = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise BadUrlTableError(filename, 'bad magic number')
+        if version != VERSION:
+            self.close()
+            raise BadUrlTableError(filename, 'unsupported version ' +
+                                   str(version))
+        self._strings_offset = _HEADER.size + 4 * (self._count + 1)
+
+    def close(self):
+        """close(self): Unmap and close the url table file."""
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, id):
+        if id < 0:
+            id += self._count
+        if not 0 <= id < self._count:
+            raise IndexError('url table index out of range')
+        start, end = _OFFSETS.unpack_from(self._map, _HEADER.size + 4 * id)
+        if start == end:
+            return None
+        return self._map[self._strings_offset + start:
+                         self._strings_offset + end]
+
+    def __iter__(self):
+        for id in xrange(self._count):
+            yield self[id]
+
+
+def load_urls(filename=None):
+    """
+    load_urls(filename=None): Return the id-to-url map in 'filename': a
+    UrlTable if it's a url table, the unpickled list if it's an old
+    'urls.pickle'. Without a filename, load URLS_FILE, or PICKLE_FILE if
+    there's only that.
+    """
+    if filename is None:
+        filename = URLS_FILE
+        if not os.path.exists(filename) and os.path.exists(PICKLE_FILE):
+            filename = PICKLE_FILE
+    if is_url_table(filename):
+        return UrlTable(filename)
+    with open(filename, 'r') as f:
+        return pickle.load(f)
+
+def main(argv):
+    """
+    Convert the url map 'urls.pickle' (or the file given with -i) to the
+    url table 'urls.bin' (or the file given with -o).
+    """
+    try:
+        opts, args = getopt.getopt(argv, 'i:o:', ['input=', 'output='])
+    except getopt.GetoptError:
+        sys.stderr.write('usage: url_table.py [-i urls.pickle] '
+                         '[-o urls.bin]\n')
+        return 2
+    input, output = PICKLE_FILE, URLS_FILE
+    for opt, arg in opts:
+        if opt in ('-i', '--input'):
+            input = arg
+        elif opt in ('-o', '--output'):
+            output = arg
+    with open(input, 'r') as f:
+        urls = pickle.load(f)
+    save_url_table(urls, output)
+    print 'Saved ' + str(len(urls)) + ' urls as \'' + output + '\''
+    return 0
+
+if __name__ == '__main__':
+    status = main(sys.argv[1:])
+    sys.exit(status)
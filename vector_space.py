@@ -2,11 +2,16 @@
 Subsystem #4: from webpages to the vector space model.
 
 Remove stop words from a tagged text and count every lemma's frequency.
+
+count_lemmas() and count_lemmas_in_file() do both in a single pass over
+the tagged lines, without building the filtered text in between.
 """
 
 import os
 import sys
 import pickle
+# modules I've written:
+import manifest
 
 _CLOSED_CLASS_CATEGORIES = ['CD', 'CC', 'DT', 'EX', 'IN', 'LS', 'MD', 'PDT',
                             'POS', 'PP', 'PP$', 'PRP', 'PRP$', 'RP', 'TO',
@@ -18,6 +23,21 @@ _OPEN_CLASS_CATEGORIES = ['JJ', 'JJR', 'JJS', 'RB', 'RBR', 'RBS', 'NN', 'NNS',
 _IS_CLOSED_CLASS = dict([(tag, True) for tag in _CLOSED_CLASS_CATEGORIES])
 _IS_CLOSED_CLASS.update([(tag, False) for tag in _OPEN_CLASS_CATEGORIES])
 
+def _is_closed_class(tag):
+    """True if 'tag' is a closed class category tag. (unknown tags aren't)"""
+    return _IS_CLOSED_CLASS.get(tag, False)
+
+def _open_class_lines(lines):
+    """Yield the lines (of the form 'word tag lemma') not tagged closed class."""
+    for line in lines:
+        try:
+            (word, tag, lemma) = line.split()
+        except ValueError:
+            # found a wrongly formatted line - ignore it
+            continue
+        if not _is_closed_class(tag):
+            yield line
+
 def remove_stopwords(text):
     """
     Remove words with a closed class category PoS tag and return the rest 
@@ -28,16 +48,8 @@ def remove_stopwords(text):
     (the lemma is optional)
     Lines with a closed class category tag are removed.
     """
-    output = ''
-    for line in text.splitlines():
-        try:
-            (word, tag, lemma) = line.split()
-        except ValueError:
-            # found a wrongly formatted line - ignore it
-            continue
-        if not _IS_CLOSED_CLASS[tag]:
-            output += line + '\n'
-    return output
+    return ''.join([line + '\n' for line in 
+                    _open_class_lines(text.splitlines())])
 
 def remove_stopwords_from_file(filename):
     """
@@ -49,46 +61,116 @@ def remove_stopwords_from_file(filename):
     (the lemma is optional)
     Lines with a closed class category tag are removed.
     """
-    output = ''
     with open(filename, 'r') as f:
-        for line in f:
-            try:
-                (word, tag, lemma) = line.split()
-            except ValueError:
-                # found a wrongly formatted line - ignore it
-                continue
-            if not _IS_CLOSED_CLASS[tag]:
-                output += line + '\n'
-    return output
+        return ''.join([line.rstrip('\n') + '\n' for line in 
+                        _open_class_lines(f)])
 
-def make_dict_of_lemmas(text):
+def _count_term_frequencies(lemmas):
     """
-    Return a dictionary with one entry for every lemma in 'text'.
-    key = lemma, value = lemma's frequency (tf)
-
-    'text' is a string with lines of the form:
-    word tag lemma
+    Count the lemmas in the iterable 'lemmas' and return a tuple 
+    ({lemma: tf}, number of lemmas), tf being the lemma's count divided by 
+    the number of lemmas.
     """
     d = {}
     word_count = 0
-    for line in text.splitlines():
-        try:
-            (word, tag, lemma) = line.split()
-        except ValueError:
-            # found a wrongly formatted line - ignore it
-            continue
+    for lemma in lemmas:
         d[lemma] = d.get(lemma, 0) + 1
         word_count += 1
     # now d[w] is w's term count - divide by 'word_count' 
     # to get the term frequency
     for lemma, term_count in d.iteritems():
         d[lemma] = term_count / float(word_count)
-    return d
+    return d, word_count
+
+def _term_frequencies(lemmas):
+    """
+    Count the lemmas in the iterable 'lemmas' and return a {lemma: tf} dict, 
+    tf being the lemma's count divided by the number of lemmas.
+    """
+    return _count_term_frequencies(lemmas)[0]
+
+def iter_lemmas(lines, remove_stopwords=True):
+    """
+    Yield the lemma of every line in 'lines' (an iterable of lines of the 
+    form 'word tag lemma', e.g. an open file). Wrongly formatted lines are 
+    skipped, and so are words with a closed class category tag if 
+    'remove_stopwords' == True.
+    """
+    for line in lines:
+        try:
+            (word, tag, lemma) = line.split()
+        except ValueError:
+            # found a wrongly formatted line - ignore it
+            continue
+        if remove_stopwords and _is_closed_class(tag):
+            continue
+        yield lemma
+
+def iter_word_positions(lines):
+    """
+    Yield (position, lemma, is_stop_word) for every word in 'lines' (an
+    iterable of lines of the form 'word tag lemma'). A word's position is
+    its number among the well formed lines, stop words included, so the
+    distance between two lemmas is the number of words between them.
+    """
+    position = 0
+    for line in lines:
+        try:
+            (word, tag, lemma) = line.split()
+        except ValueError:
+            # found a wrongly formatted line - ignore it
+            continue
+        yield position, lemma, _is_closed_class(tag)
+        position += 1
+
+def iter_lemma_positions(lines):
+    """
+    Yield (position, lemma) for every open class word in 'lines' (see 
+    iter_word_positions()). Words gposttl couldn't lemmatize ('<unknown>') 
+    are skipped, but still count as positions.
+    """
+    for position, lemma, is_stop_word in iter_word_positions(lines):
+        if not is_stop_word and lemma != '<unknown>':
+            yield position, lemma
+
+def count_lemmas(lines, with_length=False):
+    """
+    Remove stop words and count the lemmas in one pass. Return a dictionary 
+    with one entry for every remaining lemma.
+    key = lemma, value = lemma's frequency (tf)
+
+    'lines' is an iterable of lines of the form 'word tag lemma'. If 
+    'with_length' == True return a tuple (dictionary, number of lemmas 
+    counted), the number being the document's length.
+    """
+    if with_length:
+        return _count_term_frequencies(iter_lemmas(lines))
+    return _term_frequencies(iter_lemmas(lines))
+
+def count_lemmas_in_file(filename, with_length=False):
+    """
+    Same as count_lemmas(), for the lines of the tagged file 'filename'. The
+    file is read line by line.
+    """
+    with open(filename, 'r') as f:
+        return count_lemmas(f, with_length)
+
+def make_dict_of_lemmas(text):
+    """
+    Return a dictionary with one entry for every lemma in 'text'.
+    key = lemma, value = lemma's frequency (tf)
+
+    'text' is a string with lines of the form:
+    word tag lemma
+    """
+    return _term_frequencies(iter_lemmas(text.splitlines(), 
+                                         remove_stopwords=False))
 
 def main():
     """
     Remove stopwords and make a dictionary of lemma frequencies for files 
-    'tagged/0.txt' - 'tagged/999.txt'. The dictionary for file 'tagged/x.txt'
+    'tagged/0.txt', 'tagged/1.txt', ... (the documents in the corpus manifest,
+    see manifest.py). The dictionary for file 'tagged/x.txt'
     will be saved as 'vector_space/x.pickle' using the pickle module.
 
     If there were any arguments assume they are filenames and do all the above
@@ -99,11 +181,10 @@ def main():
     except OSError:
         pass
     if len(sys.argv) == 1:
-        # no arguments - take care of files 'tagged/0.txt' - 'tagged/999.txt'
-        for id in xrange(1000):
+        # no arguments - take care of files 'tagged/0.txt', 'tagged/1.txt', ...
+        for id in manifest.iter_doc_ids('tagged', '.txt'):
             print 'Processing \'tagged/' + str(id) + '.txt\' ... ',
-            text = remove_stopwords_from_file('tagged/' + str(id) + '.txt')
-            d = make_dict_of_lemmas(text)
+            d = count_lemmas_in_file('tagged/' + str(id) + '.txt')
             with open('vector_space/' + str(id) + '.pickle', 'w') as f:
                 pickle.dump(d, f)
             print '   done!'
@@ -113,8 +194,7 @@ def main():
         for filename in sys.argv[1:]:
             try:
                 print 'Processing \'' + filename + '\' ... ',
-                text = remove_stopwords_from_file(filename)
-                d = make_dict_of_lemmas(text)
+                d = count_lemmas_in_file(filename)
                 with open('vector_space/' + os.path.split(filename)[1] + \
                          '.pickle', 'w') as f:
                     pickle.dump(d, f)
@@ -0,0 +1,137 @@
+"""
+Compare the two ways vector_space can turn a tagged document into a
+{lemma: tf} dict:
+
+  two-pass    : remove_stopwords_from_file() builds the filtered text by
+                string concatenation (the way it used to), then
+                make_dict_of_lemmas() splits it up again
+  single-pass : count_lemmas_in_file() filters and counts the lines as it
+                reads them
+
+and report the time per document and the bytes of intermediate text built
+per document, for documents of growing size. (made-up documents in a
+temporary directory, or the tagged files given on the command line)
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import getopt
+import tempfile
+# modules I've written:
+import vector_space
+
+_OPEN_CLASS = [('house', 'NN', 'house'), ('houses', 'NNS', 'house'),
+               ('runs', 'VBZ', 'run'), ('running', 'VBG', 'run'),
+               ('quick', 'JJ', 'quick'), ('quickly', 'RB', 'quickly'),
+               ('search', 'NN', 'search'), ('engines', 'NNS', 'engine'),
+               ('indexed', 'VBN', 'index'), ('larger', 'JJR', 'large')]
+_CLOSED_CLASS = [('the', 'DT', 'the'), ('of', 'IN', 'of'), ('and', 'CC', 'and'),
+                 ('it', 'PRP', 'it'), ('to', 'TO', 'to'), ('.', '.', '.')]
+
+
+def _concatenating_remove_stopwords_from_file(filename):
+    """The old remove_stopwords_from_file(): one string += per kept line."""
+    output = ''
+    with open(filename, 'r') as f:
+        for line in f:
+            try:
+                (word, tag, lemma) = line.split()
+            except ValueError:
+                continue
+            if not vector_space._is_closed_class(tag):
+                output += line + '\n'
+    return output
+
+def two_pass(filename):
+    """Return ({lemma: tf}, bytes of intermediate text) the old way."""
+    text = _concatenating_remove_stopwords_from_file(filename)
+    return vector_space.make_dict_of_lemmas(text), len(text)
+
+def single_pass(filename):
+    """Return ({lemma: tf}, bytes of intermediate text) the new way."""
+    return vector_space.count_lemmas_in_file(filename), 0
+
+def make_document(filename, num_words, seed=0):
+    """Write a made-up tagged document of 'num_words' lines to 'filename'."""
+    rng = random.Random(seed)
+    with open(filename, 'w') as f:
+        for i in xrange(num_words):
+            if rng.random() < 0.4:
+                entry = rng.choice(_CLOSED_CLASS)
+            else:
+                word, tag, lemma = rng.choice(_OPEN_CLASS)
+                n = str(rng.randint(0, 500))
+                entry = (word + n, tag, lemma + n)
+            f.write('\t'.join(entry) + '\n')
+
+def measure(func, filename, repeat=5):
+    """
+    measure(func, filename, repeat=5): Run func(filename) 'repeat' times.
+    Return (best time in seconds, bytes of intermediate text, result).
+    """
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        result, intermediate = func(filename)
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, intermediate, result
+
+def report(filenames, repeat=5):
+    """Print both paths' time and intermediate bytes for every file."""
+    print '%10s %10s | %12s %12s | %12s %12s' % \
+          ('lines', 'bytes', 'two-pass ms', 'interm. B', 'single ms',
+           'interm. B')
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            num_lines = sum(1 for line in f)
+        old_time, old_bytes, old_result = measure(two_pass, filename, repeat)
+        new_time, new_bytes, new_result = measure(single_pass, filename,
+                                                  repeat)
+        if old_result != new_result:
+            print 'Warning: the two paths disagree on \'' + filename + '\''
+        print '%10d %10d | %12.2f %12d | %12.2f %12d' % \
+              (num_lines, os.path.getsize(filename), old_time * 1000,
+               old_bytes, new_time * 1000, new_bytes)
+
+def main(argv):
+    """
+    Benchmark the tagged files given as arguments, or made-up documents of
+    1000, 10000, ... up to '--words' words.
+    """
+    try:
+        opts, args = getopt.getopt(argv, 'w:r:', ['words=', 'repeat='])
+    except getopt.GetoptError:
+        sys.stderr.write('usage: vector_space_benchmark.py [-w max_words] '
+                         '[-r repeat] [tagged_file ...]\n')
+        return 2
+    max_words, repeat = 100000, 5
+    for opt, arg in opts:
+        if opt in ('-w', '--words'):
+            max_words = int(arg)
+        elif opt in ('-r', '--repeat'):
+            repeat = int(arg)
+    if args:
+        report(args, repeat)
+        return 0
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filenames = []
+        num_words = 1000
+        while num_words <= max_words:
+            filename = os.path.join(tmpdir, str(num_words) + '.txt')
+            make_document(filename, num_words)
+            filenames.append(filename)
+            num_words *= 10
+        report(filenames, repeat)
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == '__main__':
+    status = main(sys.argv[1:])
+    sys.exit(status)